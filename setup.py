@@ -96,7 +96,7 @@ setuptools.setup(
     install_requires=[
         'alembic>=0.8.3',
         'apscheduler>=3.3.1',
-        'Flask>=0.10.1',
+        'Flask>=0.12',
         'Flask-JWT>=0.3.1',
         'Flask-Migrate>=1.6.0',
         'Flask-Script>=2.0.5',
@@ -104,7 +104,7 @@ setuptools.setup(
         'flask-sqlalchemy-session>=1.1',
         'flask-redis>=0.1.0',
         'Flask-uWSGI-WebSocket>=0.5.2',
-        'Werkzeug>=0.10.4',
+        'Werkzeug>=0.12',
         'gevent>=1.1.1',
         'itsdangerous>=0.24',
         'Jinja2>=2.8',
@@ -115,6 +115,11 @@ setuptools.setup(
         'python-dateutil>=2.4.2',
         'python-editor>=0.4',
         'tmlibrary>=0.1.0'
-    ]
+    ],
+    extras_require={
+        'arrow': ['pyarrow>=0.4.0'],
+        'hdf5': ['h5py>=2.6.0'],
+        'zstd': ['zstandard>=0.7.0'],
+    }
 )
 
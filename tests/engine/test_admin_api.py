@@ -0,0 +1,36 @@
+import json
+
+from tmserver import cfg
+from tmserver.extensions import gc3pie
+from tmserver.extensions.gc3pie import GC3Pie
+
+
+def _set_admin_users(monkeypatch, names):
+    monkeypatch.setattr(
+        type(cfg), 'admin_users', property(lambda self: names)
+    )
+
+
+def test_engine_metrics_are_forbidden_for_other_users(rr, monkeypatch):
+    _set_admin_users(monkeypatch, [])
+    rv = rr.browser.get('/api/engine/metrics')
+    assert rv.status_code == 403
+
+
+def test_engine_metrics_of_admin(rr, monkeypatch):
+    _set_admin_users(monkeypatch, [rr.user.name])
+    monkeypatch.setattr(gc3pie, 'get_engine_metrics', lambda: {'cycles': 3})
+    rv = rr.browser.get('/api/engine/metrics')
+    assert rv.status_code == 200
+    assert json.loads(rv.data)['data'] == {'cycles': 3}
+
+
+def test_metrics_command_returns_metrics_of_engine():
+
+    class StubEngine(object):
+
+        def get_metrics(self):
+            return {'cycles': 1}
+
+    state = {'engine': StubEngine()}
+    assert GC3Pie()._handle_command(state, 'metrics') == {'cycles': 1}
@@ -0,0 +1,284 @@
+import datetime
+import time
+import threading
+import gevent
+import gc3libs
+import gc3libs.core
+
+from tmserver.extensions.gc3pie import GC3Pie
+from tmserver.extensions.gc3pie.engine import BgEngine
+from tmserver.extensions.gc3pie.ipc import (
+    EngineServer, EngineClient, HubDispatcher
+)
+
+
+class StubExecution(object):
+
+    def __init__(self, state):
+        self.state = state
+        self.exitcode = None
+
+
+class StubTask(object):
+
+    def __init__(self, persistent_id, state=gc3libs.Run.State.NEW,
+            tasks=[]):
+        self.persistent_id = persistent_id
+        self.execution = StubExecution(state)
+        self.tasks = list(tasks)
+
+
+class StubEngine(gc3libs.core.Engine):
+
+    """Engine that terminates all tasks upon progress."""
+
+    def __init__(self, progress_delay=0):
+        self._new = list()
+        self._in_flight = list()
+        self._stopped = list()
+        self._terminating = list()
+        self._terminated = list()
+        self.progress_delay = progress_delay
+        self.in_progress = False
+        self.removed = list()
+        self.killed = list()
+        self.redone = list()
+
+    def add(self, task):
+        self._new.append(task)
+
+    def remove(self, task):
+        for tasks in (self._new, self._in_flight, self._stopped,
+                self._terminating, self._terminated):
+            if task in tasks:
+                tasks.remove(task)
+                self.removed.append(task)
+                return
+        raise ValueError('Task is not managed by the engine.')
+
+    def progress(self):
+        self.in_progress = True
+        # Runs in a thread of the thread pool.
+        time.sleep(self.progress_delay)
+        for task in self._new:
+            task.execution.state = gc3libs.Run.State.TERMINATED
+        self.in_progress = False
+
+    def stats(self, only=None):
+        assert not self.in_progress
+        return {'NEW': len(self._new)}
+
+    def find_task_by_id(self, task_id):
+        assert not self.in_progress
+        for task in self._new + self._in_flight + self._terminated:
+            if task.persistent_id == task_id:
+                return task
+        raise KeyError(task_id)
+
+    def kill(self, task):
+        self.killed.append(task)
+
+    def redo(self, task, index):
+        self.redone.append((task, index))
+
+
+def test_progress_doesnt_block_other_greenlets():
+    engine = StubEngine(progress_delay=0.2)
+    bgengine = BgEngine('gevent', engine)
+    ticks = list()
+
+    def tick():
+        while True:
+            ticks.append(time.time())
+            gevent.sleep(0.01)
+
+    greenlet = gevent.spawn(tick)
+    bgengine._perform()
+    greenlet.kill()
+    assert len(ticks) > 5
+
+
+def test_engine_is_not_accessed_while_progress_runs():
+    engine = StubEngine(progress_delay=0.2)
+    bgengine = BgEngine('gevent', engine)
+    bgengine.add(StubTask(1))
+    greenlet = gevent.spawn(bgengine._perform)
+    gevent.sleep(0.05)
+    assert engine.in_progress
+    assert bgengine.stats() == {'NEW': 1}
+    greenlet.join()
+
+
+def test_only_tasks_whose_state_changed_are_reported():
+    engine = StubEngine()
+    bgengine = BgEngine('gevent', engine)
+    unchanged = StubTask(1, gc3libs.Run.State.RUNNING)
+    changed = StubTask(2, gc3libs.Run.State.NEW)
+    engine._in_flight.append(unchanged)
+    engine._new.append(changed)
+    states = {
+        id(task): (task, task.execution.state)
+        for task in bgengine._iter_active_tasks()
+    }
+    changed.execution.state = gc3libs.Run.State.SUBMITTED
+    # Tasks added during progress, e.g. subtasks of collections
+    added = StubTask(3)
+    engine._new.append(added)
+    assert bgengine._get_changed_tasks(states) == [changed, added]
+
+
+def test_terminated_tasks_are_removed_after_retention():
+    engine = StubEngine()
+    bgengine = BgEngine('gevent', engine)
+    bgengine.terminated_retention = 10
+    subtask = StubTask(2, gc3libs.Run.State.TERMINATED)
+    orphan = StubTask(3, gc3libs.Run.State.TERMINATED)
+    task = StubTask(1, gc3libs.Run.State.TERMINATED, [subtask, orphan])
+    # The orphan is not managed by the engine, such that removal fails.
+    engine._terminated.extend([task, subtask])
+    bgengine._roots[id(task)] = task
+    bgengine._remove_terminated_tasks()
+    assert engine.removed == []
+    bgengine._terminated_at[id(task)] -= 11
+    bgengine._remove_terminated_tasks()
+    assert set(engine.removed) == set([task, subtask])
+    assert engine._terminated == []
+    assert bgengine._roots == {}
+    assert bgengine.metrics.snapshot()['errors'] == {'remove': 1}
+
+
+def test_task_that_terminated_before_it_was_added_is_removed():
+    engine = StubEngine()
+    bgengine = BgEngine('gevent', engine)
+    bgengine.terminated_retention = 10
+    task = StubTask(1, gc3libs.Run.State.TERMINATED)
+    bgengine.add(task)
+    bgengine._perform()
+    assert id(task) in bgengine._terminated_at
+    bgengine._terminated_at[id(task)] -= 11
+    bgengine._perform()
+    assert engine.removed == [task]
+    assert bgengine._roots == {}
+    assert bgengine._terminated_at == {}
+
+
+def test_metrics_describe_cycles_and_tasks():
+    engine = StubEngine()
+    bgengine = BgEngine('gevent', engine)
+    bgengine.add(StubTask(1))
+    bgengine._perform()
+    metrics = bgengine.get_metrics()
+    assert metrics['cycles'] == 1
+    assert metrics['last_cycle']['queue_length'] == 1
+    assert metrics['last_cycle']['changed_tasks'] == 1
+    assert metrics['queue_length'] == 0
+    assert metrics['tasks'] == {'NEW': 1}
+
+
+def _get_interval(bgengine):
+    job = bgengine._scheduler.get_job('perform')
+    return job.trigger.interval.total_seconds()
+
+
+def test_interval_backs_off_while_idle():
+    engine = StubEngine()
+    bgengine = BgEngine('gevent', engine)
+    bgengine.start(1, 4)
+    try:
+        for expected in [2, 4, 4]:
+            bgengine._adapt_interval()
+            assert bgengine.interval == expected
+            assert _get_interval(bgengine) == expected
+        # Queued operations and new tasks make the engine busy again.
+        bgengine._q.append((engine.add, (StubTask(1), ), {}))
+        bgengine._adapt_interval()
+        assert bgengine.interval == 1
+        assert _get_interval(bgengine) == 1
+    finally:
+        bgengine.stop()
+
+
+def _get_next_run_time(bgengine):
+    return bgengine._scheduler.get_job('perform').next_run_time
+
+
+def _get_now(bgengine):
+    return datetime.datetime.now(bgengine._scheduler.timezone)
+
+
+def test_adding_task_wakes_up_main_loop():
+    engine = StubEngine()
+    bgengine = BgEngine('gevent', engine)
+    # Nothing to wake up before the engine is started.
+    bgengine.add(StubTask(1))
+    bgengine.start(60)
+    try:
+        assert _get_next_run_time(bgengine) > _get_now(bgengine)
+        bgengine.add(StubTask(2))
+        assert _get_next_run_time(bgengine) <= _get_now(bgengine)
+    finally:
+        bgengine.stop()
+
+
+def test_kill_doesnt_wait_for_progress():
+    engine = StubEngine(progress_delay=0.5)
+    bgengine = BgEngine('gevent', engine)
+    task = StubTask(1)
+    bgengine.add(task)
+    greenlet = gevent.spawn(bgengine._perform)
+    gevent.sleep(0.05)
+    assert engine.in_progress
+    start = time.time()
+    assert bgengine.kill_by_id(1)
+    assert not bgengine.kill_by_id(2)
+    assert time.time() - start < 0.1
+    greenlet.join()
+    assert engine.killed == []
+    bgengine._perform()
+    assert engine.killed == [task]
+
+
+def test_resubmitted_task_replaces_task_with_same_id():
+    engine = StubEngine()
+    bgengine = BgEngine('gevent', engine)
+    task = StubTask(1)
+    bgengine.add(task)
+    bgengine._perform()
+    reloaded = StubTask(1)
+    bgengine.resubmit(reloaded, 2)
+    assert bgengine._roots == {id(reloaded): reloaded}
+    bgengine._perform()
+    assert engine.removed == [task]
+    assert engine._new == [reloaded]
+    assert engine.redone == [(reloaded, 2)]
+
+
+def test_kill_command_is_answered_during_progress(tmpdir):
+    engine = StubEngine(progress_delay=0.5)
+    bgengine = BgEngine('gevent', engine)
+    bgengine.add(StubTask(1))
+    state = {'engine': bgengine, 'store': None}
+    filename = str(tmpdir.join('engine.sock'))
+    server = EngineServer(
+        filename,
+        lambda op, **params: GC3Pie()._handle_command(state, op, **params),
+        HubDispatcher()
+    )
+    server.start()
+    # The client gives up before the cycle of the main loop is done.
+    client = EngineClient(filename, timeout=0.2)
+    greenlet = gevent.spawn(bgengine._perform)
+    gevent.sleep(0.05)
+    results = list()
+
+    def kill():
+        results.append(client.call('kill', task_id=1))
+        results.append(client.call('kill', task_id=2))
+
+    thread = threading.Thread(target=kill)
+    thread.start()
+    while thread.is_alive():
+        gevent.sleep(0.01)
+    assert results == [True, False]
+    assert engine.in_progress
+    greenlet.join()
@@ -0,0 +1,53 @@
+import gevent
+import gc3libs
+
+from tmserver.extensions.gc3pie.events import TaskEventBroker, Submission
+
+
+class StubExecution(object):
+
+    def __init__(self, state):
+        self.state = state
+        self.exitcode = None
+
+
+class StubTask(object):
+
+    def __init__(self, persistent_id, submission_id):
+        self.persistent_id = persistent_id
+        self.submission_id = submission_id
+        self.jobname = 'task%d' % persistent_id
+        self.execution = StubExecution(gc3libs.Run.State.NEW)
+
+
+def test_submission_is_forgotten_once_its_tasks_terminated():
+    broker = TaskEventBroker()
+    broker._submissions[7] = Submission(1, 2, 'workflow')
+    queue = broker.subscribe(1)
+    tasks = [StubTask(1, 7), StubTask(2, 7)]
+    for task in tasks:
+        broker.on_progress(task)
+    tasks[0].execution.state = gc3libs.Run.State.TERMINATED
+    broker.on_progress(tasks[0])
+    assert 7 in broker._submissions
+    tasks[1].execution.state = gc3libs.Run.State.TERMINATED
+    broker.on_progress(tasks[1])
+    assert 7 not in broker._submissions
+    assert not broker._states
+    assert queue.qsize() == 4
+    event = queue.get_nowait()
+    assert event['program'] == 'workflow'
+    assert event['old_state'] is None
+
+
+def test_waiting_for_events_doesnt_block_other_greenlets():
+    broker = TaskEventBroker()
+    queue = broker.subscribe(1)
+    waiting = gevent.spawn(queue.get, timeout=5)
+    gevent.sleep(0.1)
+    # The hub keeps running greenlets while the subscriber waits.
+    assert not waiting.ready()
+    broker.publish(1, {'state': 'RUNNING'})
+    assert waiting.get(timeout=1) == {'state': 'RUNNING'}
+    broker.unsubscribe(1, queue)
+    assert not broker._subscribers
@@ -0,0 +1,45 @@
+import threading
+import gevent
+import pytest
+from gevent.monkey import get_original
+
+from tmserver.extensions.gc3pie.ipc import EngineLock, HubDispatcher
+
+
+def _run_in_thread(fn):
+    thread = threading.Thread(target=fn)
+    thread.start()
+    while thread.is_alive():
+        gevent.sleep(0.01)
+
+
+def test_engine_lock_is_held_by_one_owner(tmpdir):
+    filename = str(tmpdir.join('engine.lock'))
+    lock = EngineLock(filename)
+    assert lock.acquire()
+    assert lock.is_acquired
+    assert not EngineLock(filename).acquire()
+
+
+def test_dispatcher_runs_calls_of_other_threads_in_hub_thread():
+    get_ident = get_original('thread', 'get_ident')
+    dispatcher = HubDispatcher()
+    results = list()
+    _run_in_thread(lambda: results.append(dispatcher.call(get_ident)))
+    assert results == [get_ident()]
+
+
+def test_dispatcher_raises_errors_in_calling_thread():
+    dispatcher = HubDispatcher()
+    errors = list()
+
+    def fail():
+        raise ValueError('test')
+
+    def call():
+        with pytest.raises(ValueError):
+            dispatcher.call(fail)
+        errors.append(True)
+
+    _run_in_thread(call)
+    assert errors == [True]
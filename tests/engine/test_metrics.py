@@ -0,0 +1,31 @@
+from tmserver.extensions.gc3pie.metrics import EngineMetrics, HISTOGRAM_BUCKETS
+
+
+def test_snapshot_without_cycles():
+    snapshot = EngineMetrics().snapshot()
+    assert snapshot['cycles'] == 0
+    assert snapshot['last_cycle'] is None
+    assert snapshot['durations']['total']['mean'] is None
+    assert sum(snapshot['histogram']['counts']) == 0
+
+
+def test_only_most_recent_cycles_are_summarized():
+    metrics = EngineMetrics(window=2)
+    for total in [100.0, 0.001, 1000.0]:
+        metrics.record_cycle(0, {'total': total}, 0, 0)
+    snapshot = metrics.snapshot()
+    assert snapshot['cycles'] == 3
+    assert snapshot['window'] == 2
+    assert snapshot['durations']['total']['max'] == 1000.0
+    counts = snapshot['histogram']['counts']
+    assert len(counts) == len(HISTOGRAM_BUCKETS) + 1
+    assert counts[0] == 1
+    assert counts[-1] == 1
+
+
+def test_errors_are_counted_by_operation():
+    metrics = EngineMetrics()
+    metrics.record_error('submit')
+    metrics.record_error('submit')
+    metrics.record_error('progress')
+    assert metrics.snapshot()['errors'] == {'submit': 2, 'progress': 1}
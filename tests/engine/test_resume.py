@@ -0,0 +1,37 @@
+import contextlib
+
+import mock
+import tmlib.models as tm
+
+from tmserver.extensions.gc3pie import GC3Pie
+
+
+class StubStore(object):
+
+    def __init__(self, task_ids):
+        self.task_ids = task_ids
+
+    def load(self, task_id):
+        if task_id not in self.task_ids:
+            raise KeyError(task_id)
+        return task_id
+
+
+def test_only_most_recent_submissions_are_resumed(monkeypatch):
+    latest = mock.Mock()
+    latest.group_by.return_value.all.return_value = [(3, ), (5, ), (6, )]
+    unfinished = mock.Mock()
+    unfinished.join.return_value.filter.return_value.all.return_value = [
+        (2, 20), (3, 30), (5, 50), (6, 60)
+    ]
+    session = mock.Mock()
+    session.query.side_effect = [latest, unfinished]
+
+    @contextlib.contextmanager
+    def create_session():
+        yield session
+
+    monkeypatch.setattr(tm.utils, 'MainSession', create_session)
+    # Submission 2 was superseded and task 60 can't be loaded.
+    store = StubStore([20, 30, 50])
+    assert GC3Pie()._load_unfinished_tasks(store) == [30, 50]
@@ -0,0 +1,88 @@
+import time
+import gc3libs
+
+from tmserver.extensions.gc3pie.store import BatchingStore, FULL_SAVE_INTERVAL
+
+
+class StubExecution(object):
+
+    def __init__(self, state):
+        self.state = state
+        self.exitcode = None
+
+
+class StubTask(object):
+
+    def __init__(self, persistent_id, state=gc3libs.Run.State.RUNNING,
+            tasks=[]):
+        self.persistent_id = persistent_id
+        self.execution = StubExecution(state)
+        self.tasks = list(tasks)
+
+
+class StubStore(object):
+
+    def __init__(self):
+        self.saved = list()
+
+    def save(self, task):
+        self.saved.append(task)
+        return task.persistent_id
+
+
+def _create_store():
+    store = BatchingStore(StubStore())
+    store.updated = list()
+    store._update_states = lambda mappings: store.updated.extend(
+        [m['id'] for m in mappings]
+    )
+    return store
+
+
+def test_state_of_recently_saved_tasks_is_updated_in_batch():
+    store = _create_store()
+    task = StubTask(1)
+    store.save(task)
+    assert store._store.saved == [task]
+    with store.batch():
+        store.save(task)
+        assert store.updated == []
+    assert store.updated == [1]
+    assert store._store.saved == [task]
+
+
+def test_terminated_tasks_are_saved_with_their_subtasks():
+    store = _create_store()
+    subtask = StubTask(2, gc3libs.Run.State.TERMINATED)
+    task = StubTask(1, gc3libs.Run.State.TERMINATED, [subtask])
+    with store.batch():
+        store.save(subtask)
+        store.save(task)
+    # The subtask is saved together with its parent.
+    assert store._store.saved == [task]
+    assert store.updated == []
+
+
+def test_outdated_tasks_are_saved_after_interval_without_changes():
+    store = _create_store()
+    task = StubTask(1)
+    store.save(task)
+    with store.batch():
+        store.save(task)
+    store._saved_at[1] = time.time() - FULL_SAVE_INTERVAL - 1
+    store.flush()
+    assert store._store.saved == [task, task]
+    store.flush()
+    assert store._store.saved == [task, task]
+
+
+def test_discarded_tasks_are_not_saved():
+    store = _create_store()
+    task = StubTask(1)
+    store.save(task)
+    with store.batch():
+        store.save(task)
+    # The task was resubmitted and replaced by a newly loaded object.
+    store.discard(task)
+    store.flush(full=True)
+    assert store._store.saved == [task]
@@ -0,0 +1,84 @@
+import flask
+import pytest
+
+from tmserver.extensions.gc3pie import GC3Pie, _LRUCache
+
+
+class StubTask(object):
+
+    def __init__(self, persistent_id, tasks=[]):
+        self.persistent_id = persistent_id
+        self.jobname = 'job_%d' % persistent_id
+        self.output_dir = '/tmp/job_%d' % persistent_id
+        self.stdout = 'stdout.log'
+        self.stderr = 'stderr.log'
+        self.tasks = list(tasks)
+
+
+class StubStore(object):
+
+    def __init__(self, tasks):
+        self.tasks = {t.persistent_id: t for t in tasks}
+        self.loaded = list()
+
+    def load(self, task_id):
+        self.loaded.append(task_id)
+        return self.tasks[task_id]
+
+
+class StubEngine(object):
+
+    def find_task_by_id(self, task_id):
+        raise KeyError(task_id)
+
+    def add(self, task):
+        pass
+
+    def redo(self, task, index):
+        pass
+
+
+@pytest.yield_fixture
+def state():
+    app = flask.Flask(__name__)
+    subtask = StubTask(2)
+    state = {
+        'engine': StubEngine(),
+        'store': StubStore([StubTask(1, [subtask]), subtask]),
+        'task_info': _LRUCache(10)
+    }
+    app.extensions['gc3pie'] = state
+    with app.app_context():
+        yield state
+
+
+def test_least_recently_used_items_are_evicted():
+    cache = _LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    cache.discard('a')
+    cache.discard('x')
+    assert cache.get('a') is None
+
+
+def test_log_info_is_loaded_once(state):
+    gc3pie = GC3Pie()
+    info = gc3pie.retrieve_task_log_info(2)
+    assert info.jobname == 'job_2'
+    assert gc3pie.retrieve_task_log_info(2) == info
+    assert state['store'].loaded == [2]
+
+
+def test_resubmission_invalidates_log_info_of_subtasks(state):
+    gc3pie = GC3Pie()
+    gc3pie.retrieve_task_log_info(1)
+    gc3pie.retrieve_task_log_info(2)
+    gc3pie.resubmit_task(state['store'].tasks[1])
+    gc3pie.retrieve_task_log_info(2)
+    gc3pie.retrieve_task_log_info(1)
+    assert state['store'].loaded == [1, 2, 2, 1]
@@ -0,0 +1,54 @@
+import numpy as np
+
+from tmserver.export.borders import (
+    BorderIndex, compute_border_labels, get_border_mapobject_ids
+)
+
+
+def test_objects_touching_image_edge_are_border_objects():
+    array = np.zeros((5, 5), dtype=np.int32)
+    array[0, 1] = 1
+    array[2, 2] = 2
+    array[3:5, 3] = 3
+    assert compute_border_labels(array).tolist() == [1, 3]
+
+
+def test_border_labels_roundtrip(tmpdir):
+    index = BorderIndex(str(tmpdir))
+    index.store(1, 2, 3, [1, 3, 12], 100)
+    assert index.load(1, 2, 3, 100) == set([1, 3, 12])
+    # Segmentations were recreated in the meantime.
+    assert index.load(1, 2, 3, 200) is None
+    assert index.load(1, 2, 4, 100) is None
+
+
+def test_filtered_export_doesnt_replace_border_status_of_site(tmpdir):
+    index = BorderIndex(str(tmpdir))
+    # ID, label and segmentation layer ID of objects; objects 10 and 12 lie
+    # at the border.
+    mapobjects = [(10, 1, 5), (11, 2, 5), (12, 3, 5)]
+    max_mapobject_ids = {5: 12}
+    computed = list()
+
+    def compute(mapobject_ids):
+        computed.append(mapobject_ids)
+        return [i for i in mapobject_ids if i in (10, 12)]
+
+    border_ids = get_border_mapobject_ids(
+        index, 1, 2, mapobjects[:2], max_mapobject_ids, compute, False
+    )
+    assert border_ids == set([10])
+    assert index.load(1, 5, 2, 12) is None
+
+    border_ids = get_border_mapobject_ids(
+        index, 1, 2, mapobjects, max_mapobject_ids, compute, True
+    )
+    assert border_ids == set([10, 12])
+    assert index.load(1, 5, 2, 12) == set([1, 3])
+
+    # Subsequent exports use the stored status.
+    border_ids = get_border_mapobject_ids(
+        index, 1, 2, mapobjects[1:], max_mapobject_ids, compute, False
+    )
+    assert border_ids == set([12])
+    assert len(computed) == 2
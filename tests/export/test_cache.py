@@ -0,0 +1,61 @@
+import os
+import time
+
+from tmserver.export.cache import ExportCache
+
+
+def test_export_is_cached_once_stream_is_complete(tmpdir):
+    cache = ExportCache(str(tmpdir), 1024, 3600)
+    key = cache.create_key('features', 1, cache.get_data_version(1))
+    stream = cache.stream(key, iter(['a,b\r\n', '1,2\r\n']))
+    assert next(stream) == 'a,b\r\n'
+    assert cache.get(key) is None
+    assert list(stream) == ['1,2\r\n']
+    with open(cache.get(key)) as f:
+        assert f.read() == 'a,b\r\n1,2\r\n'
+
+
+def test_updated_data_version_changes_key(tmpdir):
+    cache = ExportCache(str(tmpdir), 1024, 3600)
+    version = cache.get_data_version(1)
+    assert cache.get_data_version(1) == version
+    cache.update_data_version(1)
+    assert cache.get_data_version(1) != version
+
+
+def test_least_recently_used_exports_are_evicted(tmpdir):
+    cache = ExportCache(str(tmpdir), 10, 3600)
+    cache.materialize('a', iter(['x' * 6]))
+    cache.materialize('b', iter(['x' * 6]))
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
+
+
+def test_use_of_export_doesnt_change_modification_time(tmpdir):
+    cache = ExportCache(str(tmpdir), 20, 3600)
+    path = cache.materialize('a', iter(['x' * 6]))
+    os.utime(path, (1000, time.time() - 60))
+    mtime = os.path.getmtime(path)
+    assert cache.get('a') == path
+    assert os.path.getmtime(path) == mtime
+    assert os.path.getatime(path) > mtime
+
+
+def test_exports_expire_after_creation_despite_use(tmpdir):
+    cache = ExportCache(str(tmpdir), 20, 3600)
+    path = cache.materialize('a', iter(['x' * 6]))
+    os.utime(path, (time.time(), time.time() - 3601))
+    assert cache.get('a') is None
+
+
+def test_recently_used_exports_are_kept(tmpdir):
+    cache = ExportCache(str(tmpdir), 15, 3600)
+    now = time.time()
+    for i, key in enumerate(['a', 'b']):
+        path = cache.materialize(key, iter(['x' * 6]))
+        os.utime(path, (now - 10 + i, now - 10 + i))
+    assert cache.get('a') is not None
+    cache.materialize('c', iter(['x' * 6]))
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
@@ -0,0 +1,23 @@
+import zlib
+
+import pytest
+
+from tmserver.export.compression import compress_stream
+
+
+def test_gzip_stream_can_be_decompressed_chunk_by_chunk():
+    chunks = ['a,b,c\r\n', '1,2,3\r\n' * 100, '4,5,6\r\n']
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    compressed = compress_stream(iter(chunks), 'gzip', 6)
+    for chunk in chunks:
+        # Each chunk must be flushed, such that the client can decompress it
+        # before the stream is complete.
+        assert decompressor.decompress(next(compressed)) == chunk
+    data = ''.join(compressed)
+    assert decompressor.decompress(data) == ''
+    assert decompressor.unused_data == ''
+
+
+def test_unsupported_encoding():
+    with pytest.raises(ValueError):
+        compress_stream(iter(['a']), 'br', 6)
@@ -0,0 +1,60 @@
+import io
+import zipfile
+
+import numpy as np
+import pytest
+
+from tmserver.export import formats
+from tmserver.export.formats import (
+    CSVWriter, NPZWriter, get_table_writer_class, stream_table
+)
+
+
+def test_csv_table_matches_database_representation():
+    writer = CSVWriter(['Area', 'Intensity'])
+    chunks = [([1, 2], [['10', '0.5'], ['nan', '0.25']]), ([], [])]
+    table = ''.join(stream_table(writer, chunks))
+    assert table == 'Area,Intensity\r\n10,0.5\r\nnan,0.25\r\n'
+
+
+def test_npz_table_roundtrip():
+    writer = NPZWriter(['Area', 'Intensity'])
+    chunks = [
+        ([3, 1], [['10', '0.5'], ['nan', '0.25']]),
+        ([7], [['12', '1e-20']])
+    ]
+    data = ''.join(stream_table(writer, chunks))
+    zf = zipfile.ZipFile(io.BytesIO(data))
+    assert all(
+        info.compress_type == zipfile.ZIP_STORED for info in zf.infolist()
+    )
+    table = np.load(io.BytesIO(data))
+    assert table['mapobject_id'].tolist() == [3, 1, 7]
+    assert list(table['columns']) == ['Area', 'Intensity']
+    values = table['values']
+    assert values.shape == (3, 2)
+    assert np.isnan(values[1, 0])
+    assert values[2, 1] == 1e-20
+
+
+def test_unknown_table_format():
+    with pytest.raises(ValueError):
+        get_table_writer_class('xlsx')
+
+
+def test_csv_table_with_metadata():
+    writer = CSVWriter(['Area'], [('well_name', 'str'), ('label', 'int')])
+    chunks = [([1, 2], [['10'], ['12']], [['A01', 1], ['A01', 2]])]
+    table = ''.join(stream_table(writer, chunks))
+    assert table == 'well_name,label,Area\r\nA01,1,10\r\nA01,2,12\r\n'
+
+
+def test_metadata_not_supported_by_npz():
+    with pytest.raises(ValueError):
+        NPZWriter(['Area'], [('well_name', 'str')])
+
+
+def test_unavailable_format_is_rejected_before_streaming(monkeypatch):
+    monkeypatch.setattr(formats, 'h5py', None)
+    with pytest.raises(ValueError):
+        get_table_writer_class('hdf5')
@@ -0,0 +1,42 @@
+import pytest
+
+from tmserver.export.partition import map_partitions
+
+
+def test_results_are_yielded_in_order_of_partitions():
+    def read(pid):
+        return pid * 10
+    results = list(map_partitions(read, [3, 1, 2, 0], max_workers=3))
+    assert results == [30, 10, 20, 0]
+
+
+def test_partitions_are_read_ahead_up_to_limit():
+    scheduled = []
+
+    def partition_ids():
+        for pid in range(10):
+            scheduled.append(pid)
+            yield pid
+
+    results = map_partitions(
+        lambda pid: pid, partition_ids(), max_workers=1, max_pending=2
+    )
+    assert next(results) == 0
+    # One partition is scheduled for each consumed result, such that no
+    # more than two partitions are pending at any time.
+    assert scheduled == [0, 1, 2]
+    assert list(results) == list(range(1, 10))
+    assert scheduled == list(range(10))
+
+
+def test_errors_of_workers_are_raised_to_consumer():
+    def read(pid):
+        if pid == 2:
+            raise ValueError('partition %d is broken' % pid)
+        return pid
+
+    results = map_partitions(read, range(5), max_workers=2)
+    assert next(results) == 0
+    assert next(results) == 1
+    with pytest.raises(ValueError):
+        next(results)
@@ -0,0 +1,101 @@
+import flask
+import mock
+
+from tmserver.api import feature
+from tmserver.api.feature import _send_cached_file
+from tmserver.export.cache import ExportCache
+
+
+def _send(app, path, key, headers=None):
+    with app.test_request_context('/', headers=headers):
+        return _send_cached_file(
+            path, key, 'text/csv', as_attachment=True,
+            attachment_filename='table.csv'
+        )
+
+
+def test_cached_export_is_private_and_validated_by_key(tmpdir):
+    app = flask.Flask(__name__)
+    cache = ExportCache(str(tmpdir), 1024, 3600)
+    key = cache.create_key('features', 1)
+    path = cache.materialize(key, iter(['a,b\r\n', '1,2\r\n']))
+    response = _send(app, path, key)
+    assert response.status_code == 200
+    assert response.get_etag() == (key, False)
+    assert response.cache_control.private
+    assert response.cache_control.no_cache
+    assert not response.cache_control.public
+    assert response.cache_control.max_age in (None, 0)
+
+
+def test_cached_export_can_be_resumed_and_revalidated(tmpdir):
+    app = flask.Flask(__name__)
+    cache = ExportCache(str(tmpdir), 1024, 3600)
+    key = cache.create_key('features', 1)
+    path = cache.materialize(key, iter(['a,b\r\n', '1,2\r\n']))
+    etag = '"%s"' % key
+    # Using the cached export must not change its validators.
+    assert cache.get(key) == path
+    response = _send(
+        app, path, key, {'Range': 'bytes=5-', 'If-Range': etag}
+    )
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == 'bytes 5-9/10'
+    response = _send(app, path, key, {'If-None-Match': etag})
+    assert response.status_code == 304
+    response = _send(
+        app, path, 'other', {'Range': 'bytes=5-', 'If-Range': etag}
+    )
+    assert response.status_code == 200
+
+
+def test_cached_json_is_private_and_computed_once(tmpdir, monkeypatch):
+    app = flask.Flask(__name__)
+    cache = ExportCache(str(tmpdir), 1024, 3600)
+    monkeypatch.setattr(feature, 'get_export_cache', lambda: cache)
+    calls = list()
+
+    def compute():
+        calls.append(1)
+        return [{'well': 'A01', 'mean': 1.5}]
+
+    key = cache.create_key('statistics', 1)
+    for i in range(2):
+        with app.test_request_context('/'):
+            response = feature._create_cached_json_response(key, compute)
+        assert response.status_code == 200
+        assert response.get_etag() == (key, False)
+        assert response.cache_control.no_cache
+        assert not response.cache_control.public
+    assert len(calls) == 1
+    headers = {'If-None-Match': '"%s"' % key}
+    with app.test_request_context('/', headers=headers):
+        response = feature._create_cached_json_response(key, compute)
+    assert response.status_code == 304
+
+
+def test_cached_histogram_is_revalidated_after_data_changed(tmpdir,
+        monkeypatch):
+    app = flask.Flask(__name__)
+    cache = ExportCache(str(tmpdir), 1024, 3600)
+    monkeypatch.setattr(feature, 'get_export_cache', lambda: cache)
+    session = mock.Mock()
+    session.query.return_value.filter_by.return_value.scalar.return_value = 9
+    counts = iter([[1, 2], [3, 4]])
+    url = '/feature-histogram?features=Area&bins=2'
+
+    def request_histogram(headers=None):
+        with app.test_request_context(url, headers=headers):
+            key = feature._get_export_cache_key(session, 1, 2, ['5'])
+            return feature._create_cached_json_response(
+                key, lambda: {'counts': next(counts)}
+            )
+
+    response = request_histogram()
+    etag = response.headers['ETag']
+    assert request_histogram({'If-None-Match': etag}).status_code == 304
+    cache.update_data_version(1)
+    response = request_histogram({'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+    assert response.cache_control.no_cache
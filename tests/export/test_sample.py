@@ -0,0 +1,53 @@
+import collections
+
+import mock
+from sqlalchemy import column, Integer
+from sqlalchemy.dialects import postgresql
+
+from tmserver.api.feature import (
+    _group_partitions, _get_sample_order, _get_feature_values_of_mapobjects
+)
+
+Partition = collections.namedtuple(
+    'Partition', ['id', 'plate_name', 'well_name']
+)
+
+
+def _compile(expression):
+    compiled = expression.compile(dialect=postgresql.dialect())
+    return str(compiled), compiled.params
+
+
+def test_partitions_are_grouped_into_strata():
+    partitions = [
+        Partition(1, 'p1', 'A01'), Partition(2, 'p2', 'A01'),
+        Partition(3, 'p1', 'A01'), Partition(4, 'p1', 'B02')
+    ]
+    assert _group_partitions(partitions).items() == [(None, [1, 2, 3, 4])]
+    assert _group_partitions(partitions, 'plate').items() == [
+        (('p1', ), [1, 3, 4]), (('p2', ), [2])
+    ]
+    assert _group_partitions(partitions, 'well').items() == [
+        (('p1', 'A01'), [1, 3]), (('p2', 'A01'), [2]), (('p1', 'B02'), [4])
+    ]
+
+
+def test_sample_order_depends_only_on_seed():
+    ids = column('id', Integer)
+    sql, params = _compile(_get_sample_order(42, ids))
+    assert sql.startswith('md5(concat(')
+    assert params.values() == ['42:']
+    assert _compile(_get_sample_order(42, ids)) == (sql, params)
+    assert _compile(_get_sample_order(43, ids))[1] != params
+
+
+def test_feature_values_of_sampled_mapobjects_follow_order_of_ids():
+    session = mock.Mock()
+    session.query.return_value.filter.return_value.all.return_value = [
+        (7, {'1': '0.5', '2': '3'}), (3, {'1': '1.5'})
+    ]
+    ids, rows = _get_feature_values_of_mapobjects(
+        session, 1, [3, 5, 7], ['2', '1']
+    )
+    assert ids == [3, 5, 7]
+    assert rows == [['nan', '1.5'], ['nan', 'nan'], ['3', '0.5']]
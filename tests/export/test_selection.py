@@ -0,0 +1,55 @@
+import collections
+
+import flask
+import mock
+import pytest
+
+from tmserver.util import get_list_query_param
+from tmserver.model import encode_pk
+from tmserver.error import MalformedRequestError, ResourceNotFoundError
+from tmserver.api.mapobject import (
+    _get_matching_features, _get_matching_partitions
+)
+
+Feature = collections.namedtuple('Feature', ['id', 'name'])
+
+
+def _make_session(features):
+    session = mock.Mock()
+    query = session.query.return_value.filter_by.return_value.order_by
+    query.return_value.all.return_value = features
+    return session
+
+
+def test_list_query_param_may_be_repeated_or_comma_separated():
+    app = flask.Flask(__name__)
+    with app.test_request_context('/?ids=3,1&ids=2&ids='):
+        assert get_list_query_param('ids', type=int) == [3, 1, 2]
+        assert get_list_query_param('names') is None
+    with app.test_request_context('/?ids=1,a'):
+        with pytest.raises(MalformedRequestError):
+            get_list_query_param('ids', type=int)
+
+
+def test_features_are_selected_by_name_or_id_in_order_of_selection():
+    features = [
+        Feature(1, 'Area'), Feature(2, 'Perimeter'), Feature(3, 'Mean')
+    ]
+    session = _make_session(features)
+    assert _get_matching_features(session, 5) == features
+    selected = _get_matching_features(session, 5, ['Mean', encode_pk(1)])
+    assert [f.name for f in selected] == ['Mean', 'Area']
+
+
+def test_unknown_feature_is_not_found():
+    session = _make_session([Feature(1, 'Area')])
+    with pytest.raises(ResourceNotFoundError):
+        _get_matching_features(session, 5, ['Area', 'Volume'])
+    with pytest.raises(ResourceNotFoundError):
+        _get_matching_features(session, 5, [encode_pk(2)])
+
+
+def test_partitions_are_not_filtered_without_mapobject_selection():
+    session = mock.Mock()
+    assert _get_matching_partitions(session, 5, [3, 1, 2]) == [3, 1, 2]
+    assert not session.query.called
@@ -0,0 +1,40 @@
+import numpy as np
+
+from tmserver.export.statistics import to_value_matrix, summarize, Histogram
+
+
+def test_missing_values_are_nan():
+    rows = [{'1': '2.5', '2': '1'}, {'1': '0.5'}]
+    values = to_value_matrix(rows, ['1', '2'])
+    assert values.shape == (2, 2)
+    assert values[0].tolist() == [2.5, 1.0]
+    assert np.isnan(values[1, 1])
+
+
+def test_summary_ignores_missing_values():
+    stats = summarize(np.array([1.0, np.nan, 2.0, 3.0, 4.0]), [0.25])
+    assert stats['count'] == 4
+    assert stats['mean'] == 2.5
+    assert stats['median'] == 2.5
+    assert stats['quantiles'] == {'0.25': 1.75}
+
+
+def test_summary_without_values():
+    stats = summarize(np.array([np.nan]))
+    assert stats == {'count': 0, 'mean': None, 'std': None, 'median': None}
+
+
+def test_histogram_is_accumulated_over_chunks():
+    hist = Histogram.from_range([(0.0, 4.0)], [4])
+    hist.add(np.array([[0.5], [1.5], [np.nan]]))
+    hist.add(np.array([[1.0], [4.0], [5.0]]))
+    result = hist.to_dict()
+    assert result['edges'] == [[0.0, 1.0, 2.0, 3.0, 4.0]]
+    assert result['counts'] == [1, 2, 0, 1]
+    assert result['missing'] == 1
+
+
+def test_2d_histogram():
+    hist = Histogram.from_range([(0.0, 2.0), (0.0, 1.0)], [2, 1])
+    hist.add(np.array([[0.5, 0.5], [1.5, 0.5], [1.5, 1.0]]))
+    assert hist.to_dict()['counts'] == [[1], [2]]
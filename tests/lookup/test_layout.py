@@ -0,0 +1,69 @@
+import time
+import pytest
+
+from tmserver import lookup
+from tmserver.lookup import (
+    ExperimentLayout, PlateRecord, WellRecord, SiteRecord, get_site_id,
+    invalidate_layout
+)
+from tmserver.error import ResourceNotFoundError
+
+
+def _create_layout(n_sites=2):
+    return ExperimentLayout(
+        [PlateRecord(1, 'plate1')],
+        [WellRecord(1, 'A01', 'plate1'), WellRecord(2, 'A02', 'plate1')],
+        [SiteRecord(i + 1, 0, i, 'A01', 'plate1') for i in range(n_sites)]
+    )
+
+
+@pytest.fixture
+def layouts(monkeypatch):
+    # Layouts that are successively loaded from the database
+    created = list()
+
+    def load(cls, session):
+        layout = _create_layout(n_sites=len(created) + 1)
+        created.append(layout)
+        return layout
+
+    monkeypatch.setattr(ExperimentLayout, 'load', classmethod(load))
+    monkeypatch.setattr(lookup, '_layouts', dict())
+    return created
+
+
+def test_sites_are_found_by_position():
+    layout = _create_layout()
+    assert [s.id for s in layout.find_sites(well_name='A01')] == [1, 2]
+    assert [s.id for s in layout.find_sites(well_pos_x=1)] == [2]
+    assert layout.get_site_id('plate1', 'A01', 0, 1) == 2
+    assert layout.get_site_id('plate1', 'A02', 0, 1) is None
+    assert [w.id for w in layout.find_wells('plate1', 'A02')] == [2]
+
+
+def test_unknown_names_raise_error():
+    layout = _create_layout()
+    with pytest.raises(ResourceNotFoundError):
+        layout.find_plates('plate2')
+    with pytest.raises(ResourceNotFoundError):
+        layout.find_sites(well_name='B01')
+
+
+def test_layout_is_reloaded_once_for_unknown_site(layouts):
+    assert get_site_id(None, 1, 'plate1', 'A01', 0, 0) == 1
+    assert len(layouts) == 1
+    layouts[0].created = time.time() - lookup._RELOAD_INTERVAL - 1
+    assert get_site_id(None, 1, 'plate1', 'A01', 0, 1) == 2
+    assert len(layouts) == 2
+    with pytest.raises(ResourceNotFoundError):
+        get_site_id(None, 1, 'plate1', 'A01', 0, 5)
+    assert len(layouts) == 2
+
+
+def test_invalidated_layout_is_reloaded(layouts):
+    get_site_id(None, 1, 'plate1', 'A01', 0, 0)
+    get_site_id(None, 1, 'plate1', 'A01', 0, 0)
+    assert len(layouts) == 1
+    invalidate_layout(1)
+    get_site_id(None, 1, 'plate1', 'A01', 0, 0)
+    assert len(layouts) == 2
@@ -0,0 +1,38 @@
+import json
+
+import flask
+import numpy as np
+import pytest
+
+from tmserver.api.feature import _read_mapobject_ids
+from tmserver.error import MalformedRequestError, MissingPOSTParameterError
+
+
+def _read(data, content_type):
+    app = flask.Flask(__name__)
+    with app.test_request_context(
+            '/', method='POST', data=data, content_type=content_type):
+        return _read_mapobject_ids()
+
+
+def test_ids_are_read_from_json_in_order():
+    ids = _read(json.dumps({'mapobject_ids': [243, 17, 5012, 17]}),
+                'application/json')
+    assert ids == [243, 17, 5012, 17]
+
+
+def test_ids_are_read_from_binary_stream():
+    data = np.array([243, 17, 2 ** 40], dtype='<i8').tobytes()
+    assert _read(data, 'application/octet-stream') == [243, 17, 2 ** 40]
+    assert _read('', 'application/octet-stream') == []
+
+
+def test_invalid_ids():
+    with pytest.raises(MissingPOSTParameterError):
+        _read(json.dumps({'ids': [1]}), 'application/json')
+    with pytest.raises(MalformedRequestError):
+        _read(json.dumps({'mapobject_ids': [1, 'a']}), 'application/json')
+    with pytest.raises(MalformedRequestError):
+        _read(json.dumps({'mapobject_ids': 1}), 'application/json')
+    with pytest.raises(MalformedRequestError):
+        _read('\x01\x00\x00', 'application/octet-stream')
@@ -0,0 +1,41 @@
+import pytest
+from sqlalchemy import column, Float
+
+from tmserver.predicate import (
+    parse_predicate, get_feature_names, compile_predicate
+)
+
+
+def test_precedence_of_boolean_operators():
+    tree = parse_predicate('a > 1 or not b <= 2 and "c d" != 3')
+    assert tree[0] == 'or'
+    assert tree[1][0].feature == 'a'
+    assert tree[1][1][0] == 'and'
+    assert tree[1][1][1][0][0] == 'not'
+    assert get_feature_names(tree) == ['a', 'b', 'c d']
+
+
+def test_number_on_left_side_is_mirrored():
+    comparison = parse_predicate('0.5 < Intensity_mean')
+    assert comparison.feature == 'Intensity_mean'
+    assert comparison.op == '>'
+    assert comparison.value == 0.5
+
+
+def test_invalid_expression():
+    with pytest.raises(ValueError):
+        parse_predicate('Area > ')
+    with pytest.raises(ValueError):
+        parse_predicate('Area > 1; DROP TABLE feature_values')
+
+
+def test_negation_excludes_nan():
+    columns = {'a': column('a', Float), 'b': column('b', Float)}
+    tree = parse_predicate('not (a > 1 and b = 2)')
+    sql = str(compile_predicate(tree, columns))
+    assert 'NOT' not in sql
+    assert sql.count(' OR ') == 1
+    assert 'a <= ' in sql
+    assert 'b != ' in sql
+    # Each comparison excludes NaN values.
+    assert sql.count(' != ') == 3
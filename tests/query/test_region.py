@@ -0,0 +1,44 @@
+import json
+
+import pytest
+
+from tmserver.api.layer import _get_selection_geometry
+from tmserver.error import MalformedRequestError, MissingPOSTParameterError
+
+
+def _compile(expression):
+    compiled = expression.compile()
+    return str(compiled), sorted(compiled.params.values())
+
+
+def test_bbox_is_converted_to_envelope():
+    sql, params = _compile(_get_selection_geometry({'bbox': [0, -10, 5, 0]}))
+    assert sql.startswith('ST_MakeEnvelope(')
+    assert params == [-10.0, 0.0, 0.0, 5.0]
+
+
+def test_invalid_bbox():
+    for bbox in [[0, 1, 2], [0, 'a', 1, 1], None, [5, 0, 0, 10]]:
+        with pytest.raises(MalformedRequestError):
+            _get_selection_geometry({'bbox': bbox})
+
+
+def test_polygon_is_passed_as_geojson():
+    geometry = {
+        'type': 'Polygon',
+        'coordinates': [[[0, 0], [10, 0], [10, -10], [0, 0]]]
+    }
+    sql, params = _compile(_get_selection_geometry({'geometry': geometry}))
+    assert sql.startswith('ST_GeomFromGeoJSON(')
+    assert json.loads(params[0]) == geometry
+
+
+def test_invalid_geometry():
+    with pytest.raises(MalformedRequestError):
+        _get_selection_geometry(
+            {'geometry': {'type': 'Point', 'coordinates': [0, 0]}}
+        )
+    with pytest.raises(MalformedRequestError):
+        _get_selection_geometry({'geometry': 'POLYGON((0 0, 1 0, 0 0))'})
+    with pytest.raises(MissingPOSTParameterError):
+        _get_selection_geometry({'mode': 'within'})
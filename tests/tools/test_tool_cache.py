@@ -0,0 +1,101 @@
+import json
+import contextlib
+import collections
+
+import mock
+import pytest
+
+from tmserver.api import tools
+from tmserver.export.cache import ExportCache
+from tmserver import cfg
+
+User = collections.namedtuple('User', ['id'])
+
+
+@pytest.fixture
+def result_cache(tmpdir, monkeypatch):
+    monkeypatch.setattr(cfg, 'cache_dir', str(tmpdir))
+    monkeypatch.setattr(cfg, 'tool_result_cache_max_age', 1)
+    monkeypatch.setattr(
+        tools, 'get_export_cache',
+        lambda: ExportCache(str(tmpdir.join('exports')), 1024, 3600)
+    )
+    monkeypatch.setattr(tools, '_result_cache', None)
+    return tools._get_result_cache()
+
+
+def test_reuse_depends_on_export_cache(result_cache, monkeypatch):
+    assert result_cache is not None
+    assert tools._get_result_cache() is result_cache
+    monkeypatch.setattr(cfg, 'tool_result_cache_max_age', 0)
+    assert tools._get_result_cache() is None
+    monkeypatch.setattr(cfg, 'tool_result_cache_max_age', 1)
+    monkeypatch.setattr(tools, 'get_export_cache', lambda: None)
+    assert tools._get_result_cache() is None
+
+
+@pytest.fixture
+def experiment(monkeypatch):
+    experiment = {'max_mapobject_id': 100}
+
+    @contextlib.contextmanager
+    def create_session(experiment_id):
+        session = mock.Mock()
+        session.query.return_value.scalar.return_value = \
+            experiment['max_mapobject_id']
+        yield session
+
+    monkeypatch.setattr(tools.tm.utils, 'ExperimentSession', create_session)
+    monkeypatch.setattr(tools, 'current_identity', User(2))
+    return experiment
+
+
+def test_identical_requests_share_key(result_cache, experiment):
+    key = tools._get_result_cache_key(
+        1, 'Cluster Tool', {'k': 3, 'features': ['a']}
+    )
+    assert key == tools._get_result_cache_key(
+        1, 'Cluster Tool', {'features': ['a'], 'k': 3}
+    )
+    assert key != tools._get_result_cache_key(
+        1, 'Cluster Tool', {'features': ['a'], 'k': 4}
+    )
+    assert key != tools._get_result_cache_key(
+        1, 'Heatmap Tool', {'features': ['a'], 'k': 3}
+    )
+    assert key != tools._get_result_cache_key(
+        3, 'Cluster Tool', {'features': ['a'], 'k': 3}
+    )
+
+
+def test_requests_of_other_users_have_other_key(result_cache, experiment,
+        monkeypatch):
+    key = tools._get_result_cache_key(1, 'Cluster Tool', {'k': 3})
+    monkeypatch.setattr(tools, 'current_identity', User(5))
+    assert key != tools._get_result_cache_key(1, 'Cluster Tool', {'k': 3})
+
+
+def test_modified_data_changes_key(result_cache, experiment):
+    key = tools._get_result_cache_key(1, 'Cluster Tool', {'k': 3})
+    tools.get_export_cache().update_data_version(1)
+    updated_key = tools._get_result_cache_key(1, 'Cluster Tool', {'k': 3})
+    assert updated_key != key
+    # Workflow jobs create mapobjects without updating the data version.
+    experiment['max_mapobject_id'] = 120
+    assert updated_key != tools._get_result_cache_key(
+        1, 'Cluster Tool', {'k': 3}
+    )
+
+
+def test_no_key_without_cache(result_cache, experiment, monkeypatch):
+    monkeypatch.setattr(cfg, 'tool_result_cache_max_age', 0)
+    assert tools._get_result_cache_key(1, 'Cluster Tool', {'k': 3}) is None
+
+
+def test_submission_is_cached_by_key(result_cache):
+    key = result_cache.create_key('tool', 1)
+    tools._cache_tool_result(None, 7)
+    assert result_cache.get(key) is None
+    tools._cache_tool_result(key, 7)
+    with open(result_cache.get(key)) as f:
+        assert json.load(f) == {'submission_id': 7}
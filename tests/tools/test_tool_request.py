@@ -0,0 +1,67 @@
+import time
+
+import pytest
+
+from tmserver import toolpool
+from tmserver.api import tools
+from tmserver.toolpool import ToolPool
+
+
+class StubTool(object):
+
+    __cost__ = 0.5
+
+
+class ExpensiveStubTool(object):
+
+    __cost__ = 100
+
+
+def _sleep(experiment_id, tool_name, submission_id, payload):
+    time.sleep(10)
+
+
+@pytest.yield_fixture
+def pool(monkeypatch):
+    pool = ToolPool(1, timeout=0.5)
+    monkeypatch.setattr(tools, 'get_tool_pool', lambda: pool)
+    yield pool
+    while not pool._idle.empty():
+        pool._idle.get().terminate()
+
+
+@pytest.fixture
+def deleted(monkeypatch):
+    deleted = list()
+    monkeypatch.setattr(
+        tools, '_delete_tool_results', lambda *args: deleted.append(args)
+    )
+    return deleted
+
+
+def test_cheap_request_is_processed_within_server(pool, deleted,
+        monkeypatch):
+    monkeypatch.setattr(tools, 'get_tool_class', lambda name: StubTool)
+    monkeypatch.setattr(toolpool, '_process_request', lambda *args: None)
+    assert tools._process_request_within_server(1, 'Stub Tool', 2, {})
+    assert deleted == []
+
+
+def test_expensive_request_is_processed_by_job(pool, deleted, monkeypatch):
+    monkeypatch.setattr(
+        tools, 'get_tool_class', lambda name: ExpensiveStubTool
+    )
+    monkeypatch.setattr(toolpool, '_process_request', _sleep)
+    start = time.time()
+    assert not tools._process_request_within_server(1, 'Stub Tool', 2, {})
+    assert time.time() - start < 0.5
+    assert deleted == []
+
+
+def test_partial_results_are_deleted_after_timeout(pool, deleted,
+        monkeypatch):
+    monkeypatch.setattr(tools, 'get_tool_class', lambda name: StubTool)
+    monkeypatch.setattr(toolpool, '_process_request', _sleep)
+    assert not tools._process_request_within_server(1, 'Stub Tool', 2, {})
+    assert deleted == [(1, 2)]
+    assert pool._idle.empty()
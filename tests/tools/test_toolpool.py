@@ -0,0 +1,87 @@
+import os
+import time
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from tmserver import toolpool
+from tmserver.toolpool import ToolPool, ToolPoolError
+
+
+def _write_pid(experiment_id, tool_name, submission_id, payload):
+    with open(payload['filename'], 'w') as f:
+        f.write(str(os.getpid()))
+
+
+def _fail(experiment_id, tool_name, submission_id, payload):
+    raise ValueError('Tool failed.')
+
+
+def _sleep(experiment_id, tool_name, submission_id, payload):
+    time.sleep(10)
+
+
+@pytest.yield_fixture
+def pool():
+    pool = ToolPool(1, timeout=0.5)
+    yield pool
+    while not pool._idle.empty():
+        pool._idle.get().terminate()
+
+
+def test_request_is_processed_by_worker_process(pool, tmpdir, monkeypatch):
+    # Workers are forked after the function was replaced.
+    monkeypatch.setattr(toolpool, '_process_request', _write_pid)
+    filename = str(tmpdir.join('pid'))
+    pool.run(1, 'Stub Tool', 2, {'filename': filename})
+    with open(filename) as f:
+        pid = int(f.read())
+    assert pid != os.getpid()
+    # The worker is reused for the next request.
+    pool.run(1, 'Stub Tool', 3, {'filename': filename})
+    with open(filename) as f:
+        assert int(f.read()) == pid
+
+
+def test_error_of_tool_is_raised(pool, monkeypatch):
+    monkeypatch.setattr(toolpool, '_process_request', _fail)
+    with pytest.raises(ToolPoolError) as err:
+        pool.run(1, 'Stub Tool', 2, {})
+    assert 'Tool failed.' in str(err.value)
+    assert pool._idle.qsize() == 1
+
+
+def test_worker_is_killed_after_timeout(pool, monkeypatch):
+    monkeypatch.setattr(toolpool, '_process_request', _sleep)
+    start = time.time()
+    with pytest.raises(ToolPoolError):
+        pool.run(1, 'Stub Tool', 2, {})
+    assert time.time() - start < 5
+    assert pool._idle.empty()
+
+
+def test_connection_inherited_across_fork_is_discarded(tmpdir):
+    engine = create_engine(
+        'sqlite:///%s' % tmpdir.join('test.db'), poolclass=QueuePool
+    )
+    connection = engine.connect()
+    inherited = connection.connection.connection
+    connection.close()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            connection = engine.connect()
+            is_new = connection.connection.connection is not inherited
+            is_own = connection.connection.info['pid'] == os.getpid()
+            os.write(write_fd, str(int(is_new and is_own)))
+        finally:
+            os._exit(0)
+    os.close(write_fd)
+    os.waitpid(pid, 0)
+    assert os.read(read_fd, 1) == '1'
+    # The server still uses its own connection.
+    connection = engine.connect()
+    assert connection.connection.connection is inherited
+    assert connection.execute('SELECT 1').scalar() == 1
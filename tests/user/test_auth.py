@@ -0,0 +1,31 @@
+import flask
+import pytest
+from flask_jwt import JWTError
+
+from tmserver.extensions.auth import get_token
+
+
+@pytest.fixture
+def token_app():
+    app = flask.Flask(__name__)
+    app.config['JWT_AUTH_HEADER_PREFIX'] = 'JWT'
+    app.add_url_rule('/events', 'api.get_task_events', lambda: '')
+    app.add_url_rule('/experiments', 'api.get_experiments', lambda: '')
+    return app
+
+
+def test_token_is_read_from_header(token_app):
+    headers = {'Authorization': 'JWT abc'}
+    with token_app.test_request_context('/experiments', headers=headers):
+        assert get_token() == 'abc'
+    headers = {'Authorization': 'Bearer abc'}
+    with token_app.test_request_context('/experiments', headers=headers):
+        with pytest.raises(JWTError):
+            get_token()
+
+
+def test_token_is_only_read_from_query_string_of_event_streams(token_app):
+    with token_app.test_request_context('/events?access_token=abc'):
+        assert get_token() == 'abc'
+    with token_app.test_request_context('/experiments?access_token=abc'):
+        assert get_token() is None
@@ -41,3 +41,5 @@ import tmserver.api.tile
 import tmserver.api.tools
 
 import tmserver.api.workflow
+
+import tmserver.api.admin
@@ -34,6 +34,7 @@ from tmserver.util import (
 )
 from tmserver.api import api
 from tmserver.error import *
+from tmserver.lookup import invalidate_layout
 
 
 logger = logging.getLogger(__name__)
@@ -101,6 +102,7 @@ def create_acquisition(experiment_id):
         )
         session.add(acquisition)
         session.commit()
+        invalidate_layout(experiment_id)
         return jsonify(data=acquisition)
 
 
@@ -140,6 +142,7 @@ def delete_acquisition(experiment_id, acquisition_id):
     with tm.utils.ExperimentSession(experiment_id) as session:
         session.query(tm.Acquisition).filter_by(id=acquisition_id).delete()
         # TODO: DELETE CASCADE mapobjects, channel_layer_tiles
+    invalidate_layout(experiment_id)
     return jsonify(message='ok')
 
 
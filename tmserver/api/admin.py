@@ -0,0 +1,104 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""API view functions for inspecting the server."""
+import logging
+import functools
+from flask import jsonify
+from flask_jwt import jwt_required
+from flask_jwt import current_identity
+
+from tmserver.extensions import gc3pie
+from tmserver.api import api
+from tmserver.error import ForbiddenError
+from tmserver import cfg
+
+logger = logging.getLogger(__name__)
+
+
+def assert_admin(f):
+    """Decorator that only grants access to users listed in configuration
+    parameter
+    :attr:`admin_users <tmserver.config.ServerConfig.admin_users>`.
+
+    Raises
+    ------
+    ForbiddenError
+        when the current user is not an administrator
+    """
+    @functools.wraps(f)
+    def wrapped(*args, **kwargs):
+        if current_identity.name not in cfg.admin_users:
+            raise ForbiddenError(
+                'User "%s" is not an administrator.' % current_identity.name
+            )
+        return f(*args, **kwargs)
+    return wrapped
+
+
+@api.route('/engine/metrics', methods=['GET'])
+@jwt_required()
+@assert_admin
+def get_engine_metrics():
+    """
+    .. http:get:: /api/engine/metrics
+
+        Get timings of recent cycles of the main loop of the engine that
+        processes workflow and tool jobs.
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+            Content-Type: application/json
+
+            {
+                "data": {
+                    "cycles": 1520,
+                    "window": 1000,
+                    "interval": 2,
+                    "queue_length": 0,
+                    "tasks": {"NEW": 0, "RUNNING": 12, "TERMINATED": 40, ...},
+                    "last_cycle": {
+                        "started_at": 1490971436.1,
+                        "drain": 0.002,
+                        "progress": 1.31,
+                        "callbacks": 0.01,
+                        "total": 1.322,
+                        "queue_length": 1,
+                        "changed_tasks": 3
+                    },
+                    "durations": {
+                        "total": {"mean": 0.8, "median": 0.6, "p95": 2.1, "max": 4.7},
+                        ...
+                    },
+                    "histogram": {
+                        "buckets": [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300],
+                        "counts": [10, 50, 112, 400, 300, 128, 0, 0, 0, 0, 0]
+                    },
+                    "errors": {"submit": 2}
+                }
+            }
+
+        :reqheader Authorization: JWT token issued by the server
+        :statuscode 200: no error
+        :statuscode 403: user is not an administrator
+
+    .. note:: Durations are given in seconds. The last histogram count
+        refers to cycles that took longer than the last bucket.
+    """
+    logger.info('get engine metrics')
+    return jsonify(data=gc3pie.get_engine_metrics())
@@ -16,34 +16,329 @@
 """API view functions for querying :mod:`feature <tmlib.models.feature>`
 resources.
 """
+import os
 import csv
 import json
+import errno
+import fcntl
+import itertools
+import threading
+import collections
 import logging
 import numpy as np
 import pandas as pd
 from cStringIO import StringIO
 from flask_jwt import jwt_required
 from flask import jsonify, request, send_file, Response, stream_with_context
+from sqlalchemy import func, cast, Float
+from sqlalchemy.dialects.postgresql import array
 from sqlalchemy.orm.exc import NoResultFound
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
 
 import tmlib.models as tm
 
 from tmserver.api import api
 from tmserver.util import (
     decode_query_ids, assert_query_params, assert_form_params,
-    is_true, is_false
+    is_true, is_false, get_list_query_param
 )
 from tmserver.error import *
+from tmserver.export import (
+    map_partitions, get_table_writer_class, stream_table, CSVWriter,
+    negotiate_encoding, compress_stream, get_export_cache, invalidate_exports,
+    get_border_index, get_border_mapobject_ids
+)
+from tmserver.export.statistics import to_value_matrix, summarize, Histogram
+from tmserver import cfg as server_cfg
+from tmserver.lookup import get_site_id
+from tmserver.predicate import (
+    parse_predicate, get_feature_names, compile_predicate
+)
 from tmserver.api.mapobject import (
     _get_matching_sites, _get_matching_plates, _get_matching_wells,
-    _get_matching_layers, _get_mapobjects_at_ref_position,
-    _get_border_mapobjects_at_ref_position
+    _get_matching_layers, _get_matching_features, _get_matching_partitions,
+    _get_mapobjects_at_ref_position, _get_border_mapobjects_at_ref_position,
+    _filter_mapobject_ids
 )
 
 
 logger = logging.getLogger(__name__)
 
 
+def _get_export_cache_key(session, experiment_id, mapobject_type_id, *parts):
+    cache = get_export_cache()
+    if cache is None:
+        return None
+    # The largest mapobject ID changes when objects get (re)created by
+    # workflow jobs, which don't update the data version.
+    max_mapobject_id = session.query(func.max(tm.Mapobject.id)).\
+        filter_by(mapobject_type_id=mapobject_type_id).\
+        scalar()
+    return cache.create_key(
+        request.path, sorted(request.args.items(multi=True)),
+        cache.get_data_version(experiment_id), max_mapobject_id, parts
+    )
+
+
+def _send_cached_file(path, cache_key, mimetype, **kwargs):
+    # The modification time of a cached file doesn't change, but its ETag is
+    # derived from the cache key, which identifies the content. Responses
+    # contain user data and must be revalidated once the data version
+    # changes, so they must neither be stored by shared caches nor be
+    # reused without asking the server.
+    response = send_file(
+        path, mimetype=mimetype, add_etags=False, cache_timeout=0, **kwargs
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.set_etag(cache_key)
+    try:
+        return response.make_conditional(
+            request, accept_ranges=True,
+            complete_length=os.path.getsize(path)
+        )
+    except RequestedRangeNotSatisfiable:
+        response.close()
+        raise
+
+
+def _create_table_response(stream, mimetype, filename, cache_key=None,
+        compress=False):
+    headers = {
+        'Content-Disposition': 'attachment; filename={filename}'.format(
+            filename=filename
+        )
+    }
+    encoding = None
+    if compress and server_cfg.export_compression_level > 0:
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = negotiate_encoding(request.accept_encodings)
+        if encoding is not None:
+            stream = compress_stream(
+                stream, encoding, server_cfg.export_compression_level
+            )
+            headers['Content-Encoding'] = encoding
+    if cache_key is not None:
+        cache = get_export_cache()
+        if encoding is not None:
+            # Each encoding of an export is cached separately.
+            cache_key = cache.create_key(cache_key, encoding)
+        path = cache.get(cache_key)
+        if path is not None:
+            response = _send_cached_file(
+                path, cache_key, mimetype, as_attachment=True,
+                attachment_filename=filename
+            )
+            for name in ('Vary', 'Content-Encoding'):
+                if name in headers:
+                    response.headers[name] = headers[name]
+            return response
+        # Requests with a "Range" header get the complete export until it
+        # is cached, rather than waiting until the export is built.
+        stream = cache.stream(cache_key, stream)
+    return Response(stream, mimetype=mimetype, headers=headers)
+
+
+def _create_cached_json_response(cache_key, compute):
+    if cache_key is None:
+        return jsonify(data=compute())
+    cache = get_export_cache()
+    path = cache.get(cache_key)
+    if path is None:
+        data = json.dumps({'data': compute()})
+        path = cache.materialize(cache_key, [data])
+    return _send_cached_file(path, cache_key, 'application/json')
+
+
+def _get_feature_value_matrix(session, mapobject_type_id, partition_key,
+        feature_keys, tpoint=None, mapobject_ids=None,
+        mapobject_id_range=None):
+    query = session.query(
+            tm.FeatureValues.values.slice(array(feature_keys))
+        ).\
+        join(tm.Mapobject).\
+        filter(
+            tm.Mapobject.mapobject_type_id == mapobject_type_id,
+            tm.Mapobject.partition_key == partition_key,
+            tm.FeatureValues.partition_key == partition_key
+        )
+    if tpoint is not None:
+        query = query.filter(tm.FeatureValues.tpoint == tpoint)
+    query = _filter_mapobject_ids(query, mapobject_ids, mapobject_id_range)
+    return to_value_matrix([r[0] for r in query.all()], feature_keys)
+
+
+def _get_feature_values_of_mapobjects(session, partition_key, mapobject_ids,
+        feature_keys, project=True):
+    if project:
+        values = tm.FeatureValues.values.slice(array(feature_keys))
+    else:
+        values = tm.FeatureValues.values
+    feature_values = session.query(tm.FeatureValues.mapobject_id, values).\
+        filter(
+            tm.FeatureValues.partition_key == partition_key,
+            tm.FeatureValues.mapobject_id.in_(mapobject_ids)
+        ).\
+        all()
+    feature_values_lut = dict(feature_values)
+    nan = str(np.nan)
+    rows = list()
+    for mapobject_id in mapobject_ids:
+        vals = feature_values_lut.get(mapobject_id, {})
+        rows.append([vals.get(k, nan) for k in feature_keys])
+    return (list(mapobject_ids), rows)
+
+
+def _group_partitions(partitions, stratify=None):
+    # Partitions are grouped by plate or well, or all end up in one stratum.
+    strata = collections.OrderedDict()
+    for p in partitions:
+        if stratify == 'plate':
+            group = (p.plate_name, )
+        elif stratify == 'well':
+            group = (p.plate_name, p.well_name)
+        else:
+            group = None
+        strata.setdefault(group, list()).append(p.id)
+    return strata
+
+
+def _get_sample_order(seed, column):
+    # Hashing the seed together with the ID gives a pseudo-random order,
+    # which only depends on the seed and not on the physical layout.
+    return func.md5(func.concat('%d:' % seed, column))
+
+
+def _get_feature_value_limits(session, mapobject_type_id, feature_key,
+        partition_keys=None, tpoint=None, mapobject_ids=None,
+        mapobject_id_range=None):
+    value = cast(tm.FeatureValues.values[feature_key], Float)
+    query = session.query(func.min(value), func.max(value)).\
+        join(tm.Mapobject).\
+        filter(
+            tm.Mapobject.mapobject_type_id == mapobject_type_id,
+            # Excludes NaN, which is larger than any number in PostgreSQL.
+            value > float('-inf'), value < float('inf')
+        )
+    if partition_keys is not None:
+        query = query.filter(
+            tm.FeatureValues.partition_key.in_(partition_keys)
+        )
+    if tpoint is not None:
+        query = query.filter(tm.FeatureValues.tpoint == tpoint)
+    query = _filter_mapobject_ids(query, mapobject_ids, mapobject_id_range)
+    return query.one()
+
+
+def _create_feature_index(experiment_id, feature_key):
+    index_name = 'feature_values_value_%s_idx' % feature_key
+    logger.info(
+        'create index "%s" for experiment %d', index_name, experiment_id
+    )
+    # The index is built concurrently outside of a transaction, such that
+    # the table doesn't get locked for writes in the meantime.
+    try:
+        with tm.utils.ExperimentConnection(experiment_id) as connection:
+            connection.execute(
+                'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} '
+                '(CAST("values" -> \'{key}\' AS DOUBLE PRECISION))'.format(
+                    name=index_name, table=tm.FeatureValues.__tablename__,
+                    key=int(feature_key)
+                )
+            )
+    except Exception as err:
+        logger.error('index "%s" could not be created: %s', index_name, err)
+        # A failed concurrent build leaves an invalid index behind.
+        try:
+            with tm.utils.ExperimentConnection(experiment_id) as connection:
+                connection.execute(
+                    'DROP INDEX CONCURRENTLY IF EXISTS %s' % index_name
+                )
+        except Exception as err:
+            logger.error(
+                'index "%s" could not be dropped: %s', index_name, err
+            )
+
+
+def _count_feature_query(experiment_id, feature_key):
+    # Queries are counted on disk, such that counts add up across server
+    # processes.
+    location = os.path.join(
+        server_cfg.cache_dir, 'feature_queries', str(experiment_id)
+    )
+    try:
+        os.makedirs(location)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    fd = os.open(
+        os.path.join(location, str(feature_key)), os.O_RDWR | os.O_CREAT,
+        0o644
+    )
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        count = int(os.read(fd, 32) or 0) + 1
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.ftruncate(fd, 0)
+        os.write(fd, str(count))
+    finally:
+        os.close(fd)
+    return count
+
+
+def _record_feature_query(experiment_id, feature_keys):
+    # Indexes are only worth their cost for features that are queried
+    # repeatedly, so they get created once a feature was used often enough.
+    threshold = server_cfg.feature_index_threshold
+    if threshold <= 0:
+        return
+    for key in feature_keys:
+        try:
+            count = _count_feature_query(experiment_id, key)
+        except (OSError, IOError, ValueError) as err:
+            logger.warn('feature query could not be counted: %s', str(err))
+            continue
+        if count == threshold:
+            t = threading.Thread(
+                target=_create_feature_index, args=(experiment_id, key)
+            )
+            t.daemon = True
+            t.start()
+
+
+def _get_border_mapobject_ids(session, experiment_id, mapobject_type_id,
+        ref_type_id, ref_id, mapobjects, complete):
+    # The border index is tagged with the largest ID of all objects of a
+    # segmentation layer at the site, which may not have been selected.
+    layer_ids = set([m[2] for m in mapobjects])
+    max_mapobject_ids = dict(
+        session.query(
+            tm.MapobjectSegmentation.segmentation_layer_id,
+            func.max(tm.MapobjectSegmentation.mapobject_id)
+        ).\
+        join(tm.Mapobject).\
+        filter(
+            tm.Mapobject.mapobject_type_id == mapobject_type_id,
+            tm.MapobjectSegmentation.partition_key == ref_id,
+            tm.MapobjectSegmentation.segmentation_layer_id.in_(layer_ids)
+        ).\
+        group_by(tm.MapobjectSegmentation.segmentation_layer_id).\
+        all()
+    )
+
+    def compute(mapobject_ids):
+        border_segmentations = _get_border_mapobjects_at_ref_position(
+            session, mapobject_ids, ref_type_id, ref_id
+        )
+        return [s.mapobject_id for s in border_segmentations]
+
+    return get_border_mapobject_ids(
+        get_border_index(), experiment_id, ref_id, mapobjects,
+        max_mapobject_ids, compute, complete
+    )
+
+
 @api.route(
     '/experiments/<experiment_id>/features/<feature_id>',
     methods=['PUT']
@@ -88,6 +383,7 @@ def update_feature(experiment_id, feature_id):
     with tm.utils.ExperimentSession(experiment_id) as session:
         feature = session.query(tm.Feature).get(feature_id)
         feature.name = name
+    invalidate_exports(experiment_id)
     return jsonify(message='ok')
 
 
@@ -122,6 +418,7 @@ def delete_feature(experiment_id, feature_id):
     with tm.utils.ExperimentSession(experiment_id, False) as session:
         session.query(tm.FeatureValue.values.delete(str(feature_id)))
         session.query(tm.Feature).filter_by(id=feature_id).delete()
+    invalidate_exports(experiment_id)
     return jsonify(message='ok')
 
 
@@ -209,15 +506,10 @@ def add_feature_values(experiment_id, mapobject_type_id):
         data.rename(feature_lut, inplace=True)
 
     with tm.utils.ExperimentSession(experiment_id) as session:
-        site = session.query(tm.Site).\
-            join(tm.Well).\
-            join(tm.Plate).\
-            filter(
-                tm.Plate.name == plate_name, tm.Well.name == well_name,
-                tm.Site.y == well_pos_y, tm.Site.x == well_pos_x
-            ).\
-            one()
-        site_id = site.id
+        site_id = get_site_id(
+            session, experiment_id, plate_name, well_name,
+            well_pos_y, well_pos_x
+        )
 
         layer = session.query(tm.SegmentationLayer.id).\
             filter_by(mapobject_type_id=mapobject_type_id, tpoint=tpoint).\
@@ -253,6 +545,7 @@ def add_feature_values(experiment_id, mapobject_type_id):
             feature_values.append(values)
         session.bulk_ingest(feature_values)
 
+    invalidate_exports(experiment_id)
     return jsonify(message='ok')
 
 
@@ -278,6 +571,13 @@ def get_feature_values(experiment_id, mapobject_type_id):
         :query well_pos_x: x-coordinate of the site within the well (optional)
         :query well_pos_y: y-coordinate of the site within the well (optional)
         :query tpoint: time point (optional)
+        :query features: names or IDs of features that should be exported
+            (optional, default: all features of the mapobject type)
+        :query mapobject_ids: IDs of mapobjects that should be exported (optional)
+        :query mapobject_id_min: smallest ID of exported mapobjects (optional)
+        :query mapobject_id_max: largest ID of exported mapobjects (optional)
+        :query format: format of the table: ``"csv"`` (default), ``"arrow"``,
+            ``"npz"`` or ``"hdf5"`` (optional)
 
         :reqheader Authorization: JWT token issued by the server
         :statuscode 200: no error
@@ -285,14 +585,38 @@ def get_feature_values(experiment_id, mapobject_type_id):
         :statuscode 401: unauthorized
         :statuscode 404: not found
 
-    .. note:: The table is send in form of a *CSV* stream with the first row
-        representing column names.
+    .. note:: By default, the table is send in form of a *CSV* stream with
+        the first row representing column names. The stream is compressed
+        with *gzip* or *zstd* when the client sends a corresponding
+        ``Accept-Encoding`` header. Binary formats have an
+        additional "mapobject_id" column and hold values as ``float64``:
+        ``"arrow"`` is streamed as *Apache Arrow* IPC record batches,
+        ``"npz"`` as uncompressed *NumPy* archive with arrays "mapobject_id",
+        "values" and "columns" and ``"hdf5"`` as *HDF5* file with datasets
+        "/mapobject_id" and "/values" (column names are stored in attribute
+        "columns"). Exports are cached on the server, such that repeated
+        downloads and requests with a ``Range`` header (to resume an
+        interrupted download) are served from disk.
     """
     plate_name = request.args.get('plate_name')
     well_name = request.args.get('well_name')
     well_pos_x = request.args.get('well_pos_x', type=int)
     well_pos_y = request.args.get('well_pos_y', type=int)
     tpoint = request.args.get('tpoint', type=int)
+    feature_selection = get_list_query_param('features')
+    selected_mapobject_ids = get_list_query_param('mapobject_ids', type=int)
+    mapobject_id_min = request.args.get('mapobject_id_min', type=int)
+    mapobject_id_max = request.args.get('mapobject_id_max', type=int)
+    if mapobject_id_min is None and mapobject_id_max is None:
+        mapobject_id_range = None
+    else:
+        mapobject_id_range = (mapobject_id_min, mapobject_id_max)
+    table_format = request.args.get('format', 'csv')
+
+    try:
+        writer_cls = get_table_writer_class(table_format)
+    except ValueError as err:
+        raise MalformedRequestError(str(err))
 
     with tm.utils.MainSession() as session:
         experiment = session.query(tm.ExperimentReference).get(experiment_id)
@@ -303,6 +627,14 @@ def get_feature_values(experiment_id, mapobject_type_id):
             get(mapobject_type_id)
         mapobject_type_name = mapobject_type.name
         mapobject_type_ref_type = mapobject_type.ref_type
+        features = _get_matching_features(
+            session, mapobject_type_id, feature_selection
+        )
+        feature_names = [f.name for f in features]
+        feature_keys = [str(f.id) for f in features]
+        cache_key = _get_export_cache_key(
+            session, experiment_id, mapobject_type_id, feature_keys
+        )
 
     if mapobject_type_ref_type in {'Plate', 'Well'}:
         if well_pos_y is not None:
@@ -333,17 +665,15 @@ def get_feature_values(experiment_id, mapobject_type_id):
         filename_formatstring += '_x{x}'
     if tpoint is not None:
         filename_formatstring += '_t{t}'
-    filename_formatstring += '_{object_type}_feature-values.csv'
+    filename_formatstring += '_{object_type}_feature-values.{extension}'
     filename = filename_formatstring.format(
         experiment=experiment_name, plate=plate_name, well=well_name,
         y=well_pos_y, x=well_pos_x,
-        t=tpoint, object_type=mapobject_type_name
+        t=tpoint, object_type=mapobject_type_name,
+        extension=writer_cls.extension
     )
 
     def generate_feature_matrix(mapobject_type_id, ref_type):
-        data = StringIO()
-        w = csv.writer(data)
-
         with tm.utils.ExperimentSession(experiment_id) as session:
 
             results = _get_matching_layers(session, tpoint)
@@ -352,35 +682,35 @@ def get_feature_values(experiment_id, mapobject_type_id):
                 layer_lut[r.id] = {'tpoint': r.tpoint, 'zplane': r.zplane}
 
             if ref_type == 'Plate':
-                results = _get_matching_plates(session, plate_name)
+                results = _get_matching_plates(
+                    session, experiment_id, plate_name
+                )
             elif ref_type == 'Well':
-                results = _get_matching_wells(session, plate_name, well_name)
+                results = _get_matching_wells(
+                    session, experiment_id, plate_name, well_name
+                )
             elif ref_type == 'Site':
                 results = _get_matching_sites(
-                    session, plate_name, well_name, well_pos_y, well_pos_x
+                    session, experiment_id, plate_name, well_name,
+                    well_pos_y, well_pos_x
                 )
-            ref_ids = [r.id for r in results]
-
-            features = session.query(tm.Feature.name).\
-                filter_by(mapobject_type_id=mapobject_type_id).\
-                order_by(tm.Feature.id).\
-                all()
-            feature_names = [f.name for f in features]
+            ref_ids = _get_matching_partitions(
+                session, mapobject_type_id, [r.id for r in results],
+                selected_mapobject_ids, mapobject_id_range
+            )
 
             ref_mapobject_type = session.query(tm.MapobjectType.id).\
                 filter_by(ref_type=ref_type, id=mapobject_type_id).\
                 one()
 
-        w.writerow(tuple(feature_names))
-        yield data.getvalue()
-        data.seek(0)
-        data.truncate(0)
-
-        for ref_id in ref_ids:
+        def collect_feature_values(ref_id):
             logger.debug('collect feature values for %s %d', ref_type, ref_id)
+            ids = list()
+            rows = list()
             with tm.utils.ExperimentSession(experiment_id) as session:
                 mapobjects = _get_mapobjects_at_ref_position(
-                    session, mapobject_type_id, ref_id, layer_lut.keys()
+                    session, mapobject_type_id, ref_id, layer_lut.keys(),
+                    selected_mapobject_ids, mapobject_id_range
                 )
                 mapobject_ids = [m.id for m in mapobjects]
 
@@ -388,56 +718,59 @@ def get_feature_values(experiment_id, mapobject_type_id):
                     logger.warn(
                         'no mapobjects found for %s %d', ref_type, ref_id
                     )
-                    continue
+                    return (ids, rows)
 
+                if feature_selection is not None:
+                    # Only the selected keys of the hstore leave the database.
+                    values = tm.FeatureValues.values.slice(array(feature_keys))
+                else:
+                    values = tm.FeatureValues.values
                 feature_values = session.query(
-                        tm.FeatureValues.mapobject_id, tm.FeatureValues.values
+                        tm.FeatureValues.mapobject_id, values
                     ).\
                     filter(tm.FeatureValues.mapobject_id.in_(mapobject_ids)).\
                     all()
                 feature_values_lut = dict(feature_values)
 
-                if not feature_values_lut:
+            if not feature_values_lut:
+                logger.warn(
+                    'no feature values found for %s %d', ref_type, ref_id
+                )
+                return (ids, rows)
+
+            for mapobject_id, label, segmentation_layer_id in mapobjects:
+                if mapobject_id not in feature_values_lut:
                     logger.warn(
-                        'no feature values found for %s %d', ref_type, ref_id
+                        'no feature values found for mapobject %d',
+                        mapobject_id
+                    )
+                    ids.append(mapobject_id)
+                    rows.append(
+                        [str(np.nan) for x in xrange(len(feature_names))]
                     )
                     continue
 
-                for mapobject_id, label, segmentation_layer_id in mapobjects:
-                    if mapobject_id not in feature_values_lut:
-                        logger.warn(
-                            'no feature values found for mapobject %d',
-                            mapobject_id
-                        )
-                        w.writerow(tuple(
-                            [str(np.nan) for x in xrange(len(feature_names))]
-                        ))
-                        yield data.getvalue()
-                        data.seek(0)
-                        data.truncate(0)
-                        continue
-
-                    vals = feature_values_lut[mapobject_id]
-                    # Values must be sorted based on feature_id, such that they
-                    # end up in the correct column of the CSV table matching
-                    # the corresponding column names.
-                    # Feature IDs must be sorted as integers to get the
-                    # desired order.
-                    w.writerow(tuple([
-                        vals[k] for k in sorted(vals, key=lambda k: int(k))
-                    ]))
-                yield data.getvalue()
-                data.seek(0)
-                data.truncate(0)
-
-    return Response(
+                vals = feature_values_lut[mapobject_id]
+                # Values must be ordered based on feature_id, such that they
+                # end up in the correct column of the table matching
+                # the corresponding column names.
+                ids.append(mapobject_id)
+                rows.append([vals.get(k, str(np.nan)) for k in feature_keys])
+            return (ids, rows)
+
+        # Partitions are read concurrently, but chunks are yielded in the
+        # order of "ref_ids" such that the table is deterministic.
+        chunks = map_partitions(
+            collect_feature_values, ref_ids, server_cfg.export_workers
+        )
+        writer = writer_cls(feature_names)
+        for data in stream_table(writer, chunks):
+            yield data
+
+    return _create_table_response(
         generate_feature_matrix(mapobject_type_id, mapobject_type_ref_type),
-        mimetype='text/csv',
-        headers={
-            'Content-Disposition': 'attachment; filename={filename}'.format(
-                filename=filename
-            )
-        }
+        writer_cls.mimetype, filename, cache_key=cache_key,
+        compress=(table_format == 'csv')
     )
 
 
@@ -470,7 +803,11 @@ def get_metadata(experiment_id, mapobject_type_id):
         :statuscode 404: not found
 
     .. note:: The table is send in form of a *CSV* stream with the first row
-        representing column names.
+        representing column names. The stream is compressed with *gzip* or
+        *zstd* when the client sends a corresponding ``Accept-Encoding``
+        header. Exports are cached on the server, such that repeated
+        downloads and requests with a ``Range`` header (to resume an
+        interrupted download) are served from disk.
     """
     plate_name = request.args.get('plate_name')
     well_name = request.args.get('well_name')
@@ -487,6 +824,14 @@ def get_metadata(experiment_id, mapobject_type_id):
             get(mapobject_type_id)
         mapobject_type_name = mapobject_type.name
         mapobject_type_ref_type = mapobject_type.ref_type
+        tool_result_ids = session.query(tm.ToolResult.id).\
+            filter_by(mapobject_type_id=mapobject_type_id).\
+            order_by(tm.ToolResult.id).\
+            all()
+        cache_key = _get_export_cache_key(
+            session, experiment_id, mapobject_type_id,
+            [t.id for t in tool_result_ids]
+        )
 
     if mapobject_type_ref_type in {'Plate', 'Well'}:
         if well_pos_y is not None:
@@ -537,7 +882,9 @@ def get_metadata(experiment_id, mapobject_type_id):
 
             ref_position_lut = dict()
             if ref_type == 'Plate':
-                results = _get_matching_plates(session, plate_name)
+                results = _get_matching_plates(
+                    session, experiment_id, plate_name
+                )
                 for r in results:
                     ref_position_lut[r.id] = {
                         'plate_name': r.plate_name,
@@ -546,7 +893,9 @@ def get_metadata(experiment_id, mapobject_type_id):
                     'plate_name'
                 ]
             elif ref_type == 'Well':
-                results = _get_matching_wells(session, plate_name, well_name)
+                results = _get_matching_wells(
+                    session, experiment_id, plate_name, well_name
+                )
                 for r in results:
                     ref_position_lut[r.id] = {
                         'plate_name': r.plate_name,
@@ -557,7 +906,8 @@ def get_metadata(experiment_id, mapobject_type_id):
                 ]
             elif ref_type == 'Site':
                 results = _get_matching_sites(
-                    session, plate_name, well_name, well_pos_y, well_pos_x
+                    session, experiment_id, plate_name, well_name,
+                    well_pos_y, well_pos_x
                 )
                 for r in results:
                     ref_position_lut[r.id] = {
@@ -585,11 +935,11 @@ def get_metadata(experiment_id, mapobject_type_id):
 
         w.writerow(tuple(metadata_names + tool_result_names))
         yield data.getvalue()
-        data.seek(0)
-        data.truncate(0)
 
-        for ref_id in ref_position_lut:
+        def collect_metadata(ref_id):
             logger.debug('collect metadata for %s %d', ref_type, ref_id)
+            data = StringIO()
+            w = csv.writer(data)
             with tm.utils.ExperimentSession(experiment_id) as session:
                 mapobjects = _get_mapobjects_at_ref_position(
                     session, mapobject_type_id, ref_id, layer_lut.keys()
@@ -600,15 +950,14 @@ def get_metadata(experiment_id, mapobject_type_id):
                     logger.warn(
                         'no mapobjects found for %s %d', ref_type, ref_id
                     )
-                    continue
+                    return ''
 
+                border_mapobject_ids = set()
                 if ref_type == 'Site':
-                    border_segmentations = _get_border_mapobjects_at_ref_position(
-                        session, mapobject_ids, ref_mapobject_type.id, ref_id
+                    border_mapobject_ids = _get_border_mapobject_ids(
+                        session, experiment_id, mapobject_type_id,
+                        ref_mapobject_type.id, ref_id, mapobjects, True
                     )
-                    border_mapobject_ids = [
-                        s.mapobject_id for s in border_segmentations
-                    ]
 
                 label_values = session.query(
                         tm.LabelValues.mapobject_id, tm.LabelValues.values
@@ -617,63 +966,1036 @@ def get_metadata(experiment_id, mapobject_type_id):
                     all()
                 label_values_lut = dict(label_values)
 
-                warn = True
-                if not label_values_lut:
-                    warn = False
+            warn = True
+            if not label_values_lut:
+                warn = False
+
+            for mapobject_id, label, segmenation_layer_id in mapobjects:
+                metadata_values = [ref_position_lut[ref_id]['plate_name']]
 
-                rows = list()
-                for mapobject_id, label, segmenation_layer_id in mapobjects:
-                    metadata_values = [ref_position_lut[ref_id]['plate_name']]
+                if 'well_name' in ref_position_lut[ref_id]:
+                    metadata_values.append(
+                        ref_position_lut[ref_id]['well_name']
+                    )
 
-                    if 'well_name' in ref_position_lut[ref_id]:
-                        metadata_values.append(
-                            ref_position_lut[ref_id]['well_name']
+                if 'well_pos_y' in ref_position_lut[ref_id]:
+                    metadata_values.extend([
+                        str(ref_position_lut[ref_id]['well_pos_y']),
+                        str(ref_position_lut[ref_id]['well_pos_x']),
+                    ])
+
+                if layer_lut[segmenation_layer_id]['tpoint'] is not None:
+                    metadata_values.extend([
+                        str(layer_lut[segmenation_layer_id]['tpoint']),
+                        str(layer_lut[segmenation_layer_id]['zplane']),
+                        str(label),
+                        str(1 if mapobject_id in border_mapobject_ids else 0)
+                    ])
+
+                if mapobject_id not in label_values_lut:
+                    if warn:
+                        logger.warn(
+                            'no label values found for mapobject %d',
+                            mapobject_id
                         )
+                    metadata_values += [
+                        str(np.nan) for x in xrange(len(tool_result_names))
+                    ]
+                else:
+                    vals = label_values_lut[mapobject_id]
+                    tool_result_values = list()
+                    for tid in tool_result_ids:
+                        try:
+                            v = vals[str(tid)]
+                        except KeyError:
+                            v = str(np.nan)
+                        tool_result_values.append(v)
+                    metadata_values += tool_result_values
+                w.writerow(tuple(metadata_values))
+            return data.getvalue()
+
+        # Partitions are read concurrently, but chunks are yielded in the
+        # order of the reference objects such that the table is deterministic.
+        ref_ids = sorted(ref_position_lut.keys())
+        chunks = map_partitions(
+            collect_metadata, ref_ids, server_cfg.export_workers
+        )
+        for chunk in chunks:
+            if chunk:
+                yield chunk
 
-                    if 'well_pos_y' in ref_position_lut[ref_id]:
-                        metadata_values.extend([
-                            str(ref_position_lut[ref_id]['well_pos_y']),
-                            str(ref_position_lut[ref_id]['well_pos_x']),
-                        ])
-
-                    if layer_lut[segmenation_layer_id]['tpoint'] is not None:
-                        metadata_values.extend([
-                            str(layer_lut[segmenation_layer_id]['tpoint']),
-                            str(layer_lut[segmenation_layer_id]['zplane']),
-                            str(label),
-                            str(1 if mapobject_id in border_mapobject_ids else 0)
-                        ])
-
-                    if mapobject_id not in label_values_lut:
-                        if warn:
-                            logger.warn(
-                                'no label values found for mapobject %d',
-                                mapobject_id
-                            )
-                        metadata_values += [
-                            str(np.nan) for x in xrange(len(tool_result_names))
-                        ]
-                    else:
-                        vals = label_values_lut[mapobject_id]
-                        tool_result_values = list()
-                        for tid in tool_result_ids:
-                            try:
-                                v = vals[str(tid)]
-                            except KeyError:
-                                v = str(np.nan)
-                            tool_result_values.append(v)
-                        metadata_values += tool_result_values
-                    w.writerow(tuple(metadata_values))
-                yield data.getvalue()
-                data.seek(0)
-                data.truncate(0)
-
-    return Response(
+    return _create_table_response(
         generate_feature_matrix(mapobject_type_id, mapobject_type_ref_type),
-        mimetype='text/csv',
-        headers={
-            'Content-Disposition': 'attachment; filename={filename}'.format(
-                filename=filename
+        'text/csv', filename, cache_key=cache_key, compress=True
+    )
+
+
+@api.route(
+    '/experiments/<experiment_id>/mapobject_types/<mapobject_type_id>/table',
+    methods=['GET']
+)
+@jwt_required()
+@decode_query_ids('read')
+def get_mapobject_table(experiment_id, mapobject_type_id):
+    """
+    .. http:get:: /api/experiments/(string:experiment_id)/mapobject_types/(string:mapobject_type_id)/table
+
+        Get metadata, :class:`LabelValues <tmlib.models.result.LabelValues>`
+        and :class:`FeatureValues <tmlib.models.feature.FeatureValues>`
+        for objects of the given
+        :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>` in form
+        of a single table with a row for each
+        :class:`Mapobject <tmlib.models.mapobject.Mapobject>`. The table
+        combines the columns of the tables provided by the
+        ``metadata`` and ``feature-values`` resources, but all data is
+        collected in a single pass.
+
+        :query plate_name: name of the plate (optional)
+        :query well_name: name of the well (optional)
+        :query well_pos_x: x-coordinate of the site within the well (optional)
+        :query well_pos_y: y-coordinate of the site within the well (optional)
+        :query tpoint: time point (optional)
+        :query features: names or IDs of features that should be exported
+            (optional, default: all features of the mapobject type)
+        :query mapobject_ids: IDs of mapobjects that should be exported (optional)
+        :query mapobject_id_min: smallest ID of exported mapobjects (optional)
+        :query mapobject_id_max: largest ID of exported mapobjects (optional)
+        :query format: format of the table: ``"csv"`` (default) or
+            ``"arrow"`` (optional)
+
+        :reqheader Authorization: JWT token issued by the server
+        :statuscode 200: no error
+        :statuscode 400: malformed request
+        :statuscode 401: unauthorized
+        :statuscode 404: not found
+
+    .. note:: Columns are ordered as follows: "mapobject_id", metadata
+        (e.g. "plate_name" or "is_border"), one column per
+        :class:`ToolResult <tmlib.models.result.ToolResult>` and one column
+        per feature. Values of tool results and features are represented as
+        ``float64`` in *Apache Arrow* streams. *CSV* streams are compressed
+        and cached like the ones of the ``feature-values`` resource.
+    """
+    plate_name = request.args.get('plate_name')
+    well_name = request.args.get('well_name')
+    well_pos_x = request.args.get('well_pos_x', type=int)
+    well_pos_y = request.args.get('well_pos_y', type=int)
+    tpoint = request.args.get('tpoint', type=int)
+    feature_selection = get_list_query_param('features')
+    selected_mapobject_ids = get_list_query_param('mapobject_ids', type=int)
+    mapobject_id_min = request.args.get('mapobject_id_min', type=int)
+    mapobject_id_max = request.args.get('mapobject_id_max', type=int)
+    if mapobject_id_min is None and mapobject_id_max is None:
+        mapobject_id_range = None
+    else:
+        mapobject_id_range = (mapobject_id_min, mapobject_id_max)
+    table_format = request.args.get('format', 'csv')
+
+    try:
+        writer_cls = get_table_writer_class(table_format)
+    except ValueError as err:
+        raise MalformedRequestError(str(err))
+    if not writer_cls.supports_metadata:
+        raise MalformedRequestError(
+            'Format "%s" is not supported for this resource.' % table_format
+        )
+
+    with tm.utils.MainSession() as session:
+        experiment = session.query(tm.ExperimentReference).get(experiment_id)
+        experiment_name = experiment.name
+
+    with tm.utils.ExperimentSession(experiment_id) as session:
+        mapobject_type = session.query(tm.MapobjectType).\
+            get(mapobject_type_id)
+        mapobject_type_name = mapobject_type.name
+        mapobject_type_ref_type = mapobject_type.ref_type
+        features = _get_matching_features(
+            session, mapobject_type_id, feature_selection
+        )
+        feature_names = [f.name for f in features]
+        feature_keys = [str(f.id) for f in features]
+        tool_results = session.query(tm.ToolResult.id, tm.ToolResult.name).\
+            filter_by(mapobject_type_id=mapobject_type_id).\
+            order_by(tm.ToolResult.id).\
+            all()
+        tool_result_names = [t.name for t in tool_results]
+        tool_result_keys = [str(t.id) for t in tool_results]
+        cache_key = _get_export_cache_key(
+            session, experiment_id, mapobject_type_id, feature_keys,
+            tool_result_keys
+        )
+
+    if mapobject_type_ref_type in {'Plate', 'Well'}:
+        if well_pos_y is not None:
+            raise MalformedRequestError(
+                'Invalid query parameter "well_pos_y" for mapobjects of type '
+                '"{0}"'.format(mapobject_type_name)
+            )
+        if well_pos_x is not None:
+            raise MalformedRequestError(
+                'Invalid query parameter "well_pos_x" for mapobjects of type '
+                '"{0}"'.format(mapobject_type_name)
+            )
+        if mapobject_type_ref_type == 'Plate':
+            if well_name is not None:
+                raise MalformedRequestError(
+                    'Invalid query parameter "well_name" for mapobjects of type '
+                    '"{0}"'.format(mapobject_type_name)
+                )
+
+    filename_formatstring = '{experiment}'
+    if plate_name is not None:
+        filename_formatstring += '_{plate}'
+    if well_name is not None:
+        filename_formatstring += '_{well}'
+    if well_pos_y is not None:
+        filename_formatstring += '_y{y}'
+    if well_pos_x is not None:
+        filename_formatstring += '_x{x}'
+    if tpoint is not None:
+        filename_formatstring += '_t{t}'
+    filename_formatstring += '_{object_type}.{extension}'
+    filename = filename_formatstring.format(
+        experiment=experiment_name, plate=plate_name, well=well_name,
+        y=well_pos_y, x=well_pos_x,
+        t=tpoint, object_type=mapobject_type_name,
+        extension=writer_cls.extension
+    )
+
+    def generate_table(mapobject_type_id, ref_type):
+        with tm.utils.ExperimentSession(experiment_id) as session:
+
+            results = _get_matching_layers(session, tpoint)
+            layer_lut = dict()
+            for r in results:
+                layer_lut[r.id] = (r.tpoint, r.zplane)
+
+            if ref_type == 'Plate':
+                results = _get_matching_plates(
+                    session, experiment_id, plate_name
+                )
+                ref_position_lut = {r.id: [r.plate_name] for r in results}
+                metadata_columns = [('plate_name', 'str')]
+            elif ref_type == 'Well':
+                results = _get_matching_wells(
+                    session, experiment_id, plate_name, well_name
+                )
+                ref_position_lut = {
+                    r.id: [r.plate_name, r.well_name] for r in results
+                }
+                metadata_columns = [
+                    ('plate_name', 'str'), ('well_name', 'str')
+                ]
+            elif ref_type == 'Site':
+                results = _get_matching_sites(
+                    session, experiment_id, plate_name, well_name,
+                    well_pos_y, well_pos_x
+                )
+                ref_position_lut = {
+                    r.id: [
+                        r.plate_name, r.well_name, r.well_pos_y, r.well_pos_x
+                    ]
+                    for r in results
+                }
+                metadata_columns = [
+                    ('plate_name', 'str'), ('well_name', 'str'),
+                    ('well_pos_y', 'int'), ('well_pos_x', 'int'),
+                    ('tpoint', 'int'), ('zplane', 'int'), ('label', 'int'),
+                    ('is_border', 'int')
+                ]
+            ref_ids = _get_matching_partitions(
+                session, mapobject_type_id, sorted(ref_position_lut.keys()),
+                selected_mapobject_ids, mapobject_id_range
             )
+
+            ref_mapobject_type = session.query(tm.MapobjectType.id).\
+                filter_by(ref_type=ref_type).\
+                order_by(tm.MapobjectType.id).\
+                first()
+
+        def collect_rows(ref_id):
+            logger.debug('collect table rows for %s %d', ref_type, ref_id)
+            ids = list()
+            metadata = list()
+            rows = list()
+            with tm.utils.ExperimentSession(experiment_id) as session:
+                mapobjects = _get_mapobjects_at_ref_position(
+                    session, mapobject_type_id, ref_id, layer_lut.keys(),
+                    selected_mapobject_ids, mapobject_id_range
+                )
+                mapobject_ids = [m.id for m in mapobjects]
+
+                if not mapobject_ids:
+                    logger.warn(
+                        'no mapobjects found for %s %d', ref_type, ref_id
+                    )
+                    return (ids, rows, metadata)
+
+                border_mapobject_ids = set()
+                if ref_type == 'Site':
+                    border_mapobject_ids = _get_border_mapobject_ids(
+                        session, experiment_id, mapobject_type_id,
+                        ref_mapobject_type.id, ref_id, mapobjects,
+                        selected_mapobject_ids is None and
+                        mapobject_id_range is None
+                    )
+
+                if feature_selection is not None:
+                    values = tm.FeatureValues.values.slice(array(feature_keys))
+                else:
+                    values = tm.FeatureValues.values
+                feature_values = session.query(
+                        tm.FeatureValues.mapobject_id, values
+                    ).\
+                    filter(tm.FeatureValues.mapobject_id.in_(mapobject_ids)).\
+                    all()
+                feature_values_lut = dict(feature_values)
+                label_values_lut = dict()
+                if tool_result_keys:
+                    label_values = session.query(
+                            tm.LabelValues.mapobject_id, tm.LabelValues.values
+                        ).\
+                        filter(tm.LabelValues.mapobject_id.in_(mapobject_ids)).\
+                        all()
+                    label_values_lut = dict(label_values)
+
+            nan = str(np.nan)
+            for mapobject_id, label, segmentation_layer_id in mapobjects:
+                m = list(ref_position_lut[ref_id])
+                if ref_type == 'Site':
+                    m.extend(layer_lut[segmentation_layer_id])
+                    m.extend([
+                        label, int(mapobject_id in border_mapobject_ids)
+                    ])
+                label_vals = label_values_lut.get(mapobject_id, {})
+                feature_vals = feature_values_lut.get(mapobject_id, {})
+                ids.append(mapobject_id)
+                metadata.append(m)
+                rows.append(
+                    [label_vals.get(k, nan) for k in tool_result_keys] +
+                    [feature_vals.get(k, nan) for k in feature_keys]
+                )
+            return (ids, rows, metadata)
+
+        chunks = map_partitions(
+            collect_rows, ref_ids, server_cfg.export_workers
+        )
+        writer = writer_cls(
+            tool_result_names + feature_names, metadata_columns
+        )
+        for data in stream_table(writer, chunks):
+            yield data
+
+    return _create_table_response(
+        generate_table(mapobject_type_id, mapobject_type_ref_type),
+        writer_cls.mimetype, filename, cache_key=cache_key,
+        compress=(table_format == 'csv')
+    )
+
+
+@api.route(
+    '/experiments/<experiment_id>/mapobject_types/<mapobject_type_id>/feature-statistics',
+    methods=['GET']
+)
+@jwt_required()
+@assert_query_params('features')
+@decode_query_ids('read')
+def get_feature_statistics(experiment_id, mapobject_type_id):
+    """
+    .. http:get:: /api/experiments/(string:experiment_id)/mapobject_types/(string:mapobject_type_id)/feature-statistics
+
+        Get summary statistics of
+        :class:`FeatureValues <tmlib.models.feature.FeatureValues>` of
+        objects of the given
+        :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+        aggregated per :class:`Plate <tmlib.models.plate.Plate>`,
+        :class:`Well <tmlib.models.well.Well>` or
+        :class:`Site <tmlib.models.site.Site>`, e.g. for a plate overview.
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+            Content-Type: application/json
+
+            {
+                "data": [
+                    {
+                        "plate_name": "plate01",
+                        "well_name": "D04",
+                        "features": {
+                            "Morphology_Area": {
+                                "count": 2345,
+                                "mean": 812.4,
+                                "std": 154.2,
+                                "median": 790.0,
+                                "quantiles": {"0.1": 623.0, "0.9": 1021.0}
+                            }
+                        }
+                    },
+                    ...
+                ]
+            }
+
+        :query features: names or IDs of features (required)
+        :query level: ``"plate"``, ``"well"`` (default) or ``"site"``
+            (optional)
+        :query quantiles: quantiles between 0 and 1 that should be computed
+            in addition to the median (optional)
+        :query plate_name: name of the plate (optional)
+        :query tpoint: time point (optional)
+
+        :reqheader Authorization: JWT token issued by the server
+        :statuscode 200: no error
+        :statuscode 400: malformed request
+        :statuscode 401: unauthorized
+        :statuscode 404: not found
+
+    .. note:: Statistics ignore missing values and are ``null`` when there
+        are no values. The standard deviation is the sample standard
+        deviation. Results are cached on the server until data of the
+        experiment changes.
+    """
+    feature_selection = get_list_query_param('features')
+    quantiles = get_list_query_param('quantiles', type=float) or []
+    level = request.args.get('level', 'well')
+    plate_name = request.args.get('plate_name')
+    tpoint = request.args.get('tpoint', type=int)
+
+    if any([q < 0 or q > 1 for q in quantiles]):
+        raise MalformedRequestError('Quantiles must be between 0 and 1.')
+    levels = ['plate', 'well', 'site']
+    if level not in levels:
+        raise MalformedRequestError(
+            'Query parameter "level" must be one of the following: "%s"'
+            % '", "'.join(levels)
+        )
+    group_fields = [
+        ['plate_name'],
+        ['plate_name', 'well_name'],
+        ['plate_name', 'well_name', 'well_pos_y', 'well_pos_x']
+    ][levels.index(level)]
+
+    with tm.utils.ExperimentSession(experiment_id) as session:
+        mapobject_type = session.query(tm.MapobjectType).\
+            get(mapobject_type_id)
+        ref_type = mapobject_type.ref_type
+        features = _get_matching_features(
+            session, mapobject_type_id, feature_selection
+        )
+        feature_names = [f.name for f in features]
+        feature_keys = [str(f.id) for f in features]
+        cache_key = _get_export_cache_key(
+            session, experiment_id, mapobject_type_id, feature_keys
+        )
+        if levels.index(level) > levels.index(ref_type.lower()):
+            raise MalformedRequestError(
+                'Mapobjects of type "%s" cannot be aggregated per %s.' % (
+                    mapobject_type.name, level
+                )
+            )
+        if ref_type == 'Plate':
+            partitions = _get_matching_plates(
+                session, experiment_id, plate_name
+            )
+        elif ref_type == 'Well':
+            partitions = _get_matching_wells(
+                session, experiment_id, plate_name, None
+            )
+        elif ref_type == 'Site':
+            partitions = _get_matching_sites(
+                session, experiment_id, plate_name, None, None, None
+            )
+
+    # Partitions are visited group by group, such that only the values of a
+    # single group need to be kept in memory.
+    def get_group(partition):
+        return tuple([getattr(partition, f) for f in group_fields])
+
+    partitions = sorted(partitions, key=lambda p: (get_group(p), p.id))
+
+    def collect_values(partition_id):
+        logger.debug(
+            'collect feature values for %s %d', ref_type, partition_id
+        )
+        with tm.utils.ExperimentSession(experiment_id) as session:
+            return _get_feature_value_matrix(
+                session, mapobject_type_id, partition_id, feature_keys, tpoint
+            )
+
+    def summarize_group(group, matrices):
+        values = np.concatenate(matrices, axis=0)
+        result = dict(zip(group_fields, group))
+        result['features'] = {
+            name: summarize(values[:, i], quantiles)
+            for i, name in enumerate(feature_names)
         }
+        return result
+
+    def compute_statistics():
+        logger.info(
+            'compute statistics of %d features of mapobject type %d per %s',
+            len(feature_keys), mapobject_type_id, level
+        )
+        results = list()
+        current_group = None
+        matrices = list()
+        chunks = map_partitions(
+            collect_values, [p.id for p in partitions],
+            server_cfg.export_workers
+        )
+        for partition, values in itertools.izip(partitions, chunks):
+            group = get_group(partition)
+            if group != current_group and matrices:
+                results.append(summarize_group(current_group, matrices))
+                matrices = list()
+            current_group = group
+            matrices.append(values)
+        if matrices:
+            results.append(summarize_group(current_group, matrices))
+        return results
+
+    return _create_cached_json_response(cache_key, compute_statistics)
+
+
+@api.route(
+    '/experiments/<experiment_id>/mapobject_types/<mapobject_type_id>/feature-histogram',
+    methods=['GET']
+)
+@jwt_required()
+@assert_query_params('features')
+@decode_query_ids('read')
+def get_feature_histogram(experiment_id, mapobject_type_id):
+    """
+    .. http:get:: /api/experiments/(string:experiment_id)/mapobject_types/(string:mapobject_type_id)/feature-histogram
+
+        Get the histogram of one
+        :class:`Feature <tmlib.models.feature.Feature>` or the binned
+        2D density of two features for objects of the given
+        :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`.
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+            Content-Type: application/json
+
+            {
+                "data": {
+                    "features": ["Morphology_Area"],
+                    "edges": [[0.0, 250.0, 500.0, 750.0, 1000.0]],
+                    "counts": [1203, 48221, 20345, 712],
+                    "missing": 3
+                }
+            }
+
+        :query features: names or IDs of one or two features (required)
+        :query bins: number of bins per feature (optional, default: ``50``)
+        :query limits: lower and upper limit of the bins per feature, e.g.
+            ``0,1000`` for one feature or ``0,1000,0.5,1.5`` for two
+            features (optional, default: range of values)
+        :query plate_name: name of the plate (optional)
+        :query well_name: name of the well (optional)
+        :query well_pos_x: x-coordinate of the site within the well (optional)
+        :query well_pos_y: y-coordinate of the site within the well (optional)
+        :query tpoint: time point (optional)
+        :query mapobject_ids: IDs of mapobjects (optional)
+        :query mapobject_id_min: smallest ID of mapobjects (optional)
+        :query mapobject_id_max: largest ID of mapobjects (optional)
+
+        :reqheader Authorization: JWT token issued by the server
+        :statuscode 200: no error
+        :statuscode 400: malformed request
+        :statuscode 401: unauthorized
+        :statuscode 404: not found
+
+    .. note:: For two features, "counts" is a nested list, where the first
+        dimension corresponds to the first feature. Values outside the limits
+        are ignored, objects with missing values are counted as "missing".
+        Results are cached on the server until data of the experiment
+        changes.
+    """
+    feature_selection = get_list_query_param('features')
+    bins = request.args.get('bins', 50, type=int)
+    limits = get_list_query_param('limits', type=float)
+    plate_name = request.args.get('plate_name')
+    well_name = request.args.get('well_name')
+    well_pos_x = request.args.get('well_pos_x', type=int)
+    well_pos_y = request.args.get('well_pos_y', type=int)
+    tpoint = request.args.get('tpoint', type=int)
+    selected_mapobject_ids = get_list_query_param('mapobject_ids', type=int)
+    mapobject_id_min = request.args.get('mapobject_id_min', type=int)
+    mapobject_id_max = request.args.get('mapobject_id_max', type=int)
+    if mapobject_id_min is None and mapobject_id_max is None:
+        mapobject_id_range = None
+    else:
+        mapobject_id_range = (mapobject_id_min, mapobject_id_max)
+
+    if len(feature_selection) not in {1, 2}:
+        raise MalformedRequestError('Either one or two features are required.')
+    if bins < 1 or bins > 10000:
+        raise MalformedRequestError(
+            'Query parameter "bins" must be between 1 and 10000.'
+        )
+    if limits is not None:
+        if len(limits) != 2 * len(feature_selection):
+            raise MalformedRequestError(
+                'Query parameter "limits" requires a lower and an upper limit '
+                'for each feature.'
+            )
+        limits = zip(limits[0::2], limits[1::2])
+        if any([lower > upper for lower, upper in limits]):
+            raise MalformedRequestError(
+                'Lower limits must not be larger than upper limits.'
+            )
+
+    with tm.utils.ExperimentSession(experiment_id) as session:
+        mapobject_type = session.query(tm.MapobjectType).\
+            get(mapobject_type_id)
+        ref_type = mapobject_type.ref_type
+        features = _get_matching_features(
+            session, mapobject_type_id, feature_selection
+        )
+        feature_names = [f.name for f in features]
+        feature_keys = [str(f.id) for f in features]
+        cache_key = _get_export_cache_key(
+            session, experiment_id, mapobject_type_id, feature_keys
+        )
+
+        if ref_type == 'Plate':
+            results = _get_matching_plates(session, experiment_id, plate_name)
+        elif ref_type == 'Well':
+            results = _get_matching_wells(
+                session, experiment_id, plate_name, well_name
+            )
+        elif ref_type == 'Site':
+            results = _get_matching_sites(
+                session, experiment_id, plate_name, well_name,
+                well_pos_y, well_pos_x
+            )
+        ref_ids = _get_matching_partitions(
+            session, mapobject_type_id, [r.id for r in results],
+            selected_mapobject_ids, mapobject_id_range
+        )
+        is_filtered_by_position = any([
+            p is not None
+            for p in [plate_name, well_name, well_pos_y, well_pos_x]
+        ])
+
+    def collect_values(ref_id):
+        with tm.utils.ExperimentSession(experiment_id) as session:
+            return _get_feature_value_matrix(
+                session, mapobject_type_id, ref_id, feature_keys, tpoint,
+                selected_mapobject_ids, mapobject_id_range
+            )
+
+    def compute_histogram():
+        if limits is None:
+            logger.debug('determine limits of bins')
+            with tm.utils.ExperimentSession(experiment_id) as session:
+                value_limits = [
+                    _get_feature_value_limits(
+                        session, mapobject_type_id, key,
+                        ref_ids if is_filtered_by_position else None,
+                        tpoint, selected_mapobject_ids, mapobject_id_range
+                    )
+                    for key in feature_keys
+                ]
+            value_limits = [
+                (0.0, 0.0) if lower is None else (lower, upper)
+                for lower, upper in value_limits
+            ]
+        else:
+            value_limits = limits
+        hist = Histogram.from_range(
+            value_limits, [bins for k in feature_keys]
+        )
+        logger.info(
+            'compute histogram of %d features of mapobject type %d',
+            len(feature_keys), mapobject_type_id
+        )
+        chunks = map_partitions(
+            collect_values, ref_ids, server_cfg.export_workers
+        )
+        for values in chunks:
+            hist.add(values)
+        result = hist.to_dict()
+        result['features'] = feature_names
+        return result
+
+    return _create_cached_json_response(cache_key, compute_histogram)
+
+
+@api.route(
+    '/experiments/<experiment_id>/mapobject_types/<mapobject_type_id>/feature-values/sample',
+    methods=['GET']
+)
+@jwt_required()
+@assert_query_params('size')
+@decode_query_ids('read')
+def get_feature_values_sample(experiment_id, mapobject_type_id):
+    """
+    .. http:get:: /api/experiments/(string:experiment_id)/mapobject_types/(string:mapobject_type_id)/feature-values/sample
+
+        Get :class:`FeatureValues <tmlib.models.feature.FeatureValues>`
+        of a random sample of objects of the given
+        :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`.
+        The table has the same format as the one of the ``feature-values``
+        resource, but with an additional "mapobject_id" column in case of
+        *CSV*.
+
+        :query size: number of mapobjects in the sample or in each stratum
+            if the sample is stratified (required)
+        :query seed: seed of the sample (optional, default: ``0``)
+        :query stratify: ``"plate"`` or ``"well"`` to sample the same number
+            of mapobjects from each plate or well (optional)
+        :query plate_name: name of the plate (optional)
+        :query features: names or IDs of features that should be exported
+            (optional, default: all features of the mapobject type)
+        :query format: format of the table: ``"csv"`` (default), ``"arrow"``,
+            ``"npz"`` or ``"hdf5"`` (optional)
+
+        :reqheader Authorization: JWT token issued by the server
+        :statuscode 200: no error
+        :statuscode 400: malformed request
+        :statuscode 401: unauthorized
+        :statuscode 404: not found
+
+    .. note:: Mapobjects are ordered by a hash of their ID and the seed,
+        such that the same seed always results in the same sample (as long
+        as the mapobjects don't change). Rows are sorted by partition and
+        mapobject ID.
+    """
+    size = request.args.get('size', type=int)
+    seed = request.args.get('seed', 0, type=int)
+    stratify = request.args.get('stratify')
+    plate_name = request.args.get('plate_name')
+    feature_selection = get_list_query_param('features')
+    table_format = request.args.get('format', 'csv')
+
+    if size is None or size < 1:
+        raise MalformedRequestError(
+            'Query parameter "size" must be a positive integer.'
+        )
+    levels = ['plate', 'well', 'site']
+    if stratify is not None and stratify not in levels[:2]:
+        raise MalformedRequestError(
+            'Query parameter "stratify" must be either "plate" or "well".'
+        )
+    try:
+        writer_cls = get_table_writer_class(table_format)
+    except ValueError as err:
+        raise MalformedRequestError(str(err))
+
+    with tm.utils.MainSession() as session:
+        experiment = session.query(tm.ExperimentReference).get(experiment_id)
+        experiment_name = experiment.name
+
+    with tm.utils.ExperimentSession(experiment_id) as session:
+        mapobject_type = session.query(tm.MapobjectType).\
+            get(mapobject_type_id)
+        mapobject_type_name = mapobject_type.name
+        ref_type = mapobject_type.ref_type
+        features = _get_matching_features(
+            session, mapobject_type_id, feature_selection
+        )
+        feature_names = [f.name for f in features]
+        feature_keys = [str(f.id) for f in features]
+        cache_key = _get_export_cache_key(
+            session, experiment_id, mapobject_type_id, feature_keys
+        )
+        if stratify is not None:
+            if levels.index(stratify) > levels.index(ref_type.lower()):
+                raise MalformedRequestError(
+                    'Mapobjects of type "%s" cannot be stratified by %s.' % (
+                        mapobject_type_name, stratify
+                    )
+                )
+        if ref_type == 'Plate':
+            partitions = _get_matching_plates(
+                session, experiment_id, plate_name
+            )
+        elif ref_type == 'Well':
+            partitions = _get_matching_wells(
+                session, experiment_id, plate_name, None
+            )
+        elif ref_type == 'Site':
+            partitions = _get_matching_sites(
+                session, experiment_id, plate_name, None, None, None
+            )
+
+    strata = _group_partitions(partitions, stratify)
+
+    filename = '{experiment}_{object_type}_sample-{seed}.{extension}'.format(
+        experiment=experiment_name, object_type=mapobject_type_name,
+        seed=seed, extension=writer_cls.extension
+    )
+
+    def sample_stratum(partition_ids):
+        with tm.utils.ExperimentSession(experiment_id) as session:
+            return session.query(
+                    tm.Mapobject.id, tm.Mapobject.partition_key
+                ).\
+                filter(
+                    tm.Mapobject.mapobject_type_id == mapobject_type_id,
+                    tm.Mapobject.partition_key.in_(partition_ids)
+                ).\
+                order_by(_get_sample_order(seed, tm.Mapobject.id)).\
+                limit(size).\
+                all()
+
+    def generate_sample():
+        logger.info(
+            'sample %d mapobjects of type %d from each of %d strata',
+            size, mapobject_type_id, len(strata)
+        )
+        sample = collections.defaultdict(list)
+        strata_samples = map_partitions(
+            sample_stratum, strata.values(), server_cfg.export_workers
+        )
+        for mapobjects in strata_samples:
+            for mapobject_id, partition_key in mapobjects:
+                sample[partition_key].append(mapobject_id)
+
+        def collect_feature_values(partition_key):
+            with tm.utils.ExperimentSession(experiment_id) as session:
+                return _get_feature_values_of_mapobjects(
+                    session, partition_key, sorted(sample[partition_key]),
+                    feature_keys, feature_selection is not None
+                )
+
+        chunks = map_partitions(
+            collect_feature_values, sorted(sample.keys()),
+            server_cfg.export_workers
+        )
+        if writer_cls is CSVWriter:
+            writer = writer_cls(feature_names, include_ids=True)
+        else:
+            writer = writer_cls(feature_names)
+        for data in stream_table(writer, chunks):
+            yield data
+
+    return _create_table_response(
+        generate_sample(), writer_cls.mimetype, filename,
+        cache_key=cache_key, compress=(table_format == 'csv')
+    )
+
+
+@api.route(
+    '/experiments/<experiment_id>/mapobject_types/<mapobject_type_id>/mapobject-ids',
+    methods=['GET']
+)
+@jwt_required()
+@assert_query_params('where')
+@decode_query_ids('read')
+def query_mapobject_ids(experiment_id, mapobject_type_id):
+    """
+    .. http:get:: /api/experiments/(string:experiment_id)/mapobject_types/(string:mapobject_type_id)/mapobject-ids
+
+        Get the IDs of objects of the given
+        :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`
+        whose :class:`FeatureValues <tmlib.models.feature.FeatureValues>`
+        satisfy a boolean expression, e.g.
+        ``Morphology_Area > 500 and Intensity_mean < 0.2``.
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+            Content-Type: application/octet-stream
+
+        :query where: expression of comparisons of features with numbers,
+            combined with ``and``, ``or``, ``not`` and parentheses; feature
+            names with special characters must be quoted (required)
+        :query tpoint: time point (optional)
+
+        :reqheader Authorization: JWT token issued by the server
+        :statuscode 200: no error
+        :statuscode 400: malformed request
+        :statuscode 401: unauthorized
+        :statuscode 404: not found
+
+    .. note:: IDs are sent in ascending order as a stream of little-endian
+        64-bit integers. Missing values don't satisfy any comparison.
+    """
+    expression = request.args.get('where')
+    tpoint = request.args.get('tpoint', type=int)
+    try:
+        predicate = parse_predicate(expression)
+    except ValueError as err:
+        raise MalformedRequestError(str(err))
+
+    with tm.utils.ExperimentSession(experiment_id) as session:
+        features = _get_matching_features(
+            session, mapobject_type_id, get_feature_names(predicate)
+        )
+    feature_keys = [str(f.id) for f in features]
+    columns = {
+        name: cast(tm.FeatureValues.values[key], Float)
+        for name, key in zip(get_feature_names(predicate), feature_keys)
+    }
+    condition = compile_predicate(predicate, columns)
+    _record_feature_query(experiment_id, feature_keys)
+
+    def generate_ids():
+        logger.info(
+            'query mapobjects of type %d of experiment %d where %s',
+            mapobject_type_id, experiment_id, expression
+        )
+        with tm.utils.ExperimentSession(experiment_id) as session:
+            # Only mapobjects of the given type have values for its
+            # features, such that there is no need to join mapobjects.
+            query = session.query(tm.FeatureValues.mapobject_id).\
+                filter(condition)
+            if tpoint is not None:
+                query = query.filter(tm.FeatureValues.tpoint == tpoint)
+            query = query.order_by(tm.FeatureValues.mapobject_id)
+            buf = list()
+            for r in query.yield_per(10000):
+                buf.append(r[0])
+                if len(buf) == 10000:
+                    yield np.array(buf, dtype='<i8').tobytes()
+                    buf = list()
+            if buf:
+                yield np.array(buf, dtype='<i8').tobytes()
+
+    return Response(generate_ids(), mimetype='application/octet-stream')
+
+
+def _read_mapobject_ids():
+    if request.mimetype == 'application/json':
+        data = request.get_json()
+        if not isinstance(data, dict) or 'mapobject_ids' not in data:
+            raise MissingPOSTParameterError('mapobject_ids')
+        try:
+            return [int(i) for i in data['mapobject_ids']]
+        except (TypeError, ValueError):
+            raise MalformedRequestError(
+                'Parameter "mapobject_ids" must be a list of integers.'
+            )
+    data = request.get_data()
+    if len(data) % 8 != 0:
+        raise MalformedRequestError(
+            'Request body must consist of little-endian 64-bit integers.'
+        )
+    return np.frombuffer(data, dtype='<i8').tolist()
+
+
+@api.route(
+    '/experiments/<experiment_id>/mapobject_types/<mapobject_type_id>/feature-values/lookup',
+    methods=['POST']
+)
+@jwt_required()
+@decode_query_ids('read')
+def lookup_feature_values(experiment_id, mapobject_type_id):
+    """
+    .. http:post:: /api/experiments/(string:experiment_id)/mapobject_types/(string:mapobject_type_id)/feature-values/lookup
+
+        Get :class:`FeatureValues <tmlib.models.feature.FeatureValues>`
+        of an explicit list of objects of the given
+        :class:`MapobjectType <tmlib.models.mapobject.MapobjectType>`,
+        e.g. of objects selected by the user.
+
+        The IDs are either sent as a stream of little-endian 64-bit integers
+        (``Content-Type: application/octet-stream``), i.e. in the format
+        returned by the ``mapobject-ids`` resource, or as JSON:
+
+        **Example request**:
+
+        .. sourcecode:: http
+
+            Content-Type: application/json
+
+            {
+                "mapobject_ids": [243, 17, 5012]
+            }
+
+        :query features: names or IDs of features that should be exported
+            (optional, default: all features of the mapobject type)
+        :query format: format of the table: ``"npz"`` (default),
+            ``"arrow"``, ``"hdf5"`` or ``"csv"`` (optional)
+
+        :reqheader Authorization: JWT token issued by the server
+        :statuscode 200: no error
+        :statuscode 400: malformed request
+        :statuscode 401: unauthorized
+        :statuscode 404: not found
+
+    .. note:: Rows are in the order of the requested IDs. The number of IDs
+        per request is limited by
+        :attr:`feature_lookup_max_ids <tmserver.config.ServerConfig.feature_lookup_max_ids>`.
+    """
+    feature_selection = get_list_query_param('features')
+    table_format = request.args.get('format', 'npz')
+    try:
+        writer_cls = get_table_writer_class(table_format)
+    except ValueError as err:
+        raise MalformedRequestError(str(err))
+    mapobject_ids = _read_mapobject_ids()
+    max_ids = server_cfg.feature_lookup_max_ids
+    if len(mapobject_ids) > max_ids:
+        raise MalformedRequestError(
+            'Feature values of at most %d mapobjects can be requested at once.'
+            % max_ids
+        )
+    logger.info(
+        'look up feature values of %d mapobjects of type %d',
+        len(mapobject_ids), mapobject_type_id
+    )
+
+    with tm.utils.ExperimentSession(experiment_id) as session:
+        features = _get_matching_features(
+            session, mapobject_type_id, feature_selection
+        )
+        feature_names = [f.name for f in features]
+        feature_keys = [str(f.id) for f in features]
+        mapobjects = list()
+        if mapobject_ids:
+            mapobjects = session.query(
+                    tm.Mapobject.id, tm.Mapobject.partition_key
+                ).\
+                filter(
+                    tm.Mapobject.mapobject_type_id == mapobject_type_id,
+                    tm.Mapobject.id.in_(set(mapobject_ids))
+                ).\
+                all()
+
+    partitions = collections.defaultdict(list)
+    for mapobject_id, partition_key in mapobjects:
+        partitions[partition_key].append(mapobject_id)
+    unknown_ids = set(mapobject_ids) - set([m.id for m in mapobjects])
+    if unknown_ids:
+        raise ResourceNotFoundError(tm.Mapobject, id=min(unknown_ids))
+
+    def collect_feature_values(partition_key):
+        with tm.utils.ExperimentSession(experiment_id) as session:
+            return _get_feature_values_of_mapobjects(
+                session, partition_key, partitions[partition_key],
+                feature_keys, feature_selection is not None
+            )
+
+    # Each partition is only queried once and rows are put back into the
+    # requested order afterwards.
+    rows_lut = dict()
+    chunks = map_partitions(
+        collect_feature_values, sorted(partitions.keys()),
+        server_cfg.export_workers
+    )
+    for ids, rows in chunks:
+        rows_lut.update(itertools.izip(ids, rows))
+    rows = [rows_lut[i] for i in mapobject_ids]
+
+    if writer_cls is CSVWriter:
+        writer = writer_cls(feature_names, include_ids=True)
+    else:
+        writer = writer_cls(feature_names)
+    filename = 'feature-values.{extension}'.format(
+        extension=writer_cls.extension
+    )
+    return _create_table_response(
+        stream_table(writer, [(mapobject_ids, rows)]), writer_cls.mimetype,
+        filename, compress=(table_format == 'csv')
     )
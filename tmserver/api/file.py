@@ -29,6 +29,7 @@ from tmserver.util import (
     assert_query_params, assert_form_params
 )
 from tmserver.api import api
+from tmserver.lookup import get_site_id
 from tmserver.error import *
 
 
@@ -90,15 +91,9 @@ def get_channel_image_file(experiment_id, channel_id):
         experiment = session.query(tm.ExperimentReference).get(experiment_id)
         experiment_name = experiment.name
     with tm.utils.ExperimentSession(experiment_id) as session:
-        site_id = session.query(tm.Site.id).\
-            join(tm.Well).\
-            join(tm.Plate).\
-            filter(
-                tm.Plate.name == plate_name,
-                tm.Well.name == well_name,
-                tm.Site.x == x, tm.Site.y == y
-            ).\
-            one()[0]
+        site_id = get_site_id(
+            session, experiment_id, plate_name, well_name, y, x
+        )
         channel = session.query(tm.Channel).get(channel_id)
         channel_name = channel.name
         image_file = session.query(tm.ChannelImageFile).\
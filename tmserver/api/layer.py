@@ -20,6 +20,7 @@ import json
 import logging
 from flask import jsonify, request, send_file
 from flask_jwt import jwt_required
+from sqlalchemy import func
 
 import tmlib.models as tm
 
@@ -27,6 +28,7 @@ from tmserver.api import api
 from tmserver.util import (
     decode_query_ids, decode_form_ids, assert_query_params, assert_form_params
 )
+from tmserver.error import *
 
 logger = logging.getLogger(__name__)
 
@@ -161,3 +163,256 @@ def get_segmentation_layers(experiment_id):
         layers = layers.all()
         return jsonify(data=layers)
 
+
+def _get_selection_geometry(data):
+    if 'bbox' in data:
+        bbox = data['bbox']
+        try:
+            minx, miny, maxx, maxy = [float(v) for v in bbox]
+        except (TypeError, ValueError):
+            raise MalformedRequestError(
+                'Parameter "bbox" must be a list of four numbers.'
+            )
+        if minx > maxx or miny > maxy:
+            raise MalformedRequestError('Parameter "bbox" is invalid.')
+        return func.ST_MakeEnvelope(minx, miny, maxx, maxy)
+    elif 'geometry' in data:
+        geometry = data['geometry']
+        if not isinstance(geometry, dict) or \
+                geometry.get('type') not in {'Polygon', 'MultiPolygon'}:
+            raise MalformedRequestError(
+                'Parameter "geometry" must be a GeoJSON Polygon or '
+                'MultiPolygon.'
+            )
+        return func.ST_GeomFromGeoJSON(json.dumps(geometry))
+    raise MissingPOSTParameterError('geometry')
+
+
+@api.route(
+    '/experiments/<experiment_id>/segmentation_layers/<segmentation_layer_id>/mapobject-ids',
+    methods=['POST']
+)
+@jwt_required()
+@decode_query_ids('read')
+def get_mapobject_ids_in_region(experiment_id, segmentation_layer_id):
+    """
+    .. http:post:: /api/experiments/(string:experiment_id)/segmentation_layers/(string:segmentation_layer_id)/mapobject-ids
+
+        Get the IDs of mapobjects whose
+        :class:`MapobjectSegmentation <tmlib.models.mapobject.MapobjectSegmentation>`
+        in the given
+        :class:`SegmentationLayer <tmlib.models.layer.SegmentationLayer>`
+        lies within a region, e.g. a selection drawn on the map.
+
+        **Example request**:
+
+        .. sourcecode:: http
+
+            Content-Type: application/json
+
+            {
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[
+                        [100, -100], [900, -100], [900, -700], [100, -100]
+                    ]]
+                },
+                "mode": "centroid"
+            }
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+            Content-Type: application/json
+
+            {
+                "data": [12, 18, 243, ...]
+            }
+
+        :reqjson geometry: GeoJSON Polygon or MultiPolygon (required unless
+            "bbox" is provided)
+        :reqjson bbox: bounding box ``[minx, miny, maxx, maxy]`` (required
+            unless "geometry" is provided)
+        :reqjson mode: ``"intersects"`` (default) selects mapobjects whose
+            outline intersects the region, ``"within"`` mapobjects whose
+            outline lies completely within the region and ``"centroid"``
+            mapobjects whose centroid lies within the region (optional)
+
+        :reqheader Authorization: JWT token issued by the server
+        :statuscode 200: no error
+        :statuscode 400: malformed request
+
+    .. note:: Coordinates are map coordinates at the maximal zoom level, i.e.
+        the coordinate system of the GeoJSON provided for segmentation tiles.
+        IDs are sorted in ascending order.
+    """
+    data = request.get_json()
+    if data is None:
+        raise MalformedRequestError('Request body must be JSON.')
+    mode = data.get('mode', 'intersects')
+    region = _get_selection_geometry(data)
+    if mode == 'intersects':
+        condition = tm.MapobjectSegmentation.geom_polygon.ST_Intersects(region)
+    elif mode == 'within':
+        condition = tm.MapobjectSegmentation.geom_polygon.ST_Within(region)
+    elif mode == 'centroid':
+        condition = tm.MapobjectSegmentation.geom_centroid.ST_Intersects(
+            region
+        )
+    else:
+        raise MalformedRequestError(
+            'Parameter "mode" must be one of the following: '
+            '"intersects", "within", "centroid"'
+        )
+    logger.info(
+        'get mapobjects of segmentation layer %d of experiment %d in region',
+        segmentation_layer_id, experiment_id
+    )
+    with tm.utils.ExperimentSession(experiment_id) as session:
+        # The spatial predicates use the GiST indexes of the geometry
+        # columns to find candidates by bounding box first.
+        mapobjects = session.query(tm.MapobjectSegmentation.mapobject_id).\
+            filter(
+                tm.MapobjectSegmentation.segmentation_layer_id ==
+                segmentation_layer_id,
+                condition
+            ).\
+            order_by(tm.MapobjectSegmentation.mapobject_id).\
+            all()
+    return jsonify(data=[m.mapobject_id for m in mapobjects])
+
+
+def _to_number(value):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return value
+    if value != value:
+        return None
+    return value
+
+
+@api.route(
+    '/experiments/<experiment_id>/segmentation_layers/<segmentation_layer_id>/mapobjects/hit',
+    methods=['GET']
+)
+@jwt_required()
+@assert_query_params('x', 'y')
+@decode_query_ids('read')
+def get_mapobject_at_point(experiment_id, segmentation_layer_id):
+    """
+    .. http:get:: /api/experiments/(string:experiment_id)/segmentation_layers/(string:segmentation_layer_id)/mapobjects/hit
+
+        Get the mapobject whose
+        :class:`MapobjectSegmentation <tmlib.models.mapobject.MapobjectSegmentation>`
+        in the given
+        :class:`SegmentationLayer <tmlib.models.layer.SegmentationLayer>`
+        contains a point, e.g. the position the user clicked on in the
+        viewer, together with its
+        :class:`FeatureValues <tmlib.models.feature.FeatureValues>` and
+        :class:`LabelValues <tmlib.models.result.LabelValues>`.
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+            Content-Type: application/json
+
+            {
+                "data": {
+                    "id": 243,
+                    "label": 17,
+                    "features": {
+                        "Morphology_Area": 812.0,
+                        ...
+                    },
+                    "labels": {
+                        "Classification": 1.0,
+                        ...
+                    }
+                }
+            }
+
+        :query x: x-coordinate of the point in map coordinates (required)
+        :query y: y-coordinate of the point in map coordinates (required)
+
+        :reqheader Authorization: JWT token issued by the server
+        :statuscode 200: no error
+        :statuscode 400: malformed request
+
+    .. note:: "data" is ``null`` if there is no mapobject at the point.
+        Labels are keyed by the name of the
+        :class:`ToolResult <tmlib.models.result.ToolResult>`. Missing values
+        are ``null``.
+    """
+    x = request.args.get('x', type=float)
+    y = request.args.get('y', type=float)
+    if x is None or y is None:
+        raise MalformedRequestError(
+            'Query parameters "x" and "y" must be numbers.'
+        )
+    logger.debug(
+        'get mapobject of segmentation layer %d at point %f/%f',
+        segmentation_layer_id, x, y
+    )
+    with tm.utils.ExperimentSession(experiment_id) as session:
+        segmentation = session.query(
+                tm.MapobjectSegmentation.mapobject_id,
+                tm.MapobjectSegmentation.partition_key,
+                tm.MapobjectSegmentation.label
+            ).\
+            filter(
+                tm.MapobjectSegmentation.segmentation_layer_id ==
+                segmentation_layer_id,
+                tm.MapobjectSegmentation.geom_polygon.ST_Contains(
+                    func.ST_MakePoint(x, y)
+                )
+            ).\
+            first()
+        if segmentation is None:
+            return jsonify(data=None)
+
+        segmentation_layer = session.query(tm.SegmentationLayer).\
+            get(segmentation_layer_id)
+        mapobject_type_id = segmentation_layer.mapobject_type_id
+        # Both tables are distributed by partition key, such that only
+        # a single shard needs to be queried. Values are stored for each
+        # time point.
+        feature_values = session.query(tm.FeatureValues.values).\
+            filter_by(
+                mapobject_id=segmentation.mapobject_id,
+                partition_key=segmentation.partition_key,
+                tpoint=segmentation_layer.tpoint
+            ).\
+            first()
+        label_values = session.query(tm.LabelValues.values).\
+            filter_by(
+                mapobject_id=segmentation.mapobject_id,
+                partition_key=segmentation.partition_key,
+                tpoint=segmentation_layer.tpoint
+            ).\
+            first()
+        features = session.query(tm.Feature.id, tm.Feature.name).\
+            filter_by(mapobject_type_id=mapobject_type_id).\
+            all()
+        tool_results = session.query(tm.ToolResult.id, tm.ToolResult.name).\
+            filter_by(mapobject_type_id=mapobject_type_id).\
+            all()
+
+    feature_values = feature_values.values if feature_values else {}
+    label_values = label_values.values if label_values else {}
+    return jsonify(data={
+        'id': segmentation.mapobject_id,
+        'label': segmentation.label,
+        'features': {
+            f.name: _to_number(feature_values.get(str(f.id)))
+            for f in features
+        },
+        'labels': {
+            t.name: _to_number(label_values.get(str(t.id)))
+            for t in tool_results
+        }
+    })
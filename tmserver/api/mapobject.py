@@ -23,6 +23,7 @@ import pandas as pd
 from cStringIO import StringIO
 from flask_jwt import jwt_required
 from flask import jsonify, request, send_file, Response
+from sqlalchemy import distinct
 from sqlalchemy.orm.exc import NoResultFound
 from werkzeug import secure_filename
 
@@ -35,101 +36,38 @@ from tmserver.util import (
     decode_query_ids, assert_query_params, assert_form_params,
     is_true, is_false
 )
+from tmserver.model import decode_pk
+from tmserver.lookup import get_layout, get_site_id
 from tmserver.error import *
+from tmserver.export import (
+    invalidate_exports, compute_border_labels, get_border_index
+)
 
 
 logger = logging.getLogger(__name__)
 
 
-def _get_matching_plates(session, plate_name):
-    query = session.query(
-            tm.Plate.id,
-            tm.Plate.name.label('plate_name')
-        )
-    if plate_name is not None:
-        logger.debug('filter metadata by plate "%s"', plate_name)
-        results = session.query(tm.Plate.id).\
-            filter_by(name=plate_name).\
-            count()
-        if results == 0:
-            raise ResourceNotFoundError(tm.Plate, name=plate_name)
-        query = query.filter(tm.Plate.name == plate_name)
-    return query.order_by(tm.Plate.id).all()
+def _get_matching_plates(session, experiment_id, plate_name):
+    logger.debug('filter metadata by plate "%s"', plate_name)
+    return get_layout(session, experiment_id).find_plates(plate_name)
 
 
-def _get_matching_wells(session, plate_name, well_name):
-    query = session.query(
-            tm.Well.id,
-            tm.Well.name.label('well_name'),
-            tm.Plate.name.label('plate_name')
-        ).\
-        join(tm.Plate)
-    if plate_name is not None:
-        logger.debug('filter metadata by plate "%s"', plate_name)
-        results = session.query(tm.Plate.id).\
-            filter_by(name=plate_name).\
-            count()
-        if results == 0:
-            raise ResourceNotFoundError(tm.Plate, name=plate_name)
-        query = query.filter(tm.Plate.name == plate_name)
-    if well_name is not None:
-        logger.debug('filter metadata by well "%s"', well_name)
-        results = session.query(tm.Well.id).\
-            filter_by(name=well_name).\
-            count()
-        if results == 0:
-            raise ResourceNotFoundError(tm.Well, name=well_name)
-        query = query.filter(tm.Well.name == well_name)
-    return query.order_by(tm.Well.id).all()
+def _get_matching_wells(session, experiment_id, plate_name, well_name):
+    logger.debug(
+        'filter metadata by plate "%s" and well "%s"', plate_name, well_name
+    )
+    return get_layout(session, experiment_id).find_wells(plate_name, well_name)
 
 
-def _get_matching_sites(session, plate_name, well_name, well_pos_y, well_pos_x):
-    query = session.query(
-            tm.Site.id,
-            tm.Site.y.label('well_pos_y'),
-            tm.Site.x.label('well_pos_x'),
-            tm.Well.name.label('well_name'),
-            tm.Plate.name.label('plate_name')
-        ).\
-        join(tm.Well).\
-        join(tm.Plate)
-    if plate_name is not None:
-        logger.debug('filter metadata by plate "%s"', plate_name)
-        results = session.query(tm.Plate.id).\
-            filter_by(name=plate_name).\
-            count()
-        if results == 0:
-            raise ResourceNotFoundError(tm.Plate, name=plate_name)
-        query = query.filter(tm.Plate.name == plate_name)
-    if well_name is not None:
-        logger.debug('filter metadata by well "%s"', well_name)
-        results = session.query(tm.Well.id).\
-            filter_by(name=well_name).\
-            count()
-        if results == 0:
-            raise ResourceNotFoundError(tm.Well, name=well_name)
-        query = query.filter(tm.Well.name == well_name)
-    if well_pos_y is not None:
-        logger.debug(
-            'filter metadata by well position y %d', well_pos_y
-        )
-        results = session.query(tm.Site.id).\
-            filter_by(y=well_pos_y).\
-            count()
-        if results == 0:
-            raise ResourceNotFoundError(tm.Site, y=well_pos_y)
-        query = query.filter(tm.Site.y == well_pos_y)
-    if well_pos_x is not None:
-        logger.debug(
-            'filter metadata by well position x %d', well_pos_x
-        )
-        results = session.query(tm.Site.id).\
-            filter_by(x=well_pos_x).\
-            count()
-        if results == 0:
-            raise ResourceNotFoundError(tm.Site, x=well_pos_x)
-        query = query.filter(tm.Site.x == well_pos_x)
-    return query.order_by(tm.Site.id).all()
+def _get_matching_sites(session, experiment_id, plate_name, well_name,
+        well_pos_y, well_pos_x):
+    logger.debug(
+        'filter metadata by plate "%s", well "%s" and well position %s/%s',
+        plate_name, well_name, well_pos_y, well_pos_x
+    )
+    return get_layout(session, experiment_id).find_sites(
+        plate_name, well_name, well_pos_y, well_pos_x
+    )
 
 
 def _get_matching_layers(session, tpoint):
@@ -145,10 +83,63 @@ def _get_matching_layers(session, tpoint):
     return query.all()
 
 
+def _get_matching_features(session, mapobject_type_id, selection=None):
+    query = session.query(tm.Feature.id, tm.Feature.name).\
+        filter_by(mapobject_type_id=mapobject_type_id).\
+        order_by(tm.Feature.id)
+    features = query.all()
+    if selection is None:
+        return features
+    # Features can be selected by name or by (encoded) ID. The order of the
+    # selection is preserved.
+    logger.debug('filter features by name or ID')
+    name_lut = {f.name: f for f in features}
+    id_lut = {f.id: f for f in features}
+    selected = list()
+    for s in selection:
+        if s in name_lut:
+            selected.append(name_lut[s])
+            continue
+        try:
+            feature_id = decode_pk(s)
+        except ValueError:
+            feature_id = None
+        if feature_id not in id_lut:
+            raise ResourceNotFoundError(tm.Feature, name=s)
+        selected.append(id_lut[feature_id])
+    return selected
+
+
+def _get_matching_partitions(session, mapobject_type_id, ref_ids,
+        mapobject_ids=None, mapobject_id_range=None):
+    if mapobject_ids is None and mapobject_id_range is None:
+        return ref_ids
+    # Only visit partitions that hold requested mapobjects.
+    logger.debug('filter partitions by mapobject IDs')
+    query = session.query(distinct(tm.Mapobject.partition_key)).\
+        filter(tm.Mapobject.mapobject_type_id == mapobject_type_id)
+    query = _filter_mapobject_ids(query, mapobject_ids, mapobject_id_range)
+    partition_keys = set([r[0] for r in query.all()])
+    return [i for i in ref_ids if i in partition_keys]
+
+
+def _filter_mapobject_ids(query, mapobject_ids, mapobject_id_range):
+    if mapobject_ids is not None:
+        query = query.filter(tm.Mapobject.id.in_(mapobject_ids))
+    if mapobject_id_range is not None:
+        lower, upper = mapobject_id_range
+        if lower is not None:
+            query = query.filter(tm.Mapobject.id >= lower)
+        if upper is not None:
+            query = query.filter(tm.Mapobject.id <= upper)
+    return query
+
+
 def _get_mapobjects_at_ref_position(session, mapobject_type_id,
-        ref_id, segmentation_layer_ids):
+        ref_id, segmentation_layer_ids, mapobject_ids=None,
+        mapobject_id_range=None):
 
-    return session.query(
+    query = session.query(
             tm.Mapobject.id, tm.MapobjectSegmentation.label,
             tm.MapobjectSegmentation.segmentation_layer_id
         ).\
@@ -159,9 +150,9 @@ def _get_mapobjects_at_ref_position(session, mapobject_type_id,
             tm.MapobjectSegmentation.segmentation_layer_id.in_(
                 segmentation_layer_ids
             )
-        ).\
-        order_by(tm.Mapobject.id).\
-        all()
+        )
+    query = _filter_mapobject_ids(query, mapobject_ids, mapobject_id_range)
+    return query.order_by(tm.Mapobject.id).all()
 
 
 def _get_border_mapobjects_at_ref_position(session, mapobject_ids,
@@ -388,6 +379,7 @@ def delete_mapobject_type(experiment_id, mapobject_type_id):
         session.query(tm.MapobjectType).\
             filter_by(id=mapobject_type_id).\
             delete()
+    invalidate_exports(experiment_id)
     return jsonify(message='ok')
 
 
@@ -507,14 +499,12 @@ def add_segmentations(experiment_id, mapobject_type_id):
         )
         segmentation_layer_id = segmentation_layer.id
 
-        site = session.query(tm.Site).\
-            join(tm.Well).\
-            join(tm.Plate).\
-            filter(
-                tm.Plate.name == plate_name, tm.Well.name == well_name,
-                tm.Site.y == well_pos_y, tm.Site.x == well_pos_x
-            ).\
-            one()
+        site_id = get_site_id(
+            session, experiment_id, plate_name, well_name,
+            well_pos_y, well_pos_x
+        )
+        site = get_layout(session, experiment_id).\
+            get_site_geometry(session, site_id)
 
         if align:
             y_offset, x_offset = site.aligned_offset
@@ -524,7 +514,6 @@ def add_segmentations(experiment_id, mapobject_type_id):
             y_offset, x_offset = site.offset
             if array.shape != site.image_size:
                 raise MalformedRequestError('Image has wrong dimensions')
-        site_id = site.id
 
         metadata = SegmentationImageMetadata(
             mapobject_type_id, site_id, tpoint, zplane
@@ -566,6 +555,14 @@ def add_segmentations(experiment_id, mapobject_type_id):
             segmentations.append(s)
         session.bulk_ingest(segmentations)
 
+    if segmentations:
+        get_border_index().store(
+            experiment_id, segmentation_layer_id, site_id,
+            compute_border_labels(array),
+            max([s.mapobject_id for s in segmentations])
+        )
+
+    invalidate_exports(experiment_id)
     return jsonify(message='ok')
 
 
@@ -641,34 +638,29 @@ def get_segmentations(experiment_id, mapobject_type_id):
         experiment_name = experiment.name
 
     with tm.utils.ExperimentSession(experiment_id) as session:
-        site = session.query(tm.Site).\
-            join(tm.Well).\
-            join(tm.Plate).\
-            filter(
-                tm.Plate.name == plate_name,
-                tm.Well.name == well_name,
-                tm.Site.x == well_pos_x, tm.Site.y == well_pos_y
-            ).\
-            one()
+        site_id = get_site_id(
+            session, experiment_id, plate_name, well_name,
+            well_pos_y, well_pos_x
+        )
         mapobject_type = session.query(tm.MapobjectType).\
             get(mapobject_type_id)
         polygons = mapobject_type.get_segmentations_per_site(
-            site.id, tpoint=tpoint, zplane=zplane
+            site_id, tpoint=tpoint, zplane=zplane
         )
         if len(polygons) == 0:
             raise ResourceNotFoundError(tm.MapobjectSegmentation, request.args)
 
+        site = get_layout(session, experiment_id).\
+            get_site_geometry(session, site_id)
         if align:
             y_offset, x_offset = site.aligned_offset
-            height = site.aligned_height
-            width = site.aligned_width
+            image_size = site.aligned_image_size
         else:
             y_offset, x_offset = site.offset
-            height = site.height
-            width = site.width
+            image_size = site.image_size
 
     img = SegmentationImage.create_from_polygons(
-        polygons, y_offset, x_offset, (height, width)
+        polygons, y_offset, x_offset, image_size
     )
     return jsonify(data=img.array.tolist())
 
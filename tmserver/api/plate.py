@@ -29,6 +29,8 @@ from tmserver.util import (
 )
 from tmserver.api import api
 from tmserver.error import *
+from tmserver.export import invalidate_exports
+from tmserver.lookup import invalidate_layout
 
 
 logger = logging.getLogger(__name__)
@@ -122,6 +124,8 @@ def update_plate(experiment_id, plate_id):
     with tm.utils.ExperimentSession(experiment_id) as session:
         plate = session.query(tm.Plate).get(plate_id)
         plate.name = name
+    invalidate_layout(experiment_id)
+    invalidate_exports(experiment_id)
     return jsonify(message='ok')
 
 
@@ -207,6 +211,8 @@ def delete_plate(experiment_id, plate_id):
     with tm.utils.ExperimentSession(experiment_id) as session:
         session.query(tm.Plate).filter_by(id=plate_id).delete()
         # TODO: DELETE CASCADE mapobjects, channel_layer_tiles
+    invalidate_layout(experiment_id)
+    invalidate_exports(experiment_id)
     return jsonify(message='ok')
 
 
@@ -263,6 +269,7 @@ def create_plate(experiment_id):
         )
         session.add(plate)
         session.commit()
+        invalidate_layout(experiment_id)
         return jsonify(data=plate)
 
 
@@ -22,7 +22,7 @@ import json
 import logging
 from flask import jsonify, request, current_app
 from flask_jwt import jwt_required, current_identity
-from sqlalchemy import distinct
+from sqlalchemy import distinct, func
 
 import tmlib.models as tm
 from tmlib import cfg as tmlib_cfg
@@ -43,11 +43,77 @@ from tmserver.util import decode_query_ids, decode_form_ids
 from tmserver.util import assert_query_params, assert_form_params
 from tmserver.model import encode_pk
 from tmserver.extensions import gc3pie
+from tmserver.export import invalidate_exports, get_export_cache
+from tmserver.export.cache import ExportCache
+from tmserver.toolpool import get_tool_pool, get_tool_cost, ToolPoolError
 from tmserver import cfg as server_cfg
 
 
 logger = logging.getLogger(__name__)
 
+#: int: maximal total size of cached references to tool results in bytes
+_RESULT_CACHE_MAX_SIZE = 16 * 1024**2
+
+_result_cache = None
+
+
+def _get_result_cache():
+    global _result_cache
+    # Results are identified by the data version of the experiment, which is
+    # only tracked when exports are cached.
+    if server_cfg.tool_result_cache_max_age <= 0 or get_export_cache() is None:
+        return None
+    if _result_cache is None:
+        _result_cache = ExportCache(
+            os.path.join(server_cfg.cache_dir, 'tools'),
+            _RESULT_CACHE_MAX_SIZE,
+            server_cfg.tool_result_cache_max_age * 3600
+        )
+    return _result_cache
+
+
+def _get_result_cache_key(experiment_id, tool_name, payload):
+    cache = _get_result_cache()
+    if cache is None:
+        return None
+    # The largest mapobject ID changes when objects get (re)created by
+    # workflow jobs, which don't update the data version.
+    with tm.utils.ExperimentSession(experiment_id) as session:
+        max_mapobject_id = session.query(func.max(tm.Mapobject.id)).scalar()
+    # Results are only listed for the user who submitted the request.
+    return cache.create_key(
+        'tool', experiment_id, tool_name, current_identity.id,
+        get_export_cache().get_data_version(experiment_id),
+        max_mapobject_id, payload
+    )
+
+
+def _get_cached_tool_result(experiment_id, cache_key):
+    path = _get_result_cache().get(cache_key)
+    if path is None:
+        return None
+    with open(path) as f:
+        submission_id = json.load(f)['submission_id']
+    with tm.utils.ExperimentSession(experiment_id) as session:
+        # The result may have been deleted or the job may have failed.
+        tool_result = session.query(tm.ToolResult).\
+            filter_by(submission_id=submission_id).\
+            order_by(tm.ToolResult.id.desc()).\
+            first()
+        if tool_result is None:
+            return None
+        return jsonify(data={
+            'submission_id': submission_id,
+            'result': tool_result
+        })
+
+
+def _cache_tool_result(cache_key, submission_id):
+    if cache_key is not None:
+        _get_result_cache().materialize(
+            cache_key, [json.dumps({'submission_id': submission_id})]
+        )
+
 
 def _create_mapobject_feature(mapobject_id, geometry_description):
     """Creates a GeoJSON feature for the given mapobject and GeoJSON geometry.
@@ -117,6 +183,49 @@ def get_tools():
     return jsonify(data=tool_descriptions)
 
 
+def _delete_tool_results(experiment_id, submission_id):
+    with tm.utils.ExperimentSession(experiment_id, False) as session:
+        tool_result_ids = [
+            r.id for r in session.query(tm.ToolResult.id).
+                filter_by(submission_id=submission_id).
+                all()
+        ]
+        for tool_result_id in tool_result_ids:
+            logger.info('delete partial tool result %d', tool_result_id)
+            key = str(tool_result_id)
+            session.query(tm.LabelValues).\
+                filter(tm.LabelValues.values.has_key(key)).\
+                update(
+                    {'values': tm.LabelValues.values.delete(key)},
+                    synchronize_session=False
+                )
+        session.query(tm.ToolResult).\
+            filter_by(submission_id=submission_id).\
+            delete()
+
+
+def _process_request_within_server(experiment_id, tool_name, submission_id,
+        payload):
+    pool = get_tool_pool()
+    cost = get_tool_cost(get_tool_class(tool_name), payload)
+    if (pool is None or cost is None or
+            cost > server_cfg.tool_fast_path_max_cost):
+        return False
+    logger.info('process request of tool "%s" within server', tool_name)
+    try:
+        pool.run(experiment_id, tool_name, submission_id, payload)
+    except ToolPoolError as err:
+        logger.error(
+            'processing of request of tool "%s" failed, submit job '
+            'instead: %s', tool_name, str(err)
+        )
+        # The worker is no longer running, but may have written results
+        # before it failed, which the job would duplicate.
+        _delete_tool_results(experiment_id, submission_id)
+        return False
+    return True
+
+
 @api.route(
     '/experiments/<experiment_id>/tools/request', methods=['POST']
 )
@@ -138,7 +247,8 @@ def process_tool_request(experiment_id):
             {
                 "tool_name": "Cluster Tool",
                 "payload": any object,
-                "session_uuid": string
+                "session_uuid": string,
+                "force": false
             }
 
         **Example response**:
@@ -150,25 +260,59 @@ def process_tool_request(experiment_id):
 
             {
                 "data": {
-                    "submission_id": "MQ=="
+                    "submission_id": "MQ==",
+                    "result": null
                 }
             }
 
         :reqheader Authorization: JWT token issued by the server
         :statuscode 200: no error
 
+    .. note:: Requests of tools that declare a low estimated cost are
+        processed right away by the server and "result" holds the
+        :class:`ToolResult <tmlib.models.result.ToolResult>` (see
+        :mod:`tmserver.toolpool`). Otherwise "result" is ``null`` and the
+        request is processed by a job.
+        The result of a previous request of the same user with the same
+        tool and payload is returned right away, as long as the data of the
+        experiment didn't change in the meantime, unless "force" is
+        ``true``.
     """
     data = request.get_json()
     payload = data.get('payload', {})
     session_uuid = data.get('session_uuid')
     tool_name = data.get('tool_name')
+    force = data.get('force', False)
     logger.info('process request of tool "%s"', tool_name)
 
+    cache_key = _get_result_cache_key(experiment_id, tool_name, payload)
+    if cache_key is not None and not force:
+        response = _get_cached_tool_result(experiment_id, cache_key)
+        if response is not None:
+            logger.info('reuse result of request of tool "%s"', tool_name)
+            return response
+
     manager = ToolRequestManager(
         experiment_id, tool_name, server_cfg.logging_verbosity
     )
     submission_id, user_name = manager.register_submission(current_identity.id)
     manager.store_payload(payload, submission_id)
+
+    processed = _process_request_within_server(
+        experiment_id, tool_name, submission_id, payload
+    )
+    if processed:
+        _cache_tool_result(cache_key, submission_id)
+        with tm.utils.ExperimentSession(experiment_id) as session:
+            tool_result = session.query(tm.ToolResult).\
+                filter_by(submission_id=submission_id).\
+                order_by(tm.ToolResult.id.desc()).\
+                first()
+            return jsonify(data={
+                'submission_id': submission_id,
+                'result': tool_result
+            })
+
     job = manager.create_job(submission_id, user_name)
 
     # with tm.utils.ExperimentSession(experiment_id) as session:
@@ -177,9 +321,11 @@ def process_tool_request(experiment_id):
 
     gc3pie.store_task(job)
     gc3pie.submit_task(job)
+    _cache_tool_result(cache_key, submission_id)
 
     return jsonify(data={
-        'submission_id': submission_id
+        'submission_id': submission_id,
+        'result': None
     })
 
 
@@ -279,6 +425,7 @@ def update_tool_result(experiment_id, tool_result_id):
     with tm.utils.ExperimentSession(experiment_id) as session:
         tool_result = session.query(tm.ToolResult).get(tool_result_id)
         tool_result.name = name
+    invalidate_exports(experiment_id)
     return jsonify(message='ok')
 
 
@@ -399,6 +546,7 @@ def delete_tool_result(experiment_id, tool_result_id):
         session.query(tm.ToolResult).\
             filter_by(id=tool_result_id).\
             delete()
+    invalidate_exports(experiment_id)
     return jsonify(message='ok')
 
 
@@ -523,7 +671,7 @@ def get_tool_job_log(experiment_id, job_id):
         'get log of tool job %d for experiment %d',
         job_id, experiment_id
     )
-    job = gc3pie.retrieve_task(job_id)
+    job = gc3pie.retrieve_task_log_info(job_id)
     stdout_file = os.path.join(job.output_dir, job.stdout)
     with open(stdout_file, 'r') as f:
         out = f.read()
@@ -22,7 +22,8 @@ import os
 from cStringIO import StringIO
 import logging
 import numpy as np
-from flask import jsonify, send_file, current_app, request
+import gevent.queue
+from flask import jsonify, send_file, current_app, request, Response
 from flask_jwt import jwt_required
 from flask_jwt import current_identity
 from sqlalchemy import func
@@ -44,11 +45,16 @@ from tmserver.model import encode_pk
 from tmserver.extensions import gc3pie
 from tmserver.api import api
 from tmserver.error import *
+from tmserver.lookup import invalidate_layout
 from tmserver import cfg as server_cfg
 
 
 logger = logging.getLogger(__name__)
 
+#: int: number of seconds after which a comment is sent to idle event streams
+#: to keep the connection open
+_EVENT_KEEPALIVE_INTERVAL = 15
+
 
 @api.route('/experiments/<experiment_id>/workflow/submit', methods=['POST'])
 @jwt_required()
@@ -111,6 +117,8 @@ def submit_workflow(experiment_id):
     )
     gc3pie.store_task(workflow)
     gc3pie.submit_task(workflow)
+    # Sites get (re)created by the workflow.
+    invalidate_layout(experiment_id)
 
     return jsonify({
         'message': 'ok',
@@ -195,6 +203,7 @@ def resubmit_workflow(experiment_id):
     workflow.update_description(workflow_description)
     workflow.update_stage(index)
     gc3pie.resubmit_task(workflow, index)
+    invalidate_layout(experiment_id)
     return jsonify({
         'message': 'ok',
         'submission_id': workflow.submission_id
@@ -237,6 +246,69 @@ def get_workflow_status(experiment_id):
     return jsonify(data=status)
 
 
+@api.route('/experiments/<experiment_id>/events', methods=['GET'])
+@jwt_required()
+@decode_query_ids('read')
+def get_task_events(experiment_id):
+    """
+    .. http:get:: /api/experiments/(string:experiment_id)/events
+
+        Subscribe to changes of the state of workflow and tool jobs of the
+        experiment as a stream of
+        `server-sent events <https://www.w3.org/TR/eventsource/>`_.
+        Clients can use the stream instead of polling the status of jobs.
+
+        **Example response**:
+
+        .. sourcecode:: http
+
+            HTTP/1.1 200 OK
+            Content-Type: text/event-stream
+
+            event: task
+            data: {"id": "dG1hcHM3NzYxOA==", "name": "tool_Heatmap", "submission_id": 4, "program": "tool", "user_id": 1, "old_state": "SUBMITTED", "state": "RUNNING", "exitcode": null}
+
+        :query access_token: JWT token issued by the server (optional,
+            alternative to the "Authorization" header)
+        :reqheader Authorization: JWT token issued by the server
+        :statuscode 200: no error
+
+    .. note:: Events of tool jobs are only sent to the user who submitted
+        the tool request.
+
+    .. note:: The ``EventSource`` interface of browsers can't set the
+        "Authorization" header, so the token can be provided as query
+        parameter instead, e.g.
+        ``new EventSource('/api/experiments/dG1hcHMx/events?access_token=' + token)``.
+        The token is only accepted that way by this resource, since URLs may
+        end up in logs.
+    """
+    logger.info('subscribe to task events of experiment %d', experiment_id)
+    broker = gc3pie.events
+    user_id = current_identity.id
+
+    def generate_events():
+        queue = broker.subscribe(experiment_id)
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = queue.get(timeout=_EVENT_KEEPALIVE_INTERVAL)
+                except gevent.queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event['program'] == 'tool' and event['user_id'] != user_id:
+                    continue
+                yield 'event: task\ndata: %s\n\n' % json.dumps(event)
+        finally:
+            broker.unsubscribe(experiment_id, queue)
+
+    return Response(
+        generate_events(), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
 @api.route(
     '/experiments/<experiment_id>/workflow/jobs/<job_id>/log', methods=['GET']
 )
@@ -272,7 +344,7 @@ def get_job_log(experiment_id, job_id):
         experiment_id, job_id
     )
     # NOTE: This is the persistent task ID of the job
-    job = gc3pie.retrieve_task(job_id)
+    job = gc3pie.retrieve_task_log_info(job_id)
     stdout_file = os.path.join(job.output_dir, job.stdout)
     with open(stdout_file, 'r') as f:
         out = f.read()
@@ -30,6 +30,20 @@ class ServerConfig(TmapsConfig):
         self.logging_verbosity = 2
         self.secret_key = 'default_secret_key'
         self.jwt_expiration_delta = datetime.timedelta(hours=6)
+        self.export_workers = 4
+        self.export_compression_level = 6
+        self.cache_dir = os.path.expanduser('~/.tmaps/cache')
+        self.export_cache_max_size = 10240
+        self.export_cache_max_age = 24
+        self.feature_index_threshold = 5
+        self.feature_lookup_max_ids = 100000
+        self.tool_workers = 2
+        self.tool_fast_path_max_cost = 1
+        self.tool_result_cache_max_age = 24
+        self.engine_min_interval = 2
+        self.engine_max_interval = 60
+        self.engine_task_retention = 3600
+        self.admin_users = ''
         self.read()
 
     @property
@@ -84,3 +98,236 @@ class ServerConfig(TmapsConfig):
             )
         self._config.set(self._section, 'jwt_expiration_delta', str(value))
 
+    @property
+    def export_workers(self):
+        '''int: number of partitions that are read concurrently from the
+        database when feature values or metadata get exported (default: ``4``)
+        '''
+        return self._config.getint(self._section, 'export_workers')
+
+    @export_workers.setter
+    def export_workers(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "export_workers" must have type int.'
+            )
+        self._config.set(self._section, 'export_workers', str(value))
+
+    @property
+    def export_compression_level(self):
+        '''int: level at which exported *CSV* tables get compressed when the
+        client accepts compressed content; ``0`` disables compression
+        (default: ``6``)
+        '''
+        return self._config.getint(self._section, 'export_compression_level')
+
+    @export_compression_level.setter
+    def export_compression_level(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "export_compression_level" must have '
+                'type int.'
+            )
+        self._config.set(self._section, 'export_compression_level', str(value))
+
+    @property
+    def cache_dir(self):
+        '''str: absolute path to the directory where the server caches data on
+        disk; may be shared between server processes
+        (default: ``"~/.tmaps/cache"``)
+        '''
+        return self._config.get(self._section, 'cache_dir')
+
+    @cache_dir.setter
+    def cache_dir(self, value):
+        if not isinstance(value, basestring):
+            raise TypeError(
+                'Configuration parameter "cache_dir" must have type str.'
+            )
+        self._config.set(self._section, 'cache_dir', str(value))
+
+    @property
+    def export_cache_max_size(self):
+        '''int: maximal total size of cached exports in megabytes;
+        ``0`` disables caching of exports (default: ``10240``)
+        '''
+        return self._config.getint(self._section, 'export_cache_max_size')
+
+    @export_cache_max_size.setter
+    def export_cache_max_size(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "export_cache_max_size" must have '
+                'type int.'
+            )
+        self._config.set(self._section, 'export_cache_max_size', str(value))
+
+    @property
+    def export_cache_max_age(self):
+        '''int: number of hours a cached export is kept after it was
+        created (default: ``24``)
+        '''
+        return self._config.getint(self._section, 'export_cache_max_age')
+
+    @export_cache_max_age.setter
+    def export_cache_max_age(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "export_cache_max_age" must have '
+                'type int.'
+            )
+        self._config.set(self._section, 'export_cache_max_age', str(value))
+
+    @property
+    def feature_index_threshold(self):
+        '''int: number of feature queries that use a feature after which an
+        index is created for the values of the feature; queries are counted
+        across server processes in :attr:`cache_dir`; ``0`` disables
+        creation of indexes (default: ``5``)
+        '''
+        return self._config.getint(self._section, 'feature_index_threshold')
+
+    @feature_index_threshold.setter
+    def feature_index_threshold(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "feature_index_threshold" must have '
+                'type int.'
+            )
+        self._config.set(self._section, 'feature_index_threshold', str(value))
+
+    @property
+    def feature_lookup_max_ids(self):
+        '''int: maximal number of mapobjects whose feature values can be
+        requested by ID at once (default: ``100000``)
+        '''
+        return self._config.getint(self._section, 'feature_lookup_max_ids')
+
+    @feature_lookup_max_ids.setter
+    def feature_lookup_max_ids(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "feature_lookup_max_ids" must have '
+                'type int.'
+            )
+        self._config.set(self._section, 'feature_lookup_max_ids', str(value))
+
+    @property
+    def tool_workers(self):
+        '''int: number of worker processes that process lightweight tool
+        requests within the server; ``0`` submits all requests as jobs
+        (default: ``2``)
+        '''
+        return self._config.getint(self._section, 'tool_workers')
+
+    @tool_workers.setter
+    def tool_workers(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "tool_workers" must have type int.'
+            )
+        self._config.set(self._section, 'tool_workers', str(value))
+
+    @property
+    def tool_fast_path_max_cost(self):
+        '''int: maximal estimated cost of a tool request that gets processed
+        within the server rather than by a job (default: ``1``)
+
+        See also
+        --------
+        :func:`tmserver.toolpool.get_tool_cost`
+        '''
+        return self._config.getint(self._section, 'tool_fast_path_max_cost')
+
+    @tool_fast_path_max_cost.setter
+    def tool_fast_path_max_cost(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "tool_fast_path_max_cost" must have '
+                'type int.'
+            )
+        self._config.set(self._section, 'tool_fast_path_max_cost', str(value))
+
+    @property
+    def tool_result_cache_max_age(self):
+        '''int: number of hours after its creation that a
+        :class:`ToolResult <tmlib.models.result.ToolResult>` is reused for
+        identical tool requests; ``0`` disables reuse (default: ``24``)
+        '''
+        return self._config.getint(self._section, 'tool_result_cache_max_age')
+
+    @tool_result_cache_max_age.setter
+    def tool_result_cache_max_age(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "tool_result_cache_max_age" must '
+                'have type int.'
+            )
+        self._config.set(
+            self._section, 'tool_result_cache_max_age', str(value)
+        )
+
+    @property
+    def engine_min_interval(self):
+        '''int: number of seconds between updates of computational tasks while
+        tasks are being processed (default: ``2``)
+        '''
+        return self._config.getint(self._section, 'engine_min_interval')
+
+    @engine_min_interval.setter
+    def engine_min_interval(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "engine_min_interval" must have '
+                'type int.'
+            )
+        self._config.set(self._section, 'engine_min_interval', str(value))
+
+    @property
+    def engine_max_interval(self):
+        '''int: maximal number of seconds between updates of computational
+        tasks when no tasks are being processed (default: ``60``)
+        '''
+        return self._config.getint(self._section, 'engine_max_interval')
+
+    @engine_max_interval.setter
+    def engine_max_interval(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "engine_max_interval" must have '
+                'type int.'
+            )
+        self._config.set(self._section, 'engine_max_interval', str(value))
+
+    @property
+    def engine_task_retention(self):
+        '''int: number of seconds after which terminated tasks are removed
+        from the engine (default: ``3600``)
+        '''
+        return self._config.getint(self._section, 'engine_task_retention')
+
+    @engine_task_retention.setter
+    def engine_task_retention(self, value):
+        if not isinstance(value, int):
+            raise TypeError(
+                'Configuration parameter "engine_task_retention" must have '
+                'type int.'
+            )
+        self._config.set(self._section, 'engine_task_retention', str(value))
+
+    @property
+    def admin_users(self):
+        '''List[str]: names of users that are allowed to inspect the server,
+        e.g. the performance of the engine that processes computational tasks;
+        specified as comma-separated list (default: ``""``)
+        '''
+        value = self._config.get(self._section, 'admin_users')
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+    @admin_users.setter
+    def admin_users(self, value):
+        if not isinstance(value, basestring):
+            raise TypeError(
+                'Configuration parameter "admin_users" must have type str.'
+            )
+        self._config.set(self._section, 'admin_users', str(value))
@@ -0,0 +1,29 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Machinery for streaming large tables of
+:class:`FeatureValues <tmlib.models.feature.FeatureValues>` and related
+metadata out of the database.
+
+"""
+from tmserver.export.partition import map_partitions
+from tmserver.export.formats import (
+    get_table_writer_class, stream_table, CSVWriter
+)
+from tmserver.export.compression import negotiate_encoding, compress_stream
+from tmserver.export.cache import get_export_cache, invalidate_exports
+from tmserver.export.borders import (
+    compute_border_labels, get_border_index, get_border_mapobject_ids
+)
@@ -0,0 +1,255 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Border status of segmented objects.
+
+An object lies at the border of a site when it touches the edge of the site's
+image. The status is determined from the labeled image when segmentations are
+added and stored on disk as a bitset over labels per site and segmentation
+layer, such that it doesn't need to be recomputed by spatial queries upon
+export.
+"""
+import os
+import errno
+import struct
+import logging
+import tempfile
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+#: str: byte layout of the file header, which holds the largest mapobject ID
+#: of the segmentation layer at the site
+_HEADER = '<q'
+
+
+def compute_border_labels(array):
+    """Determines which objects touch the edge of a labeled image.
+
+    Parameters
+    ----------
+    array: numpy.ndarray[numpy.int32]
+        labeled image
+
+    Returns
+    -------
+    numpy.ndarray[numpy.int32]
+        labels of objects at the border
+    """
+    edges = np.concatenate([
+        array[0, :], array[-1, :], array[:, 0], array[:, -1]
+    ])
+    labels = np.unique(edges)
+    return labels[labels > 0]
+
+
+class BorderIndex(object):
+
+    """Persistent border status of segmented objects.
+
+    Each entry is tagged with the largest
+    :attr:`mapobject_id <tmlib.models.mapobject.MapobjectSegmentation.mapobject_id>`
+    of the segmentations it was computed for. Entries that don't match the
+    segmentations currently stored in the database are ignored, which is the
+    case when segmentations were recreated by a workflow.
+    """
+
+    def __init__(self, directory):
+        """
+        Parameters
+        ----------
+        directory: str
+            absolute path to the directory where entries are stored
+        """
+        self.directory = directory
+
+    def _get_filename(self, experiment_id, segmentation_layer_id, site_id):
+        return os.path.join(
+            self.directory, str(experiment_id), str(segmentation_layer_id),
+            str(site_id)
+        )
+
+    def store(self, experiment_id, segmentation_layer_id, site_id,
+            border_labels, max_mapobject_id):
+        """Stores the border status of segmented objects.
+
+        Parameters
+        ----------
+        experiment_id: int
+            ID of the experiment
+        segmentation_layer_id: int
+            ID of the segmentation layer
+        site_id: int
+            ID of the site
+        border_labels: Iterable[int]
+            labels of objects at the border
+        max_mapobject_id: int
+            largest ID of mapobjects segmented at the site in the layer
+        """
+        filename = self._get_filename(
+            experiment_id, segmentation_layer_id, site_id
+        )
+        location = os.path.dirname(filename)
+        try:
+            os.makedirs(location)
+        except OSError as err:
+            if err.errno != errno.EEXIST:
+                raise
+        border_labels = np.asarray(list(border_labels), dtype=np.int64)
+        n = border_labels.max() + 1 if border_labels.size > 0 else 0
+        bits = np.zeros((n, ), dtype=bool)
+        bits[border_labels] = True
+        fd, tmp_filename = tempfile.mkstemp(dir=location, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(struct.pack(_HEADER, max_mapobject_id))
+            f.write(np.packbits(bits).tobytes())
+        os.rename(tmp_filename, filename)
+
+    def load(self, experiment_id, segmentation_layer_id, site_id,
+            max_mapobject_id):
+        """Loads the border status of segmented objects.
+
+        Parameters
+        ----------
+        experiment_id: int
+            ID of the experiment
+        segmentation_layer_id: int
+            ID of the segmentation layer
+        site_id: int
+            ID of the site
+        max_mapobject_id: int
+            largest ID of mapobjects segmented at the site in the layer
+
+        Returns
+        -------
+        Set[int]
+            labels of objects at the border or ``None`` when the border
+            status is not known for the given segmentations
+        """
+        filename = self._get_filename(
+            experiment_id, segmentation_layer_id, site_id
+        )
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return None
+        header_size = struct.calcsize(_HEADER)
+        stored_mapobject_id = struct.unpack(_HEADER, data[:header_size])[0]
+        if stored_mapobject_id != max_mapobject_id:
+            logger.debug(
+                'border status of segmentation layer %d at site %d is outdated',
+                segmentation_layer_id, site_id
+            )
+            return None
+        bits = np.unpackbits(
+            np.frombuffer(data[header_size:], dtype=np.uint8)
+        )
+        return set(np.flatnonzero(bits).tolist())
+
+
+def get_border_mapobject_ids(index, experiment_id, site_id, mapobjects,
+        max_mapobject_ids, compute, complete):
+    """Determines which objects at a site lie at the border, using the
+    border index where possible.
+
+    Parameters
+    ----------
+    index: tmserver.export.borders.BorderIndex
+        border index
+    experiment_id: int
+        ID of the experiment
+    site_id: int
+        ID of the site
+    mapobjects: List[Tuple[int, int, int]]
+        ID, label and segmentation layer ID of objects at the site
+    max_mapobject_ids: Dict[int, int]
+        largest ID of mapobjects segmented at the site for each segmentation
+        layer, regardless of which objects are passed as `mapobjects`
+    compute: function
+        function that accepts a list of mapobject IDs and returns the IDs of
+        those objects that lie at the border
+    complete: bool
+        whether `mapobjects` are all objects segmented at the site; the
+        computed border status is only stored in `index` in this case
+
+    Returns
+    -------
+    Set[int]
+        IDs of mapobjects at the border
+    """
+    layers = dict()
+    for mapobject_id, label, segmentation_layer_id in mapobjects:
+        layers.setdefault(segmentation_layer_id, list()).append(
+            (mapobject_id, label)
+        )
+    border_mapobject_ids = set()
+    missing_layers = dict()
+    for segmentation_layer_id, objects in layers.iteritems():
+        border_labels = index.load(
+            experiment_id, segmentation_layer_id, site_id,
+            max_mapobject_ids[segmentation_layer_id]
+        )
+        if border_labels is None:
+            missing_layers[segmentation_layer_id] = objects
+            continue
+        border_mapobject_ids.update([
+            mapobject_id for mapobject_id, label in objects
+            if label in border_labels
+        ])
+    if not missing_layers:
+        return border_mapobject_ids
+
+    # Segmentations that were not added via the API (e.g. by a
+    # workflow) have no precomputed border status yet.
+    logger.debug('compute border status for site %d', site_id)
+    computed_ids = set(compute(
+        [o[0] for objects in missing_layers.values() for o in objects]
+    ))
+    border_mapobject_ids.update(computed_ids)
+    if complete:
+        # The status of a subset of objects must not replace the status of
+        # all objects at the site.
+        for segmentation_layer_id, objects in missing_layers.iteritems():
+            index.store(
+                experiment_id, segmentation_layer_id, site_id,
+                [label for mapobject_id, label in objects
+                 if mapobject_id in computed_ids],
+                max_mapobject_ids[segmentation_layer_id]
+            )
+    return border_mapobject_ids
+
+
+_index = None
+
+
+def get_border_index():
+    """Gets the border index configured for the server.
+
+    Returns
+    -------
+    tmserver.export.borders.BorderIndex
+
+    See also
+    --------
+    :attr:`tmserver.config.ServerConfig.cache_dir`
+    """
+    global _index
+    from tmserver import cfg
+    if _index is None:
+        _index = BorderIndex(os.path.join(cfg.cache_dir, 'borders'))
+    return _index
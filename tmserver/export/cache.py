@@ -0,0 +1,310 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""On-disk cache of materialized exports.
+
+Exports are written to the cache while they are streamed to the client for
+the first time. Repeated and resumed downloads are then served from disk.
+Entries are identified by a key that includes the *data version* of the
+experiment, which gets updated whenever the server modifies data that
+is part of an export, such that outdated entries are never served.
+The cache directory may be shared between the processes of the server.
+"""
+import os
+import json
+import time
+import uuid
+import errno
+import hashlib
+import logging
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+
+def _makedirs(path):
+    try:
+        os.makedirs(path)
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+
+
+class ExportCache(object):
+
+    """Cache of exported tables with eviction based on size and age."""
+
+    def __init__(self, directory, max_size, max_age):
+        """
+        Parameters
+        ----------
+        directory: str
+            absolute path to the cache directory
+        max_size: int
+            maximal total size of cached exports in bytes
+        max_age: int
+            maximal time in seconds an export is kept after it was created
+
+        Note
+        ----
+        The modification time of a cached file is its creation time and is
+        never changed, since clients validate resumed and repeated downloads
+        against it. The last use of an export is tracked by its access time
+        instead, which determines the order of eviction.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+
+    @property
+    def _exports_location(self):
+        path = os.path.join(self.directory, 'exports')
+        _makedirs(path)
+        return path
+
+    @property
+    def _versions_location(self):
+        path = os.path.join(self.directory, 'versions')
+        _makedirs(path)
+        return path
+
+    def _write_atomically(self, filename, data):
+        fd, tmp_filename = tempfile.mkstemp(
+            dir=os.path.dirname(filename), prefix='.tmp-'
+        )
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_filename, filename)
+
+    def get_data_version(self, experiment_id):
+        """Gets the current data version of an experiment.
+
+        Parameters
+        ----------
+        experiment_id: int
+            ID of the experiment
+
+        Returns
+        -------
+        str
+            opaque version token
+        """
+        filename = os.path.join(self._versions_location, str(experiment_id))
+        try:
+            with open(filename, 'rb') as f:
+                return f.read()
+        except IOError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        return self.update_data_version(experiment_id)
+
+    def update_data_version(self, experiment_id):
+        """Assigns a new data version to an experiment, which invalidates all
+        cached exports of the experiment.
+
+        Parameters
+        ----------
+        experiment_id: int
+            ID of the experiment
+
+        Returns
+        -------
+        str
+            new version token
+        """
+        logger.debug('update data version of experiment %d', experiment_id)
+        version = uuid.uuid4().hex
+        filename = os.path.join(self._versions_location, str(experiment_id))
+        self._write_atomically(filename, version)
+        return version
+
+    def create_key(self, *parts):
+        """Creates a cache key.
+
+        Parameters
+        ----------
+        *parts: List
+            JSON serializable values that identify the export, which should
+            include the data version of the experiment
+
+        Returns
+        -------
+        str
+        """
+        return hashlib.sha1(json.dumps(parts, sort_keys=True)).hexdigest()
+
+    def get(self, key):
+        """Gets a cached export.
+
+        Parameters
+        ----------
+        key: str
+            cache key
+
+        Returns
+        -------
+        str
+            absolute path to the cached file or ``None`` if there is no
+            cached export for `key`
+        """
+        filename = os.path.join(self._exports_location, key)
+        try:
+            mtime = os.path.getmtime(filename)
+            now = time.time()
+            if now - mtime > self.max_age:
+                logger.debug('cached export "%s" expired', key)
+                os.remove(filename)
+                return None
+            # Access time tracks the last use for eviction, irrespective of
+            # how the file system is mounted.
+            os.utime(filename, (now, mtime))
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+            return None
+        logger.debug('serve export "%s" from cache', key)
+        return filename
+
+    def stream(self, key, chunks):
+        """Writes the export to the cache while it is streamed.
+        The entry only becomes visible once the stream was consumed
+        completely.
+
+        Parameters
+        ----------
+        key: str
+            cache key
+        chunks: Iterable[str]
+            serialized export
+
+        Returns
+        -------
+        Generator
+            `chunks`
+        """
+        filename = os.path.join(self._exports_location, key)
+        fd, tmp_filename = tempfile.mkstemp(
+            dir=self._exports_location, prefix='.tmp-'
+        )
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            os.rename(tmp_filename, filename)
+            complete = True
+            logger.debug('stored export "%s" in cache', key)
+        finally:
+            if not complete:
+                os.remove(tmp_filename)
+        self.evict()
+
+    def materialize(self, key, chunks):
+        """Writes the export to the cache.
+
+        Parameters
+        ----------
+        key: str
+            cache key
+        chunks: Iterable[str]
+            serialized export
+
+        Returns
+        -------
+        str
+            absolute path to the cached file
+        """
+        for chunk in self.stream(key, chunks):
+            pass
+        return os.path.join(self._exports_location, key)
+
+    def evict(self):
+        """Removes expired exports and the least recently used exports
+        until the total size of the cache is below the limit.
+        """
+        entries = list()
+        now = time.time()
+        location = self._exports_location
+        for name in os.listdir(location):
+            if name.startswith('.tmp-'):
+                continue
+            filename = os.path.join(location, name)
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                continue
+            if now - stat.st_mtime > self.max_age:
+                self._remove(filename)
+            else:
+                entries.append((stat.st_atime, stat.st_size, filename))
+        total_size = sum([e[1] for e in entries])
+        for atime, size, filename in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            self._remove(filename)
+            total_size -= size
+
+    def _remove(self, filename):
+        logger.debug('evict cached export "%s"', os.path.basename(filename))
+        try:
+            os.remove(filename)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+
+
+_cache = None
+
+
+def get_export_cache():
+    """Gets the export cache configured for the server.
+
+    Returns
+    -------
+    tmserver.export.cache.ExportCache
+        cache or ``None`` when caching is disabled
+
+    See also
+    --------
+    :attr:`tmserver.config.ServerConfig.cache_dir`
+    :attr:`tmserver.config.ServerConfig.export_cache_max_size`
+    :attr:`tmserver.config.ServerConfig.export_cache_max_age`
+    """
+    global _cache
+    from tmserver import cfg
+    if cfg.export_cache_max_size <= 0:
+        return None
+    if _cache is None:
+        _cache = ExportCache(
+            os.path.join(cfg.cache_dir, 'export'),
+            cfg.export_cache_max_size * 1024**2,
+            cfg.export_cache_max_age * 3600
+        )
+    return _cache
+
+
+def invalidate_exports(experiment_id):
+    """Invalidates cached exports of an experiment. Must be called whenever
+    data that is part of an export gets modified.
+
+    Parameters
+    ----------
+    experiment_id: int
+        ID of the experiment
+    """
+    cache = get_export_cache()
+    if cache is not None:
+        cache.update_data_version(experiment_id)
@@ -0,0 +1,118 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Incremental compression of streamed responses.
+
+Each chunk of the stream is compressed and flushed right away, such that the
+client can decompress the data as it arrives.
+"""
+import zlib
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+def get_supported_encodings():
+    """Gets the content encodings the server can apply to a stream in the order
+    of preference.
+
+    Returns
+    -------
+    List[str]
+        ``"zstd"`` (only when package "zstandard" is installed) and ``"gzip"``
+    """
+    encodings = list()
+    if zstandard is not None:
+        encodings.append('zstd')
+    encodings.append('gzip')
+    return encodings
+
+
+def negotiate_encoding(accept_encodings):
+    """Chooses a content encoding based on the ``Accept-Encoding`` header of
+    a request.
+
+    Parameters
+    ----------
+    accept_encodings: werkzeug.datastructures.Accept
+        encodings accepted by the client, i.e.
+        :attr:`flask.Request.accept_encodings`
+
+    Returns
+    -------
+    str
+        name of the encoding or ``None`` if the client doesn't accept
+        any of the supported encodings
+    """
+    return accept_encodings.best_match(get_supported_encodings())
+
+
+def _compress_gzip(chunks, level):
+    compressor = zlib.compressobj(
+        max(1, min(level, 9)), zlib.DEFLATED, 16 + zlib.MAX_WBITS
+    )
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush(zlib.Z_FINISH)
+
+
+def _compress_zstd(chunks, level):
+    compressor = zstandard.ZstdCompressor(level=max(1, min(level, 22)))
+    compressobj = compressor.compressobj()
+    for chunk in chunks:
+        data = compressobj.compress(chunk)
+        data += compressobj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+        if data:
+            yield data
+    yield compressobj.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH)
+
+
+def compress_stream(chunks, encoding, level):
+    """Compresses a stream incrementally.
+
+    Parameters
+    ----------
+    chunks: Iterable[str]
+        uncompressed data
+    encoding: str
+        ``"gzip"`` or ``"zstd"``
+    level: int
+        compression level
+
+    Returns
+    -------
+    Generator
+        compressed data
+
+    Raises
+    ------
+    ValueError
+        when `encoding` is not supported
+    """
+    if encoding not in get_supported_encodings():
+        raise ValueError('Encoding "%s" is not supported.' % encoding)
+    logger.debug('compress stream using "%s" at level %d', encoding, level)
+    if encoding == 'gzip':
+        return _compress_gzip(chunks, level)
+    else:
+        return _compress_zstd(chunks, level)
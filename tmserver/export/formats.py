@@ -0,0 +1,482 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Writers that serialize a table of feature values chunk by chunk.
+
+Each writer accepts chunks of rows, where each chunk consists of
+the IDs of the mapobjects, a list of rows of values and optionally a list of
+rows of metadata (e.g. the name of the well a mapobject belongs to), and
+returns the serialized bytes that should be sent to the client.
+Textual formats are streamed as they get written, whereas binary container
+formats (*NPZ* and *HDF5*) are assembled in a temporary directory and sent
+once the last chunk has been written.
+"""
+import io
+import os
+import csv
+import shutil
+import logging
+import zipfile
+import tempfile
+import numpy as np
+from cStringIO import StringIO
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+logger = logging.getLogger(__name__)
+
+#: int: number of bytes read at once when sending a temporary file
+_READ_CHUNK_SIZE = 2**20
+
+
+def _iter_file(filename):
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(_READ_CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+
+def _to_array(rows, n_columns):
+    if len(rows) == 0:
+        return np.empty((0, n_columns), dtype=np.float64)
+    return np.array(rows, dtype=np.float64).reshape(len(rows), n_columns)
+
+
+class TableWriter(object):
+
+    """Abstract base class for a writer that serializes a table
+    with a row for each mapobject and a column for each feature.
+    """
+
+    #: str: *MIME* type of the serialized table
+    mimetype = None
+
+    #: str: file extension of the serialized table
+    extension = None
+
+    #: bool: whether the writer can write metadata columns
+    supports_metadata = False
+
+    def __init__(self, column_names, metadata_columns=None):
+        """
+        Parameters
+        ----------
+        column_names: List[str]
+            names of columns, e.g. :attr:`Feature.name
+            <tmlib.models.feature.Feature.name>`
+        metadata_columns: List[Tuple[str, str]], optional
+            name and type (``"str"`` or ``"int"``) of metadata columns, which
+            precede the value columns
+        """
+        self.column_names = list(column_names)
+        if metadata_columns and not self.supports_metadata:
+            raise ValueError(
+                'Format "%s" does not support metadata.' % self.extension
+            )
+        self.metadata_columns = list(metadata_columns or [])
+
+    def open(self):
+        """Starts the table.
+
+        Returns
+        -------
+        str
+            serialized header
+        """
+        return ''
+
+    def write(self, mapobject_ids, rows, metadata=None):
+        """Writes a chunk of rows.
+
+        Parameters
+        ----------
+        mapobject_ids: List[int]
+            IDs of mapobjects
+        rows: List[List[str]]
+            values for each mapobject in the order of the columns
+        metadata: List[list], optional
+            metadata for each mapobject in the order of the metadata columns
+
+        Returns
+        -------
+        str
+            serialized chunk
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        """Finalizes the table.
+
+        Returns
+        -------
+        Iterable[str]
+            remaining serialized data
+        """
+        return []
+
+    def abort(self):
+        """Releases resources when the table won't be completed, e.g.
+        because the client closed the connection.
+        """
+        pass
+
+
+class CSVWriter(TableWriter):
+
+    """Writes the table as *CSV* with the first row representing column names.
+    Values are written as they are stored in the database.
+    """
+
+    mimetype = 'text/csv'
+
+    extension = 'csv'
+
+    supports_metadata = True
+
+    def __init__(self, column_names, metadata_columns=None, include_ids=False):
+        """
+        Parameters
+        ----------
+        column_names: List[str]
+            names of columns
+        metadata_columns: List[Tuple[str, str]], optional
+            name and type of metadata columns
+        include_ids: bool, optional
+            whether a "mapobject_id" column should be prepended
+            (default: ``False``)
+        """
+        super(CSVWriter, self).__init__(column_names, metadata_columns)
+        self.include_ids = include_ids
+
+    def _format(self, rows):
+        data = StringIO()
+        w = csv.writer(data)
+        w.writerows(rows)
+        return data.getvalue()
+
+    def open(self):
+        names = [c[0] for c in self.metadata_columns] + self.column_names
+        if self.include_ids:
+            names = ['mapobject_id'] + names
+        return self._format([names])
+
+    def write(self, mapobject_ids, rows, metadata=None):
+        if metadata is not None:
+            rows = [list(m) + list(r) for m, r in zip(metadata, rows)]
+        if self.include_ids:
+            rows = [[mid] + list(r) for mid, r in zip(mapobject_ids, rows)]
+        return self._format(rows)
+
+
+class ArrowWriter(TableWriter):
+
+    """Writes the table as *Apache Arrow* IPC stream with a record batch per
+    chunk. The stream has a "mapobject_id" column followed by the metadata
+    columns (if any) and a ``float64`` column for each feature and can be
+    memory mapped by the client.
+    """
+
+    mimetype = 'application/vnd.apache.arrow.stream'
+
+    extension = 'arrow'
+
+    supports_metadata = True
+
+    def __init__(self, column_names, metadata_columns=None):
+        super(ArrowWriter, self).__init__(column_names, metadata_columns)
+        self._sink = io.BytesIO()
+        self._metadata_types = [
+            pyarrow.string() if t == 'str' else pyarrow.int64()
+            for name, t in self.metadata_columns
+        ]
+        fields = [pyarrow.field('mapobject_id', pyarrow.int64())]
+        fields.extend([
+            pyarrow.field(name, t) for (name, _), t in zip(
+                self.metadata_columns, self._metadata_types
+            )
+        ])
+        fields.extend([
+            pyarrow.field(name, pyarrow.float64())
+            for name in self.column_names
+        ])
+        self._schema = pyarrow.schema(fields)
+        self._writer = None
+
+    def _drain(self):
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate(0)
+        return data
+
+    def open(self):
+        self._writer = pyarrow.RecordBatchStreamWriter(
+            self._sink, self._schema
+        )
+        return self._drain()
+
+    def write(self, mapobject_ids, rows, metadata=None):
+        values = _to_array(rows, len(self.column_names))
+        arrays = [pyarrow.array(np.asarray(mapobject_ids, dtype=np.int64))]
+        for i, t in enumerate(self._metadata_types):
+            arrays.append(pyarrow.array([m[i] for m in metadata], type=t))
+        arrays.extend([
+            pyarrow.array(values[:, i]) for i in xrange(values.shape[1])
+        ])
+        batch = pyarrow.RecordBatch.from_arrays(
+            arrays,
+            ['mapobject_id'] + [c[0] for c in self.metadata_columns] +
+            self.column_names
+        )
+        self._writer.write_batch(batch)
+        return self._drain()
+
+    def close(self):
+        self._writer.close()
+        return [self._drain()]
+
+
+class _SpooledTableWriter(TableWriter):
+
+    """Base class for writers of container formats that need to know the
+    dimensions of the table upfront. Chunks are appended to raw binary files
+    in a temporary directory and converted once the table is complete.
+    """
+
+    def __init__(self, column_names, metadata_columns=None):
+        super(_SpooledTableWriter, self).__init__(
+            column_names, metadata_columns
+        )
+        self._tmpdir = tempfile.mkdtemp(prefix='tmserver-export-')
+        self._ids_file = open(os.path.join(self._tmpdir, 'ids.bin'), 'wb')
+        self._values_file = open(os.path.join(self._tmpdir, 'values.bin'), 'wb')
+        self._n_rows = 0
+
+    def write(self, mapobject_ids, rows, metadata=None):
+        values = _to_array(rows, len(self.column_names))
+        np.asarray(mapobject_ids, dtype='<i8').tofile(self._ids_file)
+        values.astype('<f8').tofile(self._values_file)
+        self._n_rows += values.shape[0]
+        return ''
+
+    def _assemble(self):
+        """Creates the container file from the spooled raw data.
+
+        Returns
+        -------
+        str
+            path to the container file
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        self._ids_file.close()
+        self._values_file.close()
+        try:
+            filename = self._assemble()
+            for data in _iter_file(filename):
+                yield data
+        finally:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def abort(self):
+        for f in (self._ids_file, self._values_file):
+            if not f.closed:
+                f.close()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def _iter_raw(self, name, dtype, shape):
+        n = shape[1] if len(shape) > 1 else 1
+        rows_per_chunk = max(1, _READ_CHUNK_SIZE // (8 * max(n, 1)))
+        if np.prod(shape) > 0:
+            raw = np.memmap(
+                os.path.join(self._tmpdir, name), dtype=dtype, mode='r',
+                shape=shape
+            )
+        else:
+            raw = np.zeros(shape, dtype=dtype)
+        for i in xrange(0, shape[0], rows_per_chunk):
+            yield i, np.asarray(raw[i:i+rows_per_chunk])
+
+
+class NPZWriter(_SpooledTableWriter):
+
+    """Writes the table as uncompressed *NumPy* ``.npz`` archive with arrays
+    "mapobject_id", "values" and "columns".
+    """
+
+    mimetype = 'application/octet-stream'
+
+    extension = 'npz'
+
+    def _write_npy(self, raw_name, npy_name, dtype, shape):
+        filename = os.path.join(self._tmpdir, npy_name)
+        with open(filename, 'wb') as f:
+            np.lib.format.write_array_header_1_0(f, {
+                'descr': np.dtype(dtype).str,
+                'fortran_order': False,
+                'shape': shape
+            })
+            for i, chunk in self._iter_raw(raw_name, dtype, shape):
+                chunk.tofile(f)
+        return filename
+
+    def _assemble(self):
+        n_columns = len(self.column_names)
+        filename = os.path.join(self._tmpdir, 'table.npz')
+        columns_filename = os.path.join(self._tmpdir, 'columns.npy')
+        np.save(
+            columns_filename,
+            np.array(map(unicode, self.column_names), dtype=np.unicode_)
+        )
+        ids_filename = self._write_npy(
+            'ids.bin', 'mapobject_id.npy', '<i8', (self._n_rows,)
+        )
+        values_filename = self._write_npy(
+            'values.bin', 'values.npy', '<f8', (self._n_rows, n_columns)
+        )
+        # Members are stored uncompressed, such that clients can memory map
+        # the arrays directly from the archive.
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED, True) as zf:
+            zf.write(ids_filename, 'mapobject_id.npy')
+            zf.write(values_filename, 'values.npy')
+            zf.write(columns_filename, 'columns.npy')
+        return filename
+
+
+class HDF5Writer(_SpooledTableWriter):
+
+    """Writes the table as *HDF5* file with chunked datasets
+    "/mapobject_id" and "/values" and the column names stored in the
+    "columns" attribute of "/values".
+    """
+
+    mimetype = 'application/x-hdf5'
+
+    extension = 'h5'
+
+    def _assemble(self):
+        n_columns = len(self.column_names)
+        filename = os.path.join(self._tmpdir, 'table.h5')
+        shape = (self._n_rows, n_columns)
+        chunk_rows = max(1, min(self._n_rows, 2**16 // max(n_columns, 1)))
+        if self._n_rows > 0 and n_columns > 0:
+            chunks = (chunk_rows, n_columns)
+        else:
+            chunks = None
+        with h5py.File(filename, 'w') as f:
+            ids = f.create_dataset(
+                'mapobject_id', shape=(self._n_rows,), dtype='<i8',
+                chunks=(chunk_rows, ) if self._n_rows > 0 else None
+            )
+            for i, chunk in self._iter_raw('ids.bin', '<i8', (self._n_rows,)):
+                ids[i:i+len(chunk)] = chunk
+            values = f.create_dataset(
+                'values', shape=shape, dtype='<f8', chunks=chunks
+            )
+            values.attrs['columns'] = np.array(
+                map(unicode, self.column_names),
+                dtype=h5py.special_dtype(vlen=unicode)
+            )
+            for i, chunk in self._iter_raw('values.bin', '<f8', shape):
+                values[i:i+len(chunk), :] = chunk
+        return filename
+
+
+_WRITERS = {
+    'csv': CSVWriter,
+    'arrow': ArrowWriter,
+    'npz': NPZWriter,
+    'hdf5': HDF5Writer,
+}
+
+
+def get_table_writer_class(name):
+    """Gets the writer class for a format.
+
+    Parameters
+    ----------
+    name: str
+        name of the format: ``"csv"``, ``"arrow"``, ``"npz"`` or ``"hdf5"``
+
+    Returns
+    -------
+    type
+        subclass of :class:`TableWriter <tmserver.export.formats.TableWriter>`
+
+    Raises
+    ------
+    ValueError
+        when the format is unknown or not supported by the installation
+    """
+    if name not in _WRITERS:
+        raise ValueError(
+            'Unknown format "%s". Supported formats are: "%s"' % (
+                name, '", "'.join(sorted(_WRITERS.keys()))
+            )
+        )
+    if name == 'arrow' and pyarrow is None:
+        raise ValueError(
+            'Format "arrow" requires package "pyarrow", which is not installed.'
+        )
+    if name == 'hdf5' and h5py is None:
+        raise ValueError(
+            'Format "hdf5" requires package "h5py", which is not installed.'
+        )
+    return _WRITERS[name]
+
+
+def stream_table(writer, chunks):
+    """Serializes a table chunk by chunk.
+
+    Parameters
+    ----------
+    writer: tmserver.export.formats.TableWriter
+        writer for the requested format
+    chunks: Iterable[tuple]
+        mapobject IDs, corresponding rows of values and optionally rows of
+        metadata (see :meth:`TableWriter.write
+        <tmserver.export.formats.TableWriter.write>`)
+
+    Returns
+    -------
+    Generator
+        serialized table
+    """
+    complete = False
+    try:
+        data = writer.open()
+        if data:
+            yield data
+        for chunk in chunks:
+            data = writer.write(*chunk)
+            if data:
+                yield data
+        complete = True
+    finally:
+        if not complete:
+            writer.abort()
+    for data in writer.close():
+        if data:
+            yield data
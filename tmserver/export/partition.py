@@ -0,0 +1,86 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Concurrent reading of partitioned tables.
+
+Mapobjects, segmentations and feature values are distributed across database
+shards based on their `partition_key`. Reading one partition after the other
+leaves all but one shard idle. The functions in this module read several
+partitions at the same time, while preserving the order in which the
+partitions were requested.
+"""
+import collections
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+def map_partitions(func, partition_ids, max_workers, max_pending=None):
+    """Applies `func` to each partition in a bounded pool of workers and
+    yields the results in the order of `partition_ids`.
+
+    Each worker is expected to open its own database session, such that at
+    most `max_workers` database connections are in use at any time.
+    At most `max_pending` partitions are read ahead of the partition that
+    is currently being consumed. Results of partitions that finished early
+    are kept in memory until they are due, and no further partitions are
+    scheduled until the consumer catches up.
+
+    Parameters
+    ----------
+    func: function
+        function that accepts a partition ID and returns the data for that
+        partition, e.g. a chunk of a *CSV* table
+    partition_ids: Iterable[int]
+        IDs of partitions (values of `partition_key`)
+    max_workers: int
+        maximal number of partitions that are read concurrently
+    max_pending: int, optional
+        maximal number of partitions that are read ahead of the consumer
+        (default: ``2 * max_workers``)
+
+    Returns
+    -------
+    Generator
+        return values of `func` in the order of `partition_ids`
+
+    Note
+    ----
+    When the server runs with *gevent* monkey patching, workers are
+    greenlets rather than operating system threads.
+    """
+    max_workers = max(1, max_workers)
+    if max_pending is None:
+        max_pending = 2 * max_workers
+    max_pending = max(max_workers, max_pending)
+    partition_ids = iter(partition_ids)
+    executor = ThreadPoolExecutor(max_workers)
+    pending = collections.deque()
+    try:
+        for pid in itertools.islice(partition_ids, max_pending):
+            pending.append(executor.submit(func, pid))
+        while pending:
+            result = pending.popleft().result()
+            for pid in itertools.islice(partition_ids, 1):
+                pending.append(executor.submit(func, pid))
+            yield result
+    finally:
+        # The consumer may stop early, e.g. when the client closes the
+        # connection. Don't bother reading partitions nobody will receive.
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,154 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Summary statistics of feature values that are computed on the server,
+such that clients don't have to download values of individual mapobjects.
+"""
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def to_value_matrix(rows, keys):
+    """Converts feature values as returned by the database into an array.
+
+    Parameters
+    ----------
+    rows: List[Dict[str, str]]
+        feature values of mapobjects mapped to feature IDs
+    keys: List[str]
+        IDs of features in the order of columns
+
+    Returns
+    -------
+    numpy.ndarray[numpy.float64]
+        *n*x*p* array, where missing values are ``NaN``
+    """
+    if len(rows) == 0:
+        return np.empty((0, len(keys)), dtype=np.float64)
+    values = [[r.get(k) for k in keys] for r in rows]
+    return np.array(
+        [['nan' if v is None else v for v in row] for row in values],
+        dtype=np.float64
+    ).reshape(len(rows), len(keys))
+
+
+def summarize(values, quantiles=None):
+    """Computes summary statistics of feature values. Missing values are
+    ignored.
+
+    Parameters
+    ----------
+    values: numpy.ndarray[numpy.float64]
+        values of a feature
+    quantiles: List[float], optional
+        quantiles that should be computed in addition to the median
+
+    Returns
+    -------
+    dict
+        "count", "mean", "std" (with one degree of freedom), "median"
+        and, if requested, "quantiles" mapping each quantile to its value;
+        statistics are ``None`` when there are no values
+    """
+    values = values[~np.isnan(values)]
+    n = values.shape[0]
+    stats = {'count': int(n)}
+    if n == 0:
+        stats.update({'mean': None, 'std': None, 'median': None})
+        if quantiles:
+            stats['quantiles'] = {str(q): None for q in quantiles}
+        return stats
+    stats['mean'] = float(np.mean(values))
+    stats['std'] = float(np.std(values, ddof=1)) if n > 1 else None
+    stats['median'] = float(np.median(values))
+    if quantiles:
+        percentiles = np.percentile(values, [q * 100 for q in quantiles])
+        stats['quantiles'] = {
+            str(q): float(p) for q, p in zip(quantiles, percentiles)
+        }
+    return stats
+
+
+class Histogram(object):
+
+    """Histogram of one or more features with fixed bins that is accumulated
+    over chunks of values.
+    """
+
+    def __init__(self, edges):
+        """
+        Parameters
+        ----------
+        edges: List[numpy.ndarray[numpy.float64]]
+            monotonically increasing bin edges for each feature
+        """
+        self.edges = [np.asarray(e, dtype=np.float64) for e in edges]
+        self.counts = np.zeros(
+            tuple([len(e) - 1 for e in self.edges]), dtype=np.int64
+        )
+        self.n_missing = 0
+
+    @classmethod
+    def from_range(cls, limits, bins):
+        """Creates a histogram with bins of equal width.
+
+        Parameters
+        ----------
+        limits: List[Tuple[float]]
+            lower and upper limit of bins for each feature
+        bins: List[int]
+            number of bins for each feature
+
+        Returns
+        -------
+        tmserver.export.statistics.Histogram
+        """
+        edges = list()
+        for (lower, upper), n in zip(limits, bins):
+            if lower == upper:
+                # All values are identical.
+                lower, upper = lower - 0.5, upper + 0.5
+            edges.append(np.linspace(lower, upper, n + 1))
+        return cls(edges)
+
+    def add(self, values):
+        """Adds values to the histogram. Rows with missing values are counted,
+        but not binned. Values outside of the bins are ignored.
+
+        Parameters
+        ----------
+        values: numpy.ndarray[numpy.float64]
+            *n*x*p* array with a column for each feature
+        """
+        is_valid = np.all(np.isfinite(values), axis=1)
+        self.n_missing += int(np.sum(~is_valid))
+        counts, _ = np.histogramdd(values[is_valid, :], bins=self.edges)
+        self.counts += counts.astype(np.int64)
+
+    def to_dict(self):
+        """Serializes the histogram.
+
+        Returns
+        -------
+        dict
+            "edges", "counts" and "missing"
+        """
+        return {
+            'edges': [e.tolist() for e in self.edges],
+            'counts': self.counts.tolist(),
+            'missing': self.n_missing
+        }
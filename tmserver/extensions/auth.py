@@ -19,7 +19,7 @@ import datetime
 from flask import current_app, request
 from flask_sqlalchemy_session import current_session
 from passlib.hash import sha256_crypt
-from flask_jwt import JWT
+from flask_jwt import JWT, JWTError
 
 import tmlib.models as tm
 
@@ -28,6 +28,11 @@ from tmserver.error import ResourceNotFoundError
 
 jwt = JWT()
 
+#: Set[str]: endpoints that accept the token as query parameter
+#: "access_token", because browsers can't send headers with requests of
+#: server-sent events
+QUERY_TOKEN_ENDPOINTS = {'api.get_task_events'}
+
 
 # TODO: Use HTTPS for connections to /auth
 @jwt.authentication_handler
@@ -40,6 +45,27 @@ def authenticate(username, password):
     return user
 
 
+@jwt.request_handler
+def get_token():
+    """Get the token from the "Authorization" header of the request or,
+    for endpoints in :const:`QUERY_TOKEN_ENDPOINTS`, from the query string.
+    """
+    header = request.headers.get('Authorization')
+    if not header:
+        if request.endpoint in QUERY_TOKEN_ENDPOINTS:
+            return request.args.get('access_token')
+        return None
+    prefix = current_app.config['JWT_AUTH_HEADER_PREFIX']
+    parts = header.split()
+    if parts[0].lower() != prefix.lower():
+        raise JWTError('Invalid JWT header', 'Unsupported authorization type')
+    elif len(parts) == 1:
+        raise JWTError('Invalid JWT header', 'Token missing')
+    elif len(parts) > 2:
+        raise JWTError('Invalid JWT header', 'Token contains spaces')
+    return parts[1]
+
+
 @jwt.identity_handler
 def load_user(payload):
     """Lookup the user for a token payload."""
@@ -14,7 +14,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import os
+import time
 import logging
+import threading
+import gevent
 import gc3libs
 import collections
 from sqlalchemy import func
@@ -28,10 +31,67 @@ from tmlib.workflow.utils import get_task_status_recursively
 from tmlib.workflow.workflow import WorkflowStep, ParallelWorkflowStage
 
 from tmserver.model import encode_pk
+from tmserver import cfg
+from tmserver.lookup import invalidate_layout
 from tmserver.extensions.gc3pie.engine import BgEngine
+from tmserver.extensions.gc3pie.events import TaskEventBroker
+from tmserver.extensions.gc3pie.store import BatchingStore
+from tmserver.extensions.gc3pie.ipc import (
+    EngineLock, EngineServer, EngineClient, EngineError,
+    EngineUnavailableError, HubDispatcher
+)
 
 logger = logging.getLogger(__name__)
 
+#: int: number of seconds between attempts of processes that don't run the
+#: engine to reconnect to the engine or to take it over
+_FOLLOWER_RETRY_INTERVAL = 5
+
+#: int: maximal number of seconds commands are retried while no process runs
+#: the engine
+_COMMAND_TIMEOUT = 30
+
+#: int: maximal number of tasks whose log information is kept in memory
+TASK_INFO_CACHE_SIZE = 1024
+
+TaskLogInfo = collections.namedtuple(
+    'TaskLogInfo', ['jobname', 'output_dir', 'stdout', 'stderr']
+)
+
+
+def _invalidate_layout(experiment_id, event):
+    # Workflow steps, such as the alignment of images, change the geometry
+    # of sites, which is kept in memory by each server process.
+    if (event['program'] == 'workflow' and
+            event['state'] == gc3libs.Run.State.TERMINATED):
+        invalidate_layout(experiment_id)
+
+
+class _LRUCache(object):
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
 
 class GC3Pie(object):
 
@@ -63,6 +123,11 @@ class GC3Pie(object):
         a *GC3Pie* engine and start it in the background using the "gevent"
         scheduler.
 
+        Only one process of the server runs the engine. Other processes
+        send commands to that process and take over the engine in case the
+        process exits. Top-level tasks that haven't terminated yet are
+        loaded from the store when the engine is started.
+
         Parameters
         ----------
         app: flask.Flask
@@ -71,18 +136,152 @@ class GC3Pie(object):
         See also
         --------
         :class:`tmserver.extensions.gc3pie.engine.BGEngine`
+        :mod:`tmserver.extensions.gc3pie.ipc`
         """
         logger.info('initialize GC3Pie extension')
+        if not os.path.exists(cfg.cache_dir):
+            os.makedirs(cfg.cache_dir)
+        state = {
+            'engine': None,
+            'store': create_gc3pie_sql_store(),
+            'events': TaskEventBroker(),
+            'client': EngineClient(os.path.join(cfg.cache_dir, 'engine.sock')),
+            'task_info': _LRUCache(TASK_INFO_CACHE_SIZE),
+            'dispatcher': HubDispatcher(),
+        }
+        app.extensions['gc3pie'] = state
+        state['events'].add_listener(_invalidate_layout)
+        lock = EngineLock(os.path.join(cfg.cache_dir, 'engine.lock'))
+        if lock.acquire():
+            self._start_engine(state)
+        else:
+            logger.info('GC3Pie engine is run by another process')
+            thread = threading.Thread(target=self._follow, args=(state, lock))
+            thread.daemon = True
+            thread.start()
+
+    def _start_engine(self, state):
+        # Must be called from a greenlet of the hub, which runs the engine's
+        # scheduler.
         logger.debug('create GC3Pie engine')
-        store = create_gc3pie_sql_store()
-        engine = create_gc3pie_engine(store)
+        engine = create_gc3pie_engine(BatchingStore(state['store']))
         bgengine = BgEngine('gevent', engine)
+        bgengine.progress_callback = state['events'].on_progress
+        bgengine.terminated_retention = cfg.engine_task_retention
+        for task in self._load_unfinished_tasks(state['store']):
+            bgengine.add(task)
+        server = EngineServer(
+            state['client'].filename,
+            lambda op, **params: self._handle_command(state, op, **params),
+            state['dispatcher']
+        )
+        state['events'].add_listener(
+            lambda experiment_id, event: server.broadcast({
+                'experiment_id': experiment_id, 'event': event
+            })
+        )
+        server.start()
         logger.debug('start GC3Pie engine in the background')
-        bgengine.start(10)
-        app.extensions['gc3pie'] = {
-            'engine': bgengine,
-            'store': store,
-        }
+        bgengine.start(cfg.engine_min_interval, cfg.engine_max_interval)
+        state['engine'] = bgengine
+
+    def _load_unfinished_tasks(self, store):
+        # Tasks may have been processed by an engine of a process that
+        # exited, e.g. before the server was restarted. Only the most recent
+        # submission of each experiment and program is resumed. Older ones
+        # were superseded, e.g. by resubmitting a workflow, and resuming
+        # them could run two workflows for the same experiment.
+        with tm.utils.MainSession() as session:
+            latest_submissions = session.query(func.max(tm.Submission.id)).\
+                group_by(tm.Submission.experiment_id, tm.Submission.program).\
+                all()
+            latest_submission_ids = set([r[0] for r in latest_submissions])
+            unfinished = session.query(
+                    tm.Submission.id, tm.Submission.top_task_id
+                ).\
+                join(tm.Task, tm.Submission.top_task_id == tm.Task.id).\
+                filter(tm.Task.state != gc3libs.Run.State.TERMINATED).\
+                all()
+        tasks = list()
+        for submission_id, task_id in unfinished:
+            if submission_id not in latest_submission_ids:
+                logger.warn(
+                    'task %d of submission %d is not resumed, since it was '
+                    'superseded by a more recent submission',
+                    task_id, submission_id
+                )
+                continue
+            try:
+                tasks.append(store.load(task_id))
+            except Exception as err:
+                logger.error(
+                    'task %d could not be loaded: %s', task_id, str(err)
+                )
+        logger.info('load %d unfinished tasks', len(tasks))
+        return tasks
+
+    def _follow(self, state, lock):
+        # Forward events of the engine to local subscribers until the
+        # process that runs the engine exits, then try to take over.
+        # This runs in a separate thread, since it blocks on the socket.
+        dispatcher = state['dispatcher']
+        while True:
+            try:
+                for message in state['client'].subscribe():
+                    dispatcher.spawn(
+                        lambda m=message: state['events'].publish(
+                            m['experiment_id'], m['event']
+                        )
+                    )
+            except EngineError as err:
+                logger.debug(str(err))
+            if lock.acquire():
+                logger.info('take over GC3Pie engine')
+                dispatcher.call(lambda: self._start_engine(state))
+                return
+            time.sleep(_FOLLOWER_RETRY_INTERVAL)
+
+    def _handle_command(self, state, op, task_id=None, index=0):
+        # Commands that modify tasks are queued for the next cycle of the
+        # main loop and return whether they were accepted. They must not
+        # wait for access to the engine, which may be busy with `progress()`
+        # for longer than the client waits for the result.
+        engine = state['engine']
+        if op == 'submit':
+            # The task may already have been loaded when the engine was
+            # taken over.
+            if not engine.has_task(task_id):
+                engine.add(state['store'].load(task_id))
+            return True
+        elif op == 'add':
+            engine.add(state['store'].load(task_id))
+            return True
+        elif op == 'kill':
+            return engine.kill_by_id(task_id)
+        elif op == 'resubmit':
+            engine.resubmit(state['store'].load(task_id), index)
+            return True
+        elif op == 'metrics':
+            return engine.get_metrics()
+        else:
+            raise ValueError('Unknown command "%s".' % op)
+
+    def _command(self, op, **params):
+        # Sends a command to the process that runs the engine. While the
+        # engine is taken over, the command is retried until a process
+        # (possibly this one) runs the engine.
+        state = current_app.extensions['gc3pie']
+        deadline = time.time() + _COMMAND_TIMEOUT
+        while True:
+            if state['engine'] is not None:
+                return self._handle_command(state, op, **params)
+            try:
+                return state['client'].call(op, **params)
+            except EngineUnavailableError as err:
+                if time.time() > deadline:
+                    raise
+                logger.warn('retry command "%s": %s', op, str(err))
+                gevent.sleep(1)
 
     @property
     def _engine(self):
@@ -97,6 +296,13 @@ class GC3Pie(object):
         """
         return current_app.extensions.get('gc3pie', {}).get('store')
 
+    @property
+    def events(self):
+        """tmserver.extensions.gc3pie.events.TaskEventBroker: broker of
+        changes of the state of tasks
+        """
+        return current_app.extensions.get('gc3pie', {}).get('events')
+
     def store_task(self, task):
         """Stores task in the database.
 
@@ -107,6 +313,7 @@ class GC3Pie(object):
         """
         logger.debug('insert task into tasks table')
         persistent_id = self._store.save(task)
+        self._invalidate_task_info(task)
         logger.debug('update submissions table')
         with tm.utils.MainSession() as session:
             submission = session.query(tm.Submission).get(task.submission_id)
@@ -204,8 +411,46 @@ class GC3Pie(object):
         """
         return self._store.load(task_id)
 
+    @property
+    def _task_info(self):
+        return current_app.extensions.get('gc3pie', {}).get('task_info')
+
+    def _invalidate_task_info(self, task):
+        stack = [task]
+        while stack:
+            t = stack.pop()
+            stack.extend(getattr(t, 'tasks', []))
+            if getattr(t, 'persistent_id', None) is not None:
+                self._task_info.discard(t.persistent_id)
+
+    def retrieve_task_log_info(self, task_id):
+        """Retrieves the information that is required to access the log
+        output of a task. In contrast to :meth:`retrieve_task`, the
+        information is cached, such that the task doesn't need to be loaded
+        from the store each time.
+
+        Parameters
+        ----------
+        task_id: int
+            persistent task ID
+
+        Returns
+        -------
+        tmserver.extensions.gc3pie.TaskLogInfo
+            name of the job, output directory and names of the files for
+            standard output and error relative to the output directory
+        """
+        info = self._task_info.get(task_id)
+        if info is None:
+            task = self._store.load(task_id)
+            info = TaskLogInfo(
+                task.jobname, task.output_dir, task.stdout, task.stderr
+            )
+            self._task_info.put(task_id, info)
+        return info
+
     def submit_task(self, task):
-        """Submits task.
+        """Submits task. The task must have been stored before.
 
         Parameters
         ----------
@@ -214,7 +459,10 @@ class GC3Pie(object):
         """
         logger.info('submit task "%s"', task.jobname)
         logger.debug('add task %d to engine', task.persistent_id)
-        self._engine.add(task)
+        if self._engine is not None:
+            self._engine.add(task)
+        else:
+            self._command('submit', task_id=task.persistent_id)
 
     def kill_task(self, task):
         """Kills submitted task.
@@ -226,16 +474,15 @@ class GC3Pie(object):
         """
         logger.info('kill task "%s"', task.jobname)
         logger.debug('kill task %d', task.persistent_id)
-        # NOTE: The engine requires the exact same task (same Python ID)!
-        try:
-            task = self._engine.find_task_by_id(task.persistent_id)
-        except KeyError:
+        if self._engine is not None:
+            accepted = self._engine.kill_by_id(task.persistent_id)
+        else:
+            accepted = self._command('kill', task_id=task.persistent_id)
+        if not accepted:
             logger.error(
-                'task "%s" cannot be killed because it is not '
-                'actively being processed', task.jobname
+                'task %d cannot be killed because it is not '
+                'actively being processed', task.persistent_id
             )
-            return
-        self._engine.kill(task)
 
     def continue_task(self, task):
         """Continues interrupted task.
@@ -247,7 +494,11 @@ class GC3Pie(object):
         """
         logger.info('continue task "%s"', task.jobname)
         logger.debug('add task %d to engine', task.persistent_id)
-        self._engine.add(task)
+        if self._engine is not None:
+            self._engine.add(task)
+        else:
+            self._store.save(task)
+            self._command('add', task_id=task.persistent_id)
 
     def resubmit_task(self, task, index=0):
         """Resubmits a task.
@@ -260,14 +511,32 @@ class GC3Pie(object):
             index of an individual task within a sequential collection of tasks
             from where all subsequent tasks should be resubmitted
         """
-        # We need to remove the task first, simple addition doesn't update them!
-        try:
-            self._engine.remove(task)
-        except:
-            pass
-        self._engine.add(task)
         logger.info('resubmit task "%s" at %d', task.jobname, index)
-        self._engine.redo(task, index)
+        self._invalidate_task_info(task)
+        if self._engine is not None:
+            self._engine.resubmit(task, index)
+        else:
+            # The engine loads the task from the store.
+            self._store.save(task)
+            self._command('resubmit', task_id=task.persistent_id, index=index)
+
+    def get_engine_metrics(self):
+        """Describes the performance of the engine's main loop.
+
+        Returns
+        -------
+        dict
+            see
+            :meth:`BgEngine.get_metrics <tmserver.extensions.gc3pie.engine.BgEngine.get_metrics>`
+
+        Raises
+        ------
+        tmserver.extensions.gc3pie.ipc.EngineError
+            when the engine is run by another process that cannot be reached
+        """
+        if self._engine is not None:
+            return self._engine.get_metrics()
+        return self._command('metrics')
 
     # def set_jobs_to_stopped(self, jobs):
     #     '''Sets the state of jobs to ``STOPPED`` in a recursive manner.
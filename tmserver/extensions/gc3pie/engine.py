@@ -15,14 +15,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import absolute_import
 from collections import defaultdict
+import contextlib
+import datetime
 import functools
 import itertools
+import threading
 import time
 import logging
 import gc3libs
 import gc3libs.core
 import gc3libs.session
 
+from tmserver.extensions.gc3pie.metrics import EngineMetrics
+
 __docformat__ = 'reStructuredText'
 __version__ = '$Revision$'
 
@@ -130,8 +135,31 @@ class BgEngine(object):
     errors will only be visible in the background thread of execution.
 
     Users can define a custom callback function that gets invokes after each
-    `Engine.progress()` call and applied to each task managed by the engine.
+    `Engine.progress()` call and applied to each task managed by the engine
+    whose state changed during the call.
     To this end, set the attribute `progress_callback`.
+
+    Top-level tasks that terminated more than `terminated_retention` seconds
+    ago are removed from the engine together with their subtasks, such that
+    the duration of the main loop doesn't grow with the number of tasks that
+    have ever been processed.
+
+    When the "gevent" scheduler is used, delayed operations and
+    `Engine.progress()`, which block on the batch system and the database,
+    run in an operating system thread of the *gevent* hub's thread pool,
+    such that they don't stall greenlets that serve requests. The callback
+    is invoked in the scheduler's greenlet once `Engine.progress()`
+    returned. Methods that access the wrapped `Engine` directly, such as
+    `find_task_by_id` or `stats`, wait until the thread is done.
+
+    The main loop runs every `min_interval` seconds as long as tasks are
+    being processed and backs off exponentially up to `max_interval` seconds
+    when the engine is idle. Operations that add work, such as `add` or
+    `submit`, trigger the main loop right away. The current interval is
+    available as attribute `interval`.
+
+    The duration of each phase of the main loop and errors of delayed
+    operations are recorded in attribute `metrics`, see :meth:`get_metrics`.
     """
     def __init__(self, lib, *args, **kwargs):
         """
@@ -148,9 +176,20 @@ class BgEngine(object):
         """
         sched_factory, lock_factory = _get_scheduler_and_lock_factory(lib)
         self._scheduler = sched_factory()
+        self._lib = lib
         self.progress_callback = None
 
         self._engine_locked = lock_factory()
+        # The wrapped engine and its store are modified in a separate thread
+        # when the "gevent" scheduler is used, see `_run_blocking`. Locks
+        # of `lock_factory` only synchronize greenlets of the same thread.
+        if lib == 'gevent':
+            from gevent.monkey import get_original
+            self._engine_thread_lock = get_original(
+                'thread', 'allocate_lock'
+            )()
+        else:
+            self._engine_thread_lock = threading.Lock()
 
         # a queue for Engine ops
         self._q = []
@@ -174,27 +213,84 @@ class BgEngine(object):
         # no result caching until an update is really performed
         self._progress_last_run = 0
 
+        self.terminated_retention = 3600
+        # top-level tasks added via `add()` and the time they terminated
+        self._roots = dict()
+        self._terminated_at = dict()
+
+        # number of tasks by state at the end of the last cycle
+        self._task_counts = dict()
+
+        self.running = False
+        self.interval = None
+        self.min_interval = None
+        self.max_interval = None
+        self.metrics = EngineMetrics()
+
     #
     # control main loop scheduling
     #
 
-    def start(self, interval):
+    def start(self, interval, max_interval=None):
         """Starts triggering the main loop every `interval` seconds.
 
         Parameters
         ----------
         interval: int
-            looping interval for the scheduler
+            looping interval for the scheduler while tasks are processed
+        max_interval: int, optional
+            maximal looping interval while the engine is idle
+            (default: `interval`)
         """
         self.running = True
+        self.interval = interval
+        self.min_interval = interval
+        self.max_interval = max(interval, max_interval or interval)
         self._scheduler.add_job(
             (lambda: self._perform()), 'interval', seconds=interval,
-            # TODO: "id" to be able to later remove the job?
+            id='perform', max_instances=1, coalesce=True
         )
         self._scheduler.start()
         gc3libs.log.info(
-            "Started background execution of Engine %s every %d seconds",
-            self._engine, interval
+            "Started background execution of Engine %s every %d to %d "
+            "seconds", self._engine, self.min_interval, self.max_interval
+        )
+
+    def _is_busy(self):
+        with self._q_locked:
+            if self._q:
+                return True
+        # Stopped tasks wait for user interaction and don't need to be polled
+        # frequently.
+        return bool(
+            self._engine._new or self._engine._in_flight or
+            self._engine._terminating
+        )
+
+    def _adapt_interval(self):
+        if self._is_busy():
+            interval = self.min_interval
+        else:
+            interval = min(2 * self.interval, self.max_interval)
+        if interval != self.interval:
+            gc3libs.log.debug(
+                "%s: change interval from %d to %d seconds",
+                self, self.interval, interval
+            )
+            self.interval = interval
+            self._scheduler.reschedule_job(
+                'perform', trigger='interval', seconds=interval
+            )
+
+    def _wakeup(self):
+        """Triggers the main loop right away."""
+        if not self.running:
+            return
+        # The scheduler skips the run if the main loop is currently active.
+        # Queued operations are then performed after `min_interval`, since
+        # a non-empty queue keeps the engine busy.
+        self._scheduler.modify_job(
+            'perform', next_run_time=datetime.datetime.now()
         )
 
     def stop(self, wait=False):
@@ -214,6 +310,27 @@ class BgEngine(object):
         )
         self.running = False
         self._scheduler.shutdown(wait)
+        store = getattr(self._engine, '_store', None)
+        if hasattr(store, 'flush'):
+            # A cycle of the main loop may still be running.
+            with self._engine_access():
+                store.flush(full=True)
+
+    @contextlib.contextmanager
+    def _engine_access(self):
+        """Gives exclusive access to the wrapped engine and its store."""
+        if self._lib == 'gevent':
+            import gevent
+            # Blocking on the lock would stall all greenlets while the
+            # engine is used by a thread of the thread pool.
+            while not self._engine_thread_lock.acquire(False):
+                gevent.sleep(0.01)
+        else:
+            self._engine_thread_lock.acquire()
+        try:
+            yield
+        finally:
+            self._engine_thread_lock.release()
 
     def _perform(self):
         """
@@ -227,6 +344,9 @@ class BgEngine(object):
         - Run `Engine.progress()` to ensure that GC3Pie tasks are updated.
         """
         gc3libs.log.debug("%s: _perform() started", self)
+        started_at = time.time()
+        durations = dict()
+        changed = list()
         # quickly grab a local copy of the command queue, and
         # reset it to the empty list -- we do not want to hold
         # the lock on the queue for a long time, as that would
@@ -235,45 +355,175 @@ class BgEngine(object):
             q = self._q
             self._q = list()
 
-        # execute delayed operations
-        for fn, args, kwargs in q:
+        # The engine is locked while it is used by the thread of
+        # `_run_blocking`, but not while callbacks are invoked.
+        with self._engine_access():
+            # execute delayed operations
+            failed = self._run_blocking(
+                lambda: self._execute_delayed_calls(q)
+            )
+            t = time.time()
+            durations['drain'] = t - started_at
+            # update GC3Pie tasks
             gc3libs.log.debug(
-                "Executing delayed call %s(*%r, **%r) ...",
-                fn.__name__, args, kwargs
+                "%s: calling `progress()` on Engine %s ...",
+                self, self._engine
             )
             try:
-                fn(*args, **kwargs)
+                # Terminated tasks don't change unless they are redone,
+                # which moves them back into one of the other sets.
+                states = {
+                    id(task): (task, task.execution.state)
+                    for task in self._iter_active_tasks()
+                }
+                self._run_blocking(self._progress)
+                changed = self._get_changed_tasks(states)
+                self._remove_terminated_tasks()
+                self._task_counts = dict(self._engine.stats())
+                durations['progress'] = time.time() - t
+                succeeded = True
             except Exception, err:
+                succeeded = False
+                self.metrics.record_error('progress')
                 gc3libs.log.error(
-                    "Got %s executing delayed call %s(*%r, **%r): %s",
-                    err.__class__.__name__,
-                    fn.__name__, args, kwargs,
-                    err, exc_info=__debug__
+                    "Got %s running `Engine.progress()` in the background: %s",
+                    err.__class__.__name__, err, exc_info=__debug__
                 )
-        # update GC3Pie tasks
-        gc3libs.log.debug(
-            "%s: calling `progress()` on Engine %s ...",
-            self, self._engine
-        )
-        try:
-            self._engine.progress()
+        for name in failed:
+            self.metrics.record_error(name)
+        if succeeded:
+            t = time.time()
             try:
                 if self.progress_callback is not None:
-                    for task in self.iter_tasks:
+                    for task in changed:
                         self.progress_callback(task)
             except Exception, err:
+                self.metrics.record_error('progress_callback')
                 gc3libs.log.error(
                     "Got %s invoking callback after `Engine.progress()`: %s",
                     err.__class__.__name__, err, exc_info=__debug__
                 )
+            durations['callbacks'] = time.time() - t
             self._progress_last_run = time.time()
-        except Exception, err:
-            gc3libs.log.error(
-                "Got %s running `Engine.progress()` in the background: %s",
-                err.__class__.__name__, err, exc_info=__debug__
-            )
+        durations['total'] = time.time() - started_at
+        self.metrics.record_cycle(started_at, durations, len(q), len(changed))
+        if self.running:
+            with self._engine_access():
+                self._adapt_interval()
         gc3libs.log.debug("%s: _perform() done", self)
 
+    def _execute_delayed_calls(self, q):
+        # Names of failed calls are returned rather than recorded here,
+        # since this may run in a separate thread.
+        failed = list()
+        for fn, args, kwargs in q:
+            gc3libs.log.debug(
+                "Executing delayed call %s(*%r, **%r) ...",
+                fn.__name__, args, kwargs
+            )
+            try:
+                fn(*args, **kwargs)
+            except Exception, err:
+                gc3libs.log.error(
+                    "Got %s executing delayed call %s(*%r, **%r): %s",
+                    err.__class__.__name__,
+                    fn.__name__, args, kwargs,
+                    err, exc_info=__debug__
+                )
+                failed.append(fn.__name__)
+        return failed
+
+    def _progress(self):
+        with self._batch_saves():
+            self._engine.progress()
+
+    def _run_blocking(self, fn):
+        """Calls `fn` without blocking other greenlets when the "gevent"
+        scheduler is used.
+        """
+        if self._lib == 'gevent':
+            import gevent
+            # Greenlets can't switch to the thread, hence only the result is
+            # handed back to the calling greenlet.
+            return gevent.get_hub().threadpool.apply(fn)
+        return fn()
+
+    @contextlib.contextmanager
+    def _batch_saves(self):
+        # The engine's store may defer saves of tasks until the end of the
+        # cycle, see `tmserver.extensions.gc3pie.store.BatchingStore`.
+        store = getattr(self._engine, '_store', None)
+        if hasattr(store, 'batch'):
+            with store.batch():
+                yield
+        else:
+            yield
+
+    def _iter_active_tasks(self):
+        return itertools.chain(
+            iter(self._engine._new),
+            iter(self._engine._in_flight),
+            iter(self._engine._stopped),
+            iter(self._engine._terminating),
+        )
+
+    def _get_changed_tasks(self, states):
+        changed = list()
+        for task, state in states.itervalues():
+            if task.execution.state != state:
+                changed.append(task)
+        # Tasks that were added during `progress()`, e.g. subtasks of
+        # collections.
+        for task in self._iter_active_tasks():
+            if id(task) not in states:
+                changed.append(task)
+        return changed
+
+    def _remove_terminated_tasks(self):
+        now = time.time()
+        # All top-level tasks are checked rather than only the ones whose
+        # state changed, since tasks may already be terminated when they
+        # are added, e.g. when a finished workflow is continued.
+        for key, task in self._roots.items():
+            if task.execution.state == gc3libs.Run.State.TERMINATED:
+                self._terminated_at.setdefault(key, now)
+            else:
+                self._terminated_at.pop(key, None)
+        expired = [
+            key for key, t in self._terminated_at.iteritems()
+            if now - t > self.terminated_retention
+        ]
+        for key in expired:
+            del self._terminated_at[key]
+            root = self._roots.pop(key, None)
+            if root is None:
+                continue
+            if root.execution.state != gc3libs.Run.State.TERMINATED:
+                continue
+            gc3libs.log.debug(
+                "%s: remove terminated task %s from Engine", self, root
+            )
+            stack = [root]
+            while stack:
+                task = stack.pop()
+                stack.extend(getattr(task, 'tasks', []))
+                try:
+                    self._engine.remove(task)
+                except Exception, err:
+                    self.metrics.record_error('remove')
+                    gc3libs.log.error(
+                        "Got %s removing terminated task %s from Engine: %s",
+                        err.__class__.__name__, task, err
+                    )
+            self._discard_from_store(root)
+
+    def _discard_from_store(self, task):
+        # Removed tasks must not be saved anymore, see
+        # `tmserver.extensions.gc3pie.store.BatchingStore.discard`.
+        store = getattr(self._engine, '_store', None)
+        if hasattr(store, 'discard'):
+            store.discard(task)
+
     #
     # Engine interface
     #
@@ -282,11 +532,14 @@ class BgEngine(object):
         logger.debug('add task to engine: %s', task.persistent_id)
         with self._q_locked:
             self._q.append((self._engine.add, (task,), {}))
+            self._roots[id(task)] = task
+        self._wakeup()
 
     def redo(self, task, index):
         logger.debug('redo task "%s" at %d', task.persistent_id, index)
         with self._q_locked:
             self._q.append((self._engine.redo, (task, index,), {}))
+        self._wakeup()
 
     def close(self):
         with self._q_locked:
@@ -315,6 +568,71 @@ class BgEngine(object):
     def kill(self, task, **extra_args):
         with self._q_locked:
             self._q.append((self._engine.kill, (task,), extra_args))
+        self._wakeup()
+
+    def kill_by_id(self, task_id):
+        """Kills a top-level task. The task is looked up once the main loop
+        has access to the engine, such that the caller doesn't need to wait
+        until the current cycle is done.
+
+        Parameters
+        ----------
+        task_id: int
+            persistent task ID
+
+        Returns
+        -------
+        bool
+            whether the task is managed by the engine and will be killed
+        """
+        if not self.has_task(task_id):
+            return False
+        with self._q_locked:
+            self._q.append((self._kill_by_id, (task_id,), {}))
+        self._wakeup()
+        return True
+
+    def _kill_by_id(self, task_id):
+        # The engine requires the exact same task (same Python ID).
+        self._engine.kill(self._engine.find_task_by_id(task_id))
+
+    def resubmit(self, task, index=0):
+        """Replaces a top-level task with the same persistent ID and redoes
+        it. The replaced task is looked up once the main loop has access to
+        the engine, such that the caller doesn't need to wait until the
+        current cycle is done.
+
+        Parameters
+        ----------
+        task: gc3libs.Task
+            task loaded from the store
+        index: int, optional
+            index of the subtask of a sequential collection from where the
+            task should be redone
+        """
+        logger.debug(
+            'resubmit task "%s" at %d', task.persistent_id, index
+        )
+        with self._q_locked:
+            self._q.append((self._resubmit, (task, index), {}))
+            for key, root in self._roots.items():
+                if getattr(root, 'persistent_id', None) == task.persistent_id:
+                    del self._roots[key]
+            self._roots[id(task)] = task
+        self._wakeup()
+
+    def _resubmit(self, task, index):
+        # Simple addition doesn't update a task that is already managed.
+        try:
+            replaced = self._engine.find_task_by_id(task.persistent_id)
+        except KeyError:
+            pass
+        else:
+            self._engine.remove(replaced)
+            self._discard_from_store(replaced)
+            self._terminated_at.pop(id(replaced), None)
+        self._engine.add(task)
+        self._engine.redo(task, index)
 
     def peek(self, task, what='stdout', offset=0, size=None, **extra_args):
         with self._q_locked:
@@ -341,20 +659,25 @@ class BgEngine(object):
         logger.debug('remove task from engine: %s', task.persistent_id)
         with self._q_locked:
             self._q.append((self._engine.remove, (task,), {}))
+            self._q.append((self._discard_from_store, (task,), {}))
+            self._roots.pop(id(task), None)
 
     def select_resource(self, match):
         with self._q_locked:
             self._q.append((self._engine.select_resource, (match,), {}))
 
     def stats(self, only=None):
-        return self._engine.stats(only)
+        with self._engine_access():
+            return self._engine.stats(only)
 
     def submit(self, task, resubmit=False, targets=None, **extra_args):
         with self._q_locked:
             self._q.append((self._engine.submit, (task, resubmit, targets), extra_args))
+        self._wakeup()
 
     def find_task_by_id(self, task_id):
-        return self._engine.find_task_by_id(task_id)
+        with self._engine_access():
+            return self._engine.find_task_by_id(task_id)
 
     def update_job_state(self, *tasks, **extra_args):
         with self._q_locked:
@@ -364,14 +687,55 @@ class BgEngine(object):
     # informational methods
     #
 
+    def get_metrics(self):
+        """Describes the performance of the main loop.
+
+        Returns
+        -------
+        dict
+            summary of recent cycles of the main loop (see
+            :meth:`EngineMetrics.snapshot <tmserver.extensions.gc3pie.metrics.EngineMetrics.snapshot>`)
+            together with the current "interval", the number of queued
+            operations ("queue_length") and the number of tasks by state at
+            the end of the last cycle ("tasks")
+        """
+        metrics = self.metrics.snapshot()
+        with self._q_locked:
+            metrics['queue_length'] = len(self._q)
+        metrics['interval'] = self.interval
+        # Unlike `stats`, this doesn't wait until `progress()` is done.
+        metrics['tasks'] = dict(self._task_counts)
+        return metrics
+
+    def has_task(self, task_id):
+        """Checks whether a top-level task was added to the engine and hasn't
+        been removed since.
+
+        Parameters
+        ----------
+        task_id: int
+            persistent task ID
+
+        Returns
+        -------
+        bool
+        """
+        with self._q_locked:
+            return any(
+                getattr(task, 'persistent_id', None) == task_id
+                for task in self._roots.itervalues()
+            )
+
     def iter_tasks(self):
         """
         Iterate over all tasks managed by the Engine.
         """
-        return itertools.chain(
-            iter(self._engine._new),
-            iter(self._engine._in_flight),
-            iter(self._engine._stopped),
-            iter(self._engine._terminating),
-            iter(self._engine._terminated),
-        )
+        # The sets of tasks may change once the lock is released.
+        with self._engine_access():
+            return iter(list(itertools.chain(
+                iter(self._engine._new),
+                iter(self._engine._in_flight),
+                iter(self._engine._stopped),
+                iter(self._engine._terminating),
+                iter(self._engine._terminated),
+            )))
@@ -0,0 +1,191 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Notification of clients about changes of the state of computational tasks.
+
+The broker is registered as `progress_callback` of the
+:class:`BgEngine <tmserver.extensions.gc3pie.engine.BgEngine>` and publishes
+an event whenever the state of a task changed. Clients subscribe to the events
+of an experiment rather than polling the status of tasks from the database.
+"""
+import logging
+import threading
+import collections
+import gc3libs
+import gevent.queue
+
+import tmlib.models as tm
+
+from tmserver.model import encode_pk
+
+logger = logging.getLogger(__name__)
+
+#: int: maximal number of events that are buffered for a subscriber
+MAX_PENDING_EVENTS = 1000
+
+Submission = collections.namedtuple(
+    'Submission', ['experiment_id', 'user_id', 'program']
+)
+
+
+class TaskEventBroker(object):
+
+    """Publishes changes of the state of tasks to subscribers of the
+    experiment the tasks belong to.
+    """
+
+    def __init__(self):
+        self._subscribers = collections.defaultdict(set)
+        self._lock = threading.Lock()
+        self._states = dict()
+        self._submissions = dict()
+        # number of tasks of each submission that haven't terminated
+        self._active = collections.Counter()
+        self._listeners = list()
+
+    def add_listener(self, listener):
+        """Adds a function that gets called for every published event,
+        e.g. to forward events to other processes.
+
+        Parameters
+        ----------
+        listener: function
+            function that accepts the experiment ID and the event
+        """
+        self._listeners.append(listener)
+
+    def subscribe(self, experiment_id):
+        """Subscribes to events of an experiment.
+
+        Parameters
+        ----------
+        experiment_id: int
+            ID of the experiment
+
+        Returns
+        -------
+        gevent.queue.Queue
+            queue of events, where each event is a dictionary with keys
+            "id", "name", "submission_id", "user_id", "program",
+            "old_state", "state" and "exitcode"
+
+        Note
+        ----
+        Events are published by the hub, and waiting for them only blocks the
+        current greenlet, also when the server runs without *gevent* monkey
+        patching. Events are dropped when the subscriber doesn't keep up with
+        them. Call :meth:`unsubscribe` once events are no longer consumed.
+        """
+        queue = gevent.queue.Queue(MAX_PENDING_EVENTS)
+        with self._lock:
+            self._subscribers[experiment_id].add(queue)
+        return queue
+
+    def unsubscribe(self, experiment_id, queue):
+        """Cancels a subscription.
+
+        Parameters
+        ----------
+        experiment_id: int
+            ID of the experiment
+        queue: gevent.queue.Queue
+            queue returned by :meth:`subscribe`
+        """
+        with self._lock:
+            self._subscribers[experiment_id].discard(queue)
+            if not self._subscribers[experiment_id]:
+                del self._subscribers[experiment_id]
+
+    def publish(self, experiment_id, event):
+        """Publishes an event to all subscribers of an experiment.
+
+        Parameters
+        ----------
+        experiment_id: int
+            ID of the experiment
+        event: dict
+            event
+        """
+        for listener in self._listeners:
+            listener(experiment_id, event)
+        with self._lock:
+            queues = list(self._subscribers.get(experiment_id, []))
+        for queue in queues:
+            try:
+                queue.put_nowait(event)
+            except gevent.queue.Full:
+                logger.warn(
+                    'drop event for subscriber of experiment %d', experiment_id
+                )
+
+    def _get_submission(self, submission_id):
+        submission = self._submissions.get(submission_id)
+        if submission is None:
+            with tm.utils.MainSession() as session:
+                submission = session.query(
+                        tm.Submission.experiment_id, tm.Submission.user_id,
+                        tm.Submission.program
+                    ).\
+                    filter_by(id=submission_id).\
+                    one_or_none()
+            if submission is None:
+                return None
+            submission = Submission(*submission)
+            self._submissions[submission_id] = submission
+        return submission
+
+    def on_progress(self, task):
+        """Publishes an event in case the state of a task changed since the
+        previous call for the task.
+
+        Parameters
+        ----------
+        task: gc3libs.Task
+            task managed by the engine
+        """
+        task_id = getattr(task, 'persistent_id', None)
+        submission_id = getattr(task, 'submission_id', None)
+        if task_id is None or submission_id is None:
+            return
+        state = task.execution.state
+        old_state = self._states.get(task_id)
+        if state == old_state:
+            return
+        if state == gc3libs.Run.State.TERMINATED:
+            # The engine only reports tasks whose state changed, such that
+            # terminated tasks don't need to be remembered.
+            if self._states.pop(task_id, None) is not None:
+                self._active[submission_id] -= 1
+        else:
+            if old_state is None:
+                self._active[submission_id] += 1
+            self._states[task_id] = state
+        submission = self._get_submission(submission_id)
+        if self._active[submission_id] <= 0:
+            # All tasks of the submission terminated.
+            del self._active[submission_id]
+            self._submissions.pop(submission_id, None)
+        if submission is None:
+            return
+        self.publish(submission.experiment_id, {
+            'id': encode_pk(task_id),
+            'name': task.jobname,
+            'submission_id': submission_id,
+            'user_id': submission.user_id,
+            'program': submission.program,
+            'old_state': old_state,
+            'state': state,
+            'exitcode': task.execution.exitcode
+        })
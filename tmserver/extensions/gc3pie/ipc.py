@@ -0,0 +1,378 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Communication between the processes of the server and the single process
+that runs the *GC3Pie* engine.
+
+The server is typically run with several worker processes. Only the process
+that holds the :class:`EngineLock` runs the engine (the *leader*). The other
+processes send commands to the leader via a Unix domain socket using an
+:class:`EngineClient`, which is served by an :class:`EngineServer`.
+Messages are JSON objects that are separated by newlines.
+
+Connections are served in operating system threads. Commands are performed
+in greenlets of the *gevent* hub that runs the engine, see
+:class:`HubDispatcher`.
+"""
+import os
+import json
+import errno
+import fcntl
+import socket
+import logging
+import threading
+import collections
+import gevent
+from gevent.monkey import get_original
+
+logger = logging.getLogger(__name__)
+
+
+class EngineError(Exception):
+
+    """Error that is raised when the leader failed to perform a command or
+    could not be reached.
+    """
+
+
+class EngineUnavailableError(EngineError):
+
+    """Error that is raised when no process accepts commands, e.g. while
+    the engine is taken over after its previous process exited. In contrast
+    to other errors, the command has not been received.
+    """
+
+
+class HubDispatcher(object):
+
+    """Runs functions in greenlets of the *gevent* hub of the thread that
+    created the dispatcher on behalf of other operating system threads.
+
+    The engine and its scheduler are not thread-safe and must only be
+    accessed from greenlets of the hub that runs them.
+    """
+
+    def __init__(self):
+        self._hub = gevent.get_hub()
+        self._thread_id = get_original('thread', 'get_ident')()
+        self._calls = collections.deque()
+        self._watcher = self._hub.loop.async()
+        # The watcher shouldn't keep the event loop alive.
+        self._watcher.ref = False
+        self._watcher.start(self._dispatch)
+
+    def _dispatch(self):
+        while self._calls:
+            gevent.spawn(self._calls.popleft())
+
+    def _is_hub_thread(self):
+        return get_original('thread', 'get_ident')() == self._thread_id
+
+    def spawn(self, fn):
+        """Runs a function in a greenlet of the hub without waiting for it.
+
+        Parameters
+        ----------
+        fn: function
+            function without arguments
+        """
+        if self._is_hub_thread():
+            gevent.spawn(fn)
+            return
+        self._calls.append(fn)
+        self._watcher.send()
+
+    def call(self, fn):
+        """Runs a function in a greenlet of the hub and waits for its result.
+
+        Parameters
+        ----------
+        fn: function
+            function without arguments
+
+        Returns
+        -------
+        return value of `fn`
+
+        Raises
+        ------
+        Exception
+            exception raised by `fn`
+        """
+        # With monkey patching, threads are greenlets of the hub.
+        if self._is_hub_thread():
+            return fn()
+        done = get_original('thread', 'allocate_lock')()
+        done.acquire()
+        outcome = dict()
+
+        def run():
+            try:
+                outcome['result'] = fn()
+            except Exception as err:
+                outcome['error'] = err
+            finally:
+                done.release()
+
+        self.spawn(run)
+        done.acquire()
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['result']
+
+
+class EngineLock(object):
+
+    """Exclusive lock that determines which process runs the engine.
+    The lock is released by the operating system when the process exits.
+    """
+
+    def __init__(self, filename):
+        """
+        Parameters
+        ----------
+        filename: str
+            absolute path to the lock file
+        """
+        self.filename = filename
+        self._fd = None
+
+    @property
+    def is_acquired(self):
+        """bool: whether the lock is held by this process"""
+        return self._fd is not None
+
+    def acquire(self):
+        """Tries to acquire the lock without blocking.
+
+        Returns
+        -------
+        bool
+            whether the lock was acquired
+        """
+        if self._fd is not None:
+            return True
+        fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as err:
+            os.close(fd)
+            if err.errno in {errno.EAGAIN, errno.EACCES}:
+                return False
+            raise
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()))
+        self._fd = fd
+        logger.info('process %d acquired engine lock', os.getpid())
+        return True
+
+
+class EngineServer(object):
+
+    """Server that performs commands on behalf of other processes and
+    forwards events to subscribed processes.
+    """
+
+    def __init__(self, filename, handler, dispatcher):
+        """
+        Parameters
+        ----------
+        filename: str
+            absolute path to the Unix domain socket
+        handler: function
+            function that gets called with the name of the command and its
+            parameters as keyword arguments and returns a JSON serializable
+            result
+        dispatcher: tmserver.extensions.gc3pie.ipc.HubDispatcher
+            dispatcher that runs `handler` in greenlets of the hub that runs
+            the engine
+        """
+        self.filename = filename
+        self.handler = handler
+        self.dispatcher = dispatcher
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._socket = None
+
+    def start(self):
+        """Starts accepting connections in the background."""
+        # A socket file may have been left behind by a previous leader.
+        try:
+            os.remove(self.filename)
+        except OSError as err:
+            if err.errno != errno.ENOENT:
+                raise
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self.filename)
+        self._socket.listen(128)
+        thread = threading.Thread(target=self._serve)
+        thread.daemon = True
+        thread.start()
+
+    def _serve(self):
+        while True:
+            connection, _ = self._socket.accept()
+            thread = threading.Thread(
+                target=self._handle, args=(connection, )
+            )
+            thread.daemon = True
+            thread.start()
+
+    def _handle(self, connection):
+        stream = connection.makefile('r+b')
+        try:
+            for line in stream:
+                request = json.loads(line)
+                op = request.pop('op')
+                if op == 'subscribe':
+                    # Keep the connection open for events.
+                    with self._lock:
+                        self._subscribers.add(stream)
+                    return
+                try:
+                    response = {
+                        'result': self.dispatcher.call(
+                            lambda: self.handler(op, **request)
+                        )
+                    }
+                except Exception as err:
+                    logger.error(
+                        'command "%s" failed: %s', op, str(err), exc_info=True
+                    )
+                    response = {
+                        'error': '%s: %s' % (err.__class__.__name__, str(err))
+                    }
+                stream.write(json.dumps(response) + '\n')
+                stream.flush()
+        except socket.error as err:
+            logger.debug('connection closed: %s', str(err))
+        stream.close()
+        connection.close()
+
+    def broadcast(self, message):
+        """Sends a message to all subscribed processes.
+
+        Parameters
+        ----------
+        message: dict
+            JSON serializable message
+        """
+        data = json.dumps(message) + '\n'
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for stream in subscribers:
+            try:
+                stream.write(data)
+                stream.flush()
+            except socket.error:
+                logger.debug('remove subscriber')
+                with self._lock:
+                    self._subscribers.discard(stream)
+
+
+class EngineClient(object):
+
+    """Client that sends commands to the :class:`EngineServer`."""
+
+    def __init__(self, filename, timeout=30):
+        """
+        Parameters
+        ----------
+        filename: str
+            absolute path to the Unix domain socket
+        timeout: int, optional
+            maximal number of seconds to wait for the result of a command
+        """
+        self.filename = filename
+        self.timeout = timeout
+
+    def _connect(self, timeout):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        try:
+            connection.connect(self.filename)
+        except socket.error as err:
+            connection.close()
+            raise EngineUnavailableError(
+                'Engine cannot be reached: %s' % str(err)
+            )
+        return connection
+
+    def call(self, op, **params):
+        """Performs a command.
+
+        Parameters
+        ----------
+        op: str
+            name of the command
+        **params: dict
+            JSON serializable parameters of the command
+
+        Returns
+        -------
+        result of the command
+
+        Raises
+        ------
+        tmserver.extensions.gc3pie.ipc.EngineUnavailableError
+            when the engine cannot be reached
+        tmserver.extensions.gc3pie.ipc.EngineError
+            when the command failed
+        """
+        connection = self._connect(self.timeout)
+        try:
+            stream = connection.makefile('r+b')
+            params['op'] = op
+            stream.write(json.dumps(params) + '\n')
+            stream.flush()
+            line = stream.readline()
+        except socket.error as err:
+            raise EngineError('Command "%s" failed: %s' % (op, str(err)))
+        finally:
+            connection.close()
+        if not line:
+            raise EngineError('Command "%s" failed: no response' % op)
+        response = json.loads(line)
+        if 'error' in response:
+            raise EngineError(
+                'Command "%s" failed: %s' % (op, response['error'])
+            )
+        return response['result']
+
+    def subscribe(self):
+        """Subscribes to messages broadcast by the server.
+
+        Returns
+        -------
+        Generator
+            messages; ends when the connection is lost
+
+        Raises
+        ------
+        tmserver.extensions.gc3pie.ipc.EngineError
+            when the engine cannot be reached
+        """
+        connection = self._connect(self.timeout)
+        connection.settimeout(None)
+        try:
+            stream = connection.makefile('r+b')
+            stream.write(json.dumps({'op': 'subscribe'}) + '\n')
+            stream.flush()
+            for line in stream:
+                yield json.loads(line)
+        except socket.error as err:
+            logger.debug('subscription ended: %s', str(err))
+        finally:
+            connection.close()
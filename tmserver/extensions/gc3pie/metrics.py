@@ -0,0 +1,131 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Instrumentation of the main loop of the
+:class:`BgEngine <tmserver.extensions.gc3pie.engine.BgEngine>`.
+"""
+import logging
+import collections
+
+logger = logging.getLogger(__name__)
+
+#: int: number of most recent cycles of the main loop that are kept in memory
+WINDOW = 1000
+
+#: List[float]: upper bounds of the histogram bins of cycle durations in
+#: seconds; longer cycles are counted in an additional bin
+HISTOGRAM_BUCKETS = [0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300]
+
+#: List[str]: phases of a cycle of the main loop
+PHASES = ['drain', 'progress', 'callbacks', 'total']
+
+
+def _summarize(values):
+    if not values:
+        return {'mean': None, 'median': None, 'p95': None, 'max': None}
+    values = sorted(values)
+    n = len(values)
+    return {
+        'mean': sum(values) / float(n),
+        'median': values[(n - 1) // 2],
+        'p95': values[min(n - 1, int(0.95 * n))],
+        'max': values[-1]
+    }
+
+
+class EngineMetrics(object):
+
+    """Rolling statistics of the cycles of the main loop of the engine."""
+
+    def __init__(self, window=WINDOW):
+        """
+        Parameters
+        ----------
+        window: int, optional
+            number of most recent cycles that statistics are computed for
+        """
+        self._cycles = collections.deque(maxlen=window)
+        self._errors = collections.Counter()
+        self.n_cycles = 0
+
+    def record_cycle(self, started_at, durations, queue_length, n_changed):
+        """Records a cycle of the main loop.
+
+        Parameters
+        ----------
+        started_at: float
+            time the cycle started in seconds since the epoch
+        durations: Dict[str, float]
+            duration of each of the :const:`PHASES` in seconds
+        queue_length: int
+            number of delayed operations that were performed
+        n_changed: int
+            number of tasks whose state changed
+        """
+        cycle = {
+            'started_at': started_at,
+            'queue_length': queue_length,
+            'changed_tasks': n_changed
+        }
+        cycle.update({p: durations.get(p, 0.0) for p in PHASES})
+        self._cycles.append(cycle)
+        self.n_cycles += 1
+
+    def record_error(self, name):
+        """Records an error.
+
+        Parameters
+        ----------
+        name: str
+            name of the failed operation, e.g. the name of a delayed call or
+            ``"progress"``
+        """
+        self._errors[name] += 1
+
+    def snapshot(self):
+        """Summarizes the recorded cycles and errors.
+
+        Returns
+        -------
+        dict
+            "cycles" (total number of cycles), "window" (number of cycles
+            that statistics are computed for), "last_cycle", "durations"
+            (mean, median, 95th percentile and maximum duration of each
+            phase), "histogram" (counts of total durations for each of the
+            :const:`HISTOGRAM_BUCKETS` and for longer cycles) and "errors"
+            (number of errors by operation since the engine was started)
+        """
+        cycles = list(self._cycles)
+        counts = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+        for c in cycles:
+            i = 0
+            for upper in HISTOGRAM_BUCKETS:
+                if c['total'] <= upper:
+                    break
+                i += 1
+            counts[i] += 1
+        return {
+            'cycles': self.n_cycles,
+            'window': len(cycles),
+            'last_cycle': cycles[-1] if cycles else None,
+            'durations': {
+                p: _summarize([c[p] for c in cycles]) for p in PHASES
+            },
+            'histogram': {
+                'buckets': list(HISTOGRAM_BUCKETS),
+                'counts': counts
+            },
+            'errors': dict(self._errors)
+        }
@@ -0,0 +1,210 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Batched persistence of tasks that are updated by the *GC3Pie* engine.
+
+`Engine.progress()` saves each task whose state changed separately, which
+pickles the task including all of its subtasks and updates the corresponding
+row of the :class:`Task <tmlib.models.submission.Task>` table. The
+:class:`BatchingStore` collects these saves during one call and
+writes them afterwards at once.
+"""
+import time
+import logging
+import collections
+import contextlib
+import gc3libs
+
+import tmlib.models as tm
+
+logger = logging.getLogger(__name__)
+
+#: int: maximal number of seconds after which the pickled representation of a
+#: task is updated while the task is being processed
+FULL_SAVE_INTERVAL = 300
+
+
+class BatchingStore(object):
+
+    """Proxy of a :class:`gc3libs.persistence.sql.SqlStore` that defers saves
+    of tasks while batching is active.
+
+    When the batch ends, a change of the state of a task is persisted by
+    updating only the "state" and "exitcode" columns of all tasks in a
+    single transaction. Tasks are only pickled once they terminated or when
+    their pickled representation is older than :const:`FULL_SAVE_INTERVAL`,
+    even if their state didn't change since. Subtasks are not saved
+    separately when one of their ancestors gets pickled, since pickling a
+    task saves its subtasks as well.
+
+    Tasks that are removed from the engine must be passed to
+    :meth:`discard`, such that an outdated object isn't saved over a newer
+    version of the task, e.g. after the task was resubmitted.
+    """
+
+    def __init__(self, store):
+        """
+        Parameters
+        ----------
+        store: gc3libs.persistence.sql.SqlStore
+            store that persists tasks
+        """
+        self._store = store
+        self._pending = collections.OrderedDict()
+        self._saved_at = dict()
+        # tasks whose pickled representation is outdated by persistent ID
+        self._outdated = dict()
+        self._batching = False
+
+    def __getattr__(self, name):
+        return getattr(self._store, name)
+
+    def save(self, obj):
+        """Saves an object or defers the save while batching is active.
+
+        Parameters
+        ----------
+        obj: gc3libs.Task
+            object that should be saved
+
+        Returns
+        -------
+        int
+            persistent ID of the object
+        """
+        persistent_id = getattr(obj, 'persistent_id', None)
+        if not self._batching or persistent_id is None:
+            persistent_id = self._store.save(obj)
+            self._saved_at[persistent_id] = time.time()
+            return persistent_id
+        self._pending[id(obj)] = obj
+        return persistent_id
+
+    def discard(self, task):
+        """Forgets about a task and its subtasks, which will no longer be
+        saved unless they are passed to :meth:`save` again.
+
+        Parameters
+        ----------
+        task: gc3libs.Task
+            task that was removed from the engine
+        """
+        stack = [task]
+        while stack:
+            t = stack.pop()
+            stack.extend(getattr(t, 'tasks', []))
+            self._pending.pop(id(t), None)
+            persistent_id = getattr(t, 'persistent_id', None)
+            if self._outdated.get(persistent_id) is t:
+                del self._outdated[persistent_id]
+                self._saved_at.pop(persistent_id, None)
+
+    @contextlib.contextmanager
+    def batch(self):
+        """Defers saves until the end of the context."""
+        self._batching = True
+        try:
+            yield
+        finally:
+            self._batching = False
+            self.flush()
+
+    def flush(self, full=False):
+        """Writes deferred saves.
+
+        Parameters
+        ----------
+        full: bool, optional
+            whether all tasks should be pickled, including tasks whose state
+            was only updated previously (default: ``False``)
+        """
+        now = time.time()
+        for persistent_id, task in self._outdated.iteritems():
+            if (full or
+                    now - self._saved_at.get(persistent_id, 0) >
+                    FULL_SAVE_INTERVAL):
+                self._pending.setdefault(id(task), task)
+        tasks = self._pending.values()
+        self._pending.clear()
+        if not tasks:
+            return
+        full_saves = list()
+        state_updates = list()
+        for task in tasks:
+            if (full or
+                    task.execution.state == gc3libs.Run.State.TERMINATED or
+                    now - self._saved_at.get(task.persistent_id, 0) >
+                    FULL_SAVE_INTERVAL):
+                full_saves.append(task)
+            else:
+                state_updates.append(task)
+
+        covered = dict()
+        for task in full_saves:
+            stack = list(getattr(task, 'tasks', []))
+            while stack:
+                subtask = stack.pop()
+                covered[id(subtask)] = subtask
+                stack.extend(getattr(subtask, 'tasks', []))
+
+        start = time.time()
+        n = 0
+        for task in full_saves:
+            if id(task) in covered:
+                continue
+            try:
+                self._store.save(task)
+            except Exception as err:
+                logger.error(
+                    'task %d could not be saved: %s',
+                    task.persistent_id, str(err)
+                )
+                continue
+            self._mark_saved(task, now)
+            n += 1
+        for subtask in covered.itervalues():
+            self._mark_saved(subtask, now)
+        mappings = [
+            {
+                'id': task.persistent_id,
+                'state': task.execution.state,
+                'exitcode': task.execution.exitcode
+            }
+            for task in state_updates if id(task) not in covered
+        ]
+        if mappings:
+            self._update_states(mappings)
+            for task in state_updates:
+                if id(task) not in covered:
+                    self._outdated[task.persistent_id] = task
+        logger.debug(
+            'saved %d tasks and updated state of %d tasks in %.3f seconds',
+            n, len(mappings), time.time() - start
+        )
+        for task in tasks:
+            if task.execution.state == gc3libs.Run.State.TERMINATED:
+                self._saved_at.pop(task.persistent_id, None)
+
+    def _mark_saved(self, task, now):
+        persistent_id = getattr(task, 'persistent_id', None)
+        if persistent_id is None:
+            return
+        self._saved_at[persistent_id] = now
+        if self._outdated.get(persistent_id) is task:
+            del self._outdated[persistent_id]
+
+    def _update_states(self, mappings):
+        with tm.utils.MainSession() as session:
+            session.bulk_update_mappings(tm.Task, mappings)
@@ -0,0 +1,361 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""In-memory index of the plate/well/site hierarchy of experiments.
+
+View functions frequently need to resolve plate and well names and
+positions within wells to :class:`Site <tmlib.models.site.Site>` IDs.
+The hierarchy rarely changes, so it is loaded once per experiment and kept in
+memory. The index must be invalidated via :func:`invalidate_layout` when
+plates or acquisitions are modified. This happens as well in each server
+process when a workflow task terminates, since workflow jobs create sites
+and align images. Because sites may also be modified by other server
+processes, the index expires after :const:`LAYOUT_MAX_AGE` seconds and gets
+reloaded once when a site can't be found.
+"""
+import time
+import logging
+import threading
+import collections
+
+import tmlib.models as tm
+
+from tmserver.error import ResourceNotFoundError
+
+logger = logging.getLogger(__name__)
+
+#: int: number of seconds after which an index gets reloaded
+LAYOUT_MAX_AGE = 300
+
+#: int: minimal number of seconds between reloads caused by unknown sites
+_RELOAD_INTERVAL = 5
+
+PlateRecord = collections.namedtuple('PlateRecord', ['id', 'plate_name'])
+
+WellRecord = collections.namedtuple(
+    'WellRecord', ['id', 'well_name', 'plate_name']
+)
+
+SiteRecord = collections.namedtuple(
+    'SiteRecord',
+    ['id', 'well_pos_y', 'well_pos_x', 'well_name', 'plate_name']
+)
+
+SiteGeometry = collections.namedtuple(
+    'SiteGeometry',
+    ['offset', 'image_size', 'aligned_offset', 'aligned_image_size']
+)
+
+
+class ExperimentLayout(object):
+
+    """Index of the plates, wells and sites of an experiment."""
+
+    def __init__(self, plates, wells, sites):
+        """
+        Parameters
+        ----------
+        plates: List[tmserver.lookup.PlateRecord]
+            plates of the experiment
+        wells: List[tmserver.lookup.WellRecord]
+            wells of the experiment
+        sites: List[tmserver.lookup.SiteRecord]
+            sites of the experiment
+        """
+        self.plates = sorted(plates)
+        self.wells = sorted(wells)
+        self.sites = sorted(sites)
+        self.created = time.time()
+        self._site_lut = {
+            (s.plate_name, s.well_name, s.well_pos_y, s.well_pos_x): s.id
+            for s in self.sites
+        }
+        self._plate_names = set([p.plate_name for p in self.plates])
+        self._well_names = set([w.well_name for w in self.wells])
+        self._site_ys = set([s.well_pos_y for s in self.sites])
+        self._site_xs = set([s.well_pos_x for s in self.sites])
+        self._geometries = dict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, session):
+        """Loads the index from the database.
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            database session
+
+        Returns
+        -------
+        tmserver.lookup.ExperimentLayout
+        """
+        plates = session.query(tm.Plate.id, tm.Plate.name).all()
+        wells = session.query(tm.Well.id, tm.Well.name, tm.Plate.name).\
+            join(tm.Plate).\
+            all()
+        sites = session.query(
+                tm.Site.id, tm.Site.y, tm.Site.x, tm.Well.name, tm.Plate.name
+            ).\
+            join(tm.Well).\
+            join(tm.Plate).\
+            all()
+        return cls(
+            [PlateRecord(*p) for p in plates],
+            [WellRecord(*w) for w in wells],
+            [SiteRecord(*s) for s in sites]
+        )
+
+    def _check_plate(self, plate_name):
+        if plate_name is not None and plate_name not in self._plate_names:
+            raise ResourceNotFoundError(tm.Plate, name=plate_name)
+
+    def _check_well(self, well_name):
+        if well_name is not None and well_name not in self._well_names:
+            raise ResourceNotFoundError(tm.Well, name=well_name)
+
+    def find_plates(self, plate_name=None):
+        """Finds plates.
+
+        Parameters
+        ----------
+        plate_name: str, optional
+            name of the plate
+
+        Returns
+        -------
+        List[tmserver.lookup.PlateRecord]
+            matching plates sorted by ID
+
+        Raises
+        ------
+        tmserver.error.ResourceNotFoundError
+            when there is no plate with the given name
+        """
+        self._check_plate(plate_name)
+        return [
+            p for p in self.plates
+            if plate_name is None or p.plate_name == plate_name
+        ]
+
+    def find_wells(self, plate_name=None, well_name=None):
+        """Finds wells.
+
+        Parameters
+        ----------
+        plate_name: str, optional
+            name of the plate
+        well_name: str, optional
+            name of the well
+
+        Returns
+        -------
+        List[tmserver.lookup.WellRecord]
+            matching wells sorted by ID
+
+        Raises
+        ------
+        tmserver.error.ResourceNotFoundError
+            when there is no plate or well with the given name
+        """
+        self._check_plate(plate_name)
+        self._check_well(well_name)
+        return [
+            w for w in self.wells
+            if (plate_name is None or w.plate_name == plate_name) and
+            (well_name is None or w.well_name == well_name)
+        ]
+
+    def find_sites(self, plate_name=None, well_name=None, well_pos_y=None,
+            well_pos_x=None):
+        """Finds sites.
+
+        Parameters
+        ----------
+        plate_name: str, optional
+            name of the plate
+        well_name: str, optional
+            name of the well
+        well_pos_y: int, optional
+            y-coordinate of the site within the well
+        well_pos_x: int, optional
+            x-coordinate of the site within the well
+
+        Returns
+        -------
+        List[tmserver.lookup.SiteRecord]
+            matching sites sorted by ID
+
+        Raises
+        ------
+        tmserver.error.ResourceNotFoundError
+            when there is no plate, well or site with the given name or
+            position
+        """
+        self._check_plate(plate_name)
+        self._check_well(well_name)
+        if well_pos_y is not None and well_pos_y not in self._site_ys:
+            raise ResourceNotFoundError(tm.Site, y=well_pos_y)
+        if well_pos_x is not None and well_pos_x not in self._site_xs:
+            raise ResourceNotFoundError(tm.Site, x=well_pos_x)
+        return [
+            s for s in self.sites
+            if (plate_name is None or s.plate_name == plate_name) and
+            (well_name is None or s.well_name == well_name) and
+            (well_pos_y is None or s.well_pos_y == well_pos_y) and
+            (well_pos_x is None or s.well_pos_x == well_pos_x)
+        ]
+
+    def get_site_id(self, plate_name, well_name, well_pos_y, well_pos_x):
+        """Gets the ID of a site.
+
+        Parameters
+        ----------
+        plate_name: str
+            name of the plate
+        well_name: str
+            name of the well
+        well_pos_y: int
+            y-coordinate of the site within the well
+        well_pos_x: int
+            x-coordinate of the site within the well
+
+        Returns
+        -------
+        int
+            ID of the site or ``None`` if there is no such site
+        """
+        return self._site_lut.get(
+            (plate_name, well_name, well_pos_y, well_pos_x)
+        )
+
+    def get_site_geometry(self, session, site_id):
+        """Gets the position and size of a site within the overview.
+        Values are loaded on first use, because computing them requires the
+        full :class:`Site <tmlib.models.site.Site>` object.
+
+        Parameters
+        ----------
+        session: tmlib.models.utils.ExperimentSession
+            database session
+        site_id: int
+            ID of the site
+
+        Returns
+        -------
+        tmserver.lookup.SiteGeometry
+        """
+        with self._lock:
+            geometry = self._geometries.get(site_id)
+        if geometry is None:
+            site = session.query(tm.Site).get(site_id)
+            geometry = SiteGeometry(
+                site.offset, site.image_size,
+                site.aligned_offset, site.aligned_image_size
+            )
+            with self._lock:
+                self._geometries[site_id] = geometry
+        return geometry
+
+
+_layouts = dict()
+_layouts_lock = threading.Lock()
+
+
+def get_layout(session, experiment_id, reload=False):
+    """Gets the index of an experiment, which is loaded if it is not yet
+    available or has expired.
+
+    Parameters
+    ----------
+    session: tmlib.models.utils.ExperimentSession
+        database session for the experiment
+    experiment_id: int
+        ID of the experiment
+    reload: bool, optional
+        whether the index should be reloaded (default: ``False``)
+
+    Returns
+    -------
+    tmserver.lookup.ExperimentLayout
+    """
+    with _layouts_lock:
+        layout = _layouts.get(experiment_id)
+    if layout is not None and not reload:
+        if time.time() - layout.created < LAYOUT_MAX_AGE:
+            return layout
+    logger.debug('load layout of experiment %d', experiment_id)
+    layout = ExperimentLayout.load(session)
+    with _layouts_lock:
+        _layouts[experiment_id] = layout
+    return layout
+
+
+def get_site_id(session, experiment_id, plate_name, well_name, well_pos_y,
+        well_pos_x):
+    """Resolves the position of a site to its ID. The index is reloaded once
+    when the site is unknown, since it may have been created in the meantime.
+
+    Parameters
+    ----------
+    session: tmlib.models.utils.ExperimentSession
+        database session for the experiment
+    experiment_id: int
+        ID of the experiment
+    plate_name: str
+        name of the plate
+    well_name: str
+        name of the well
+    well_pos_y: int
+        y-coordinate of the site within the well
+    well_pos_x: int
+        x-coordinate of the site within the well
+
+    Returns
+    -------
+    int
+        ID of the site
+
+    Raises
+    ------
+    tmserver.error.ResourceNotFoundError
+        when there is no such site
+    """
+    layout = get_layout(session, experiment_id)
+    site_id = layout.get_site_id(plate_name, well_name, well_pos_y, well_pos_x)
+    if site_id is None and time.time() - layout.created > _RELOAD_INTERVAL:
+        layout = get_layout(session, experiment_id, reload=True)
+        site_id = layout.get_site_id(
+            plate_name, well_name, well_pos_y, well_pos_x
+        )
+    if site_id is None:
+        raise ResourceNotFoundError(
+            tm.Site, plate_name=plate_name, well_name=well_name,
+            y=well_pos_y, x=well_pos_x
+        )
+    return site_id
+
+
+def invalidate_layout(experiment_id):
+    """Discards the index of an experiment.
+
+    Parameters
+    ----------
+    experiment_id: int
+        ID of the experiment
+    """
+    logger.debug('invalidate layout of experiment %d', experiment_id)
+    with _layouts_lock:
+        _layouts.pop(experiment_id, None)
@@ -0,0 +1,214 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Boolean expressions over features, such as
+``Morphology_Area > 500 and Intensity_mean < 0.2``, which select
+mapobjects based on their feature values.
+
+Expressions consist of comparisons of a feature with a number, which can be
+combined with ``and``, ``or`` and ``not`` and grouped with parentheses.
+Feature names that contain other characters than letters, digits, ``_``,
+``.`` and ``-`` must be quoted.
+"""
+import logging
+import operator
+import pyparsing as pp
+
+from sqlalchemy import and_, or_
+
+logger = logging.getLogger(__name__)
+
+#: int: maximal number of comparisons in an expression
+MAX_COMPARISONS = 32
+
+_OPERATORS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+_MIRRORED_OPERATORS = {
+    '<': '>', '<=': '>=', '>': '<', '>=': '<=',
+    '=': '=', '==': '==', '!=': '!='
+}
+
+_INVERTED_OPERATORS = {
+    '<': '>=', '<=': '>', '>': '<=', '>=': '<',
+    '=': '!=', '==': '!=', '!=': '='
+}
+
+
+class Comparison(object):
+
+    """Comparison of a feature with a number."""
+
+    def __init__(self, feature, op, value):
+        self.feature = feature
+        self.op = op
+        self.value = value
+
+    def __repr__(self):
+        return 'Comparison(%r, %r, %r)' % (self.feature, self.op, self.value)
+
+
+def _create_parser():
+    number = pp.Regex(r'[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?')
+    number.setParseAction(lambda t: float(t[0]))
+    name = pp.Word(pp.alphas + '_', pp.alphanums + '_.-') | \
+        pp.QuotedString('"', escChar='\\') | \
+        pp.QuotedString("'", escChar='\\')
+    op = pp.oneOf(' '.join(sorted(_OPERATORS.keys(), key=len, reverse=True)))
+
+    keyword = pp.CaselessKeyword('and') | pp.CaselessKeyword('or') | \
+        pp.CaselessKeyword('not')
+    feature = ~keyword + name
+
+    def to_comparison(t):
+        if isinstance(t[0], float):
+            return Comparison(t[2], _MIRRORED_OPERATORS[t[1]], t[0])
+        return Comparison(t[0], t[1], t[2])
+
+    comparison = (feature + op + number) | (number + op + feature)
+    comparison.setParseAction(to_comparison)
+
+    return pp.infixNotation(comparison, [
+        (pp.CaselessKeyword('not'), 1, pp.opAssoc.RIGHT),
+        (pp.CaselessKeyword('and'), 2, pp.opAssoc.LEFT),
+        (pp.CaselessKeyword('or'), 2, pp.opAssoc.LEFT),
+    ])
+
+
+_parser = _create_parser()
+
+
+def _to_tree(tokens):
+    if isinstance(tokens, Comparison):
+        return tokens
+    tokens = list(tokens)
+    if len(tokens) == 1:
+        return _to_tree(tokens[0])
+    if isinstance(tokens[0], basestring) and tokens[0].lower() == 'not':
+        return ('not', _to_tree(tokens[1]))
+    # Binary operators of the same precedence are grouped together:
+    # [a, "and", b, "and", c]
+    return (tokens[1].lower(), [_to_tree(t) for t in tokens[0::2]])
+
+
+def parse_predicate(expression):
+    """Parses a boolean expression over features.
+
+    Parameters
+    ----------
+    expression: str
+        expression, e.g. ``"Morphology_Area > 500 and Intensity_mean < 0.2"``
+
+    Returns
+    -------
+    tmserver.predicate.Comparison or tuple
+        parse tree, where inner nodes are tuples of an operator (``"and"``,
+        ``"or"`` or ``"not"``) and its operands
+
+    Raises
+    ------
+    ValueError
+        when the expression is invalid
+    """
+    try:
+        tokens = _parser.parseString(expression, parseAll=True)
+    except pp.ParseException as err:
+        raise ValueError(
+            'Invalid expression at position %d: %s' % (err.col, err.msg)
+        )
+    tree = _to_tree(tokens)
+    if len(get_feature_names(tree, unique=False)) > MAX_COMPARISONS:
+        raise ValueError(
+            'Expression must not have more than %d comparisons.'
+            % MAX_COMPARISONS
+        )
+    return tree
+
+
+def get_feature_names(tree, unique=True):
+    """Gets the names of features that are used in an expression.
+
+    Parameters
+    ----------
+    tree: tmserver.predicate.Comparison or tuple
+        parsed expression
+    unique: bool, optional
+        whether each name should only be returned once (default: ``True``)
+
+    Returns
+    -------
+    List[str]
+        names of features in the order of their occurrence
+    """
+    if isinstance(tree, Comparison):
+        names = [tree.feature]
+    elif tree[0] == 'not':
+        names = get_feature_names(tree[1], False)
+    else:
+        names = list()
+        for t in tree[1]:
+            names.extend(get_feature_names(t, False))
+    if unique:
+        names = sorted(set(names), key=names.index)
+    return names
+
+
+def compile_predicate(tree, columns, negate=False):
+    """Translates an expression into a SQL expression.
+
+    Parameters
+    ----------
+    tree: tmserver.predicate.Comparison or tuple
+        parsed expression
+    columns: Dict[str, sqlalchemy.sql.elements.ColumnElement]
+        numeric SQL expression for each feature name
+    negate: bool, optional
+        whether the negation of the expression should be translated
+        (default: ``False``)
+
+    Returns
+    -------
+    sqlalchemy.sql.elements.ColumnElement
+        boolean SQL expression
+
+    Note
+    ----
+    ``NaN`` values never satisfy a comparison. Unlike PostgreSQL, which
+    considers ``NaN`` larger than any number and equal to itself.
+    Missing values (``NULL``) don't satisfy a comparison either. This also
+    holds for negated comparisons: negations are pushed down to the
+    comparisons, such that ``not x > 1`` is translated to ``x <= 1``.
+    """
+    if isinstance(tree, Comparison):
+        column = columns[tree.feature]
+        op = _INVERTED_OPERATORS[tree.op] if negate else tree.op
+        return and_(
+            _OPERATORS[op](column, tree.value),
+            column != float('nan')
+        )
+    if tree[0] == 'not':
+        return compile_predicate(tree[1], columns, not negate)
+    operands = [compile_predicate(t, columns, negate) for t in tree[1]]
+    # De Morgan's laws
+    if (tree[0] == 'and') != negate:
+        return and_(*operands)
+    return or_(*operands)
@@ -0,0 +1,250 @@
+# TmServer - TissueMAPS server application.
+# Copyright (C) 2016  Markus D. Herrmann, University of Zurich and Robin Hafen
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""Processing of lightweight tool requests within the server.
+
+Tool requests are normally processed by a
+:class:`ToolJob <tmlib.tools.jobs.ToolJob>`, which only starts after the next
+poll of the background engine and the start-up of a cluster job. Tools can
+declare the estimated cost of a request via the ``__cost__`` attribute of
+their class, either as a number or as a static method that accepts the
+payload. Requests whose cost doesn't exceed
+:attr:`tool_fast_path_max_cost <tmserver.config.ServerConfig.tool_fast_path_max_cost>`
+are processed by a pool of worker processes forked from the server instead.
+
+The server waits for workers via :func:`select.select` on a pipe, which
+only blocks the current greenlet when the server runs with *gevent* monkey
+patching.
+"""
+import os
+import time
+import Queue
+import select
+import logging
+import traceback
+import threading
+import multiprocessing
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool
+
+from tmlib.tools import get_tool_class
+
+logger = logging.getLogger(__name__)
+
+#: int: maximal number of seconds a worker may take to process a request
+TIMEOUT = 60
+
+
+class ToolPoolError(Exception):
+
+    """Error that is raised when a worker failed to process a request."""
+
+
+@event.listens_for(Pool, 'connect')
+def _record_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(Pool, 'checkout')
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    # Workers inherit pooled connections of the server upon fork(). They must
+    # neither use nor close them, since the server may use them concurrently.
+    if connection_record.info.get('pid', os.getpid()) != os.getpid():
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            'Connection belongs to process %d.' % connection_record.info['pid']
+        )
+
+
+def get_tool_cost(tool_cls, payload):
+    """Gets the estimated cost of a tool request.
+
+    Parameters
+    ----------
+    tool_cls: type
+        tool class derived from :class:`Tool <tmlib.tools.base.Tool>`
+    payload: dict
+        request payload
+
+    Returns
+    -------
+    float
+        estimated cost or ``None`` if the tool doesn't declare it
+    """
+    cost = getattr(tool_cls, '__cost__', None)
+    if callable(cost):
+        try:
+            cost = cost(payload)
+        except Exception as err:
+            logger.warn(
+                'cost of request of tool "%s" could not be estimated: %s',
+                tool_cls.__name__, str(err)
+            )
+            return None
+    return cost
+
+
+def _process_request(experiment_id, tool_name, submission_id, payload):
+    tool_cls = get_tool_class(tool_name)
+    tool = tool_cls(experiment_id)
+    tool.process_request(submission_id, payload)
+
+
+def _serve(connection):
+    while True:
+        try:
+            args = connection.recv()
+        except EOFError:
+            break
+        try:
+            _process_request(*args)
+        except Exception:
+            connection.send(traceback.format_exc())
+        else:
+            connection.send(None)
+    # Don't run exit handlers inherited from the server.
+    os._exit(0)
+
+
+class _Worker(object):
+
+    def __init__(self):
+        self.connection, child_connection = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(
+            target=_serve, args=(child_connection, )
+        )
+        self.process.daemon = True
+        self.process.start()
+        child_connection.close()
+
+    def run(self, args, timeout):
+        self.connection.send(args)
+        readable, _, _ = select.select([self.connection], [], [], timeout)
+        if not readable:
+            raise ToolPoolError(
+                'Request was not processed within %s seconds.' % timeout
+            )
+        return self.connection.recv()
+
+    def terminate(self):
+        self.connection.close()
+        self.process.terminate()
+        self.process.join()
+
+
+class ToolPool(object):
+
+    """Bounded pool of worker processes that process tool requests."""
+
+    def __init__(self, max_workers, timeout=TIMEOUT):
+        """
+        Parameters
+        ----------
+        max_workers: int
+            maximal number of worker processes
+        timeout: int, optional
+            maximal number of seconds a worker may take to process a request
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._idle = Queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def run(self, experiment_id, tool_name, submission_id, payload,
+            timeout=None):
+        """Processes a tool request in a worker process and waits until the
+        result has been written to the database. Workers are started on
+        demand.
+
+        Parameters
+        ----------
+        experiment_id: int
+            ID of the experiment
+        tool_name: str
+            name of the tool
+        submission_id: int
+            ID of the submission of the request
+        payload: dict
+            request payload
+        timeout: int, optional
+            maximal number of seconds to wait for the worker
+            (default: :attr:`timeout`)
+
+        Raises
+        ------
+        tmserver.toolpool.ToolPoolError
+            when processing failed or didn't finish in time; the worker has
+            stopped processing the request in either case, but may have
+            written partial results
+
+        Note
+        ----
+        Workers that don't finish in time are killed.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        with self._slots:
+            try:
+                worker = self._idle.get_nowait()
+            except Queue.Empty:
+                logger.debug('start tool worker process')
+                worker = _Worker()
+            start = time.time()
+            try:
+                error = worker.run(
+                    (experiment_id, tool_name, submission_id, payload),
+                    timeout
+                )
+            except (EOFError, IOError, OSError) as err:
+                worker.terminate()
+                raise ToolPoolError('Worker process failed: %s' % str(err))
+            except:
+                # The worker may still be busy or may have died.
+                worker.terminate()
+                raise
+            self._idle.put(worker)
+        if error is not None:
+            raise ToolPoolError(error)
+        logger.info(
+            'processed request of tool "%s" in %.3f seconds',
+            tool_name, time.time() - start
+        )
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_tool_pool():
+    """Gets the tool pool configured for the server.
+
+    Returns
+    -------
+    tmserver.toolpool.ToolPool
+        pool or ``None`` if processing of tool requests within the server is
+        disabled
+
+    See also
+    --------
+    :attr:`tmserver.config.ServerConfig.tool_workers`
+    """
+    global _pool
+    from tmserver import cfg
+    if cfg.tool_workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ToolPool(cfg.tool_workers)
+    return _pool
@@ -62,6 +62,44 @@ def is_false(value):
     return value in {'False', 'false', 'FALSE', 'no', 0}
 
 
+def get_list_query_param(name, type=None):
+    """Gets the values of a query string parameter that may either be
+    provided repeatedly (``?name=a&name=b``) or as comma-separated list
+    (``?name=a,b``).
+
+    Parameters
+    ----------
+    name: str
+        name of the parameter
+    type: function, optional
+        function that converts each value, e.g. ``int``
+
+    Returns
+    -------
+    List
+        values in the order they were provided or ``None`` when the parameter
+        was not provided
+
+    Raises
+    ------
+    tmserver.error.MalformedRequestError
+        when a value cannot be converted
+    """
+    if name not in request.args:
+        return None
+    values = list()
+    for v in request.args.getlist(name):
+        values.extend([x.strip() for x in v.split(',') if x.strip()])
+    if type is not None:
+        try:
+            values = [type(v) for v in values]
+        except ValueError:
+            raise MalformedRequestError(
+                'Invalid value for query parameter "%s".' % name
+            )
+    return values
+
+
 def assert_query_params(*params):
     """A decorator for GET request functions that asserts that the
     query string contains the required parameters.